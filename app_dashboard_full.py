@@ -1,20 +1,55 @@
 # app_dashboard_full.py
 # Dashboard Flet con:
-# - Selección de archivo, consolidación multi-hoja
+# - Selección de uno o varios archivos, consolidación multi-hoja y multi-libro
 # - Filtro por SERVICIO: sólo "consulta externa" y "urgencia gral/gener(al)" (normalizado)
 # - Separa filas por persona + servicio_norm + fecha_evento (validación o creación)
-# - Vista previa con scroll horizontal y vertical
+# - Vista previa con scroll horizontal y vertical, ordenable y filtrable (servicio, fechas,
+#   sexo, mayor de 18, nombre, columnas con valor) sin reprocesar
 # - Exportación con barra de progreso
+# - Base SQLite local opcional: la vista previa y la exportación consultan el resultado
+#   guardado por páginas, y los resultados de otras sesiones se reabren sin reprocesar
+# - El pipeline vive en consolidador.py (también usable por lotes sin la interfaz)
+# - Arranque inmediato: el encabezado y las acciones se pintan primero; pandas y consolidador
+#   se cargan en segundo plano ("Procesar" se habilita al terminar). Con la variable de entorno
+#   REDLAB_TIEMPOS_INICIO=archivo.json se guardan los tiempos de arranque (TIEMPOS_INICIO)
 # Requisitos: pip install flet pandas openpyxl
 
 from __future__ import annotations
-import re, traceback
-from datetime import datetime
+import time
+_T0 = time.perf_counter()  # referencia de TIEMPOS_INICIO: lo más cerca posible del arranque
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import traceback
+from datetime import date, datetime
 from pathlib import Path
-import unicodedata
-import pandas as pd
 import flet as ft
 
+# ---------------- Arranque ----------------
+# Segundos desde _T0 hasta cada hito: flet (importado), ventana (encabezado y acciones
+# pintados), interfaz (vista previa armada), dependencias (pandas, numpy y consolidador
+# importados), listo ("Procesar" habilitado)
+TIEMPOS_INICIO: dict[str, float] = {}
+
+def marcar_inicio(hito: str) -> None:
+    TIEMPOS_INICIO.setdefault(hito, round(time.perf_counter() - _T0, 4))
+
+marcar_inicio("flet")
+
+# Dependencias pesadas: consolidador trae pandas, numpy, openpyxl y compila las tablas de
+# normalización al importarse. Se cargan con cargar_dependencias (en un hilo, desde main)
+C = np = pd = None
+
+def cargar_dependencias() -> None:
+    global C, np, pd
+    import numpy as np
+    import pandas as pd
+    import consolidador as C
+    C.lectores_disponibles()  # find_spec de los lectores opcionales, antes del primer diálogo
+    marcar_inicio("dependencias")
+
 # ---------------- Compat icons/colors ----------------
 try:
     ICONS = ft.icons
@@ -46,418 +81,84 @@ DANGER = tone("RED_600", "#DC2626")
 WHITE = tone("WHITE", "#FFFFFF")
 
 # --------- Config preview ---------
-MAX_ROWS_PREVIEW = 80
-MAX_COLS_PREVIEW = 20
+FILAS_POR_PAGINA = 50
+COLUMNAS_VISIBLES = 10        # columnas que se desplazan (además de las fijas)
+COLUMNAS_FIJAS_PREVIEW = 1    # id_trabajador siempre a la vista al desplazar columnas
+PAGINAS_EN_CACHE = 64         # ventanas de celdas ya truncadas que se conservan (LRU)
 TRUNCATE_CELL_CHARS = 120
+TODOS = "(todos)"             # opción de los filtros de lista que no filtra
 # ----------------------------------
 
-# ====================== NORMALIZACIÓN / SINÓNIMOS ======================
-def _unidecode_local(x: str) -> str:
-    return "".join(c for c in unicodedata.normalize("NFKD", str(x)) if not unicodedata.combining(c))
-
-def slug(s: str) -> str:
-    if s is None: return ""
-    s = _unidecode_local(str(s)).strip().lower()
-    s = "".join(ch if ch.isalnum() else "_" for ch in s)
-    return re.sub(r"_+", "_", s).strip("_")
-
-# ---- Estudio (manteniendo lo tuyo + añadidos) ----
-STUDY_SHORT = {
-    "QUIMICA SANGUINEA 6 ELEMENTOS": "QS6",
-    "QUIMICA SANGUINEA 3 ELEMENTOS" : "QS3",
-    "QUIMICA SANGUINEA 5 ELEMENTOS" : "QS5",
-    "GLUCOSA": "GLU",
-    "UREA":"UREA",
-    "CREATININA": "CREATININA",
-    "ACIDO URICO": "ACH",
-    "COLESTEROL": "COL",
-    "TRIGLICERIDOS": "TRIG",
-    "TASA DE FILTRACION GLOMERULAR":"TFG",
-    "QUIMICA SANGUINEA 4": "QS4",
-    "EXAMEN GENERAL DE ORINA": "EGO",
-    "BIOMETRIA HEMATICA": "BH",
-    "HEMOGLOBINA GLICOSILADA": "HbA1c",
-    "PERFIL DE LIPIDOS": "PL",
-
-    # AÑADIDOS (no quitan nada)
-    "QUIMICA SANGUINEA 6": "QS6",
-    "BIOQUIMICA SANGUINEA 6 ELEMENTOS": "QS6",
-    "EXAMEN GENERAL DE ORINA (EGO)": "EGO",
-    "ORINA EXAMEN GENERAL": "EGO",
-    "BIOMETRIA HEMATICA B4": "BH",
-}
-
-# ---- Prueba (manteniendo lo tuyo + añadidos) ----
-TEST_SYNONYMS = {
-    "glucosa":"Glucosa",
-    "creatinina serica":"Creatinina","creatinina":"Creatinina","creatinina sérica":"Creatinina",
-    "urea":"Urea",
-    "acido urico":"Ácido Úrico","ácido úrico":"Ácido Úrico",
-    "bun":"BUN","colesterol":"Colesterol",
-    "trigliceridos":"Triglicéridos","triglicéridos":"Triglicéridos",
-    "hemoglobina glicosilada":"Hemoglobina Glicosilada",
-    "tasa de filtracion glomerular":"Tasa de Filtración Glomerular",
-    "tasa de filtración glomerular":"Tasa de Filtración Glomerular",
-    "ph":"pH",
-    "proteinas":"Proteínas","proteínas":"Proteínas",
-    "nitrito":"Nitrito","nitritos":"Nitrito",
-    "hemoglobina":"Hemoglobina",
-
-    # AÑADIDOS
-    "proteinas totales": "Proteínas",
-    "proteina": "Proteínas",
-    "tfg": "Tasa de Filtración Glomerular",
-}
-
-# Aceptar ambos separadores en las llaves (en-dash y guion corto)
-SEP_KEYS = [" – ", " - "]
-def key_variants(study: str, test: str) -> list[str]:
-    return [f"{study}{sep}{test}" for sep in SEP_KEYS]
-
-# ===== Columnas finales (mismas cabeceras, agregadas variantes de llave) =====
-want = [
-    # Glucosa
-    ("Glucosa (EGO)", [
-        "EGO – Glucosa", "EGO - Glucosa",
-        "ORINA – Glucosa", "ORINA - Glucosa"
-    ]),
-    ("Glucosa (QS)", [
-        "QS6 – Glucosa", "QS6 - Glucosa",
-        "QS4 – Glucosa", "QS4 - Glucosa"
-    ]),
-
-    # Urea
-    ("Urea (Orina)", [
-        "EGO – Urea", "EGO - Urea",
-        "ORINA – Urea", "ORINA - Urea"
-    ]),
-    ("Urea (QS)", [
-        "QS6 – Urea", "QS6 - Urea",
-        "QS4 – Urea", "QS4 - Urea"
-    ]),
-
-    # Creatinina sérica (QS)
-    ("Creatinina sérica (QS)", [
-        "QS6 – Creatinina", "QS6 - Creatinina",
-        "QS4 – Creatinina", "QS4 - Creatinina"
-    ]),
-
-    # TFG (QS)
-    ("Tasa de filtración glomerular (QS)", [
-        "QS6 – Tasa de Filtración Glomerular", "QS6 - Tasa de Filtración Glomerular",
-        "QS4 – Tasa de Filtración Glomerular", "QS4 - Tasa de Filtración Glomerular",
-        "QS6 – TFG", "QS6 - TFG", "QS4 – TFG", "QS4 - TFG"
-    ]),
-
-    # Hemoglobina
-    ("Hemoglobina (Biometría Hemática)", [
-        "BH – Hemoglobina", "BH - Hemoglobina"
-    ]),
-    ("Hemoglobina (Sanguínea)", [
-        "QS6 – Hemoglobina", "QS6 - Hemoglobina",
-        "QS4 – Hemoglobina", "QS4 - Hemoglobina"
-    ]),
-
-    # HbA1c
-    ("Hemoglobina glicosilada", [
-        "HbA1c – Hemoglobina Glicosilada", "HbA1c - Hemoglobina Glicosilada",
-        "HEMOGLOBINA GLICOSILADA – Hemoglobina Glicosilada",
-        "HEMOGLOBINA GLICOSILADA - Hemoglobina Glicosilada"
-    ]),
-
-    # EGO: Proteínas y Nitritos
-    ("Proteínas (EGO)", [
-        "EGO – Proteínas", "EGO - Proteínas",
-        "ORINA – Proteínas", "ORINA - Proteínas"
-    ]),
-    ("Nitritos (EGO)", [
-        "EGO – Nitrito", "EGO - Nitrito",
-        "EGO – Nitritos", "EGO - Nitritos",
-        "ORINA – Nitrito", "ORINA - Nitrito",
-        "ORINA – Nitritos", "ORINA - Nitritos"
-    ]),
-
-    # pH (Sanguínea) — QS; si no existe, EGO como respaldo
-    ("pH (Sanguínea)", [
-        "QS6 – pH", "QS6 - pH",
-        "QS4 – pH", "QS4 - pH",
-        "EGO – pH", "EGO - pH"
-    ]),
-
-    # Hemoglobina en orina (EGO)
-    ("Hemoglobina (orina EGO)", [
-        "EGO – Hemoglobina", "EGO - Hemoglobina",
-        "ORINA – Hemoglobina", "ORINA - Hemoglobina"
-    ]),
-]
-
-# ====================== PIPELINE ======================
-def normalize_headers(cols: list[str]) -> list[str]:
-    syn = {
-        "nombres":"nombres","nombre":"nombres",
-        "apellidop":"apellido_paterno","apellido_p":"apellido_paterno",
-        "apellidom":"apellido_materno","apellido_m":"apellido_materno",
-        "sexo":"sexo",
-        "servicio":"servicio",
-        "fecnacimiento":"fecha_nacimiento","fecnacimien":"fecha_nacimiento",
-        "fec_nacimiento":"fecha_nacimiento","fecha_nac":"fecha_nacimiento",
-        "estudio":"estudio",
-        "prueba":"prueba","resultado":"resultado",
-        "rangoinferior":"rango_inferior","rangosuperior":"rango_superior",
-        "rangoalterno":"rango_alternativo","rangoaltern":"rango_alternativo",
-        "ide":"ide","nss":"nss","codigo":"codigo","loinc":"loinc","p_loinc":"p_loinc",
-        "fechacrea":"fecha_creacion","fechaval":"fecha_validacion","usrval":"usuario_validador",
-        "fecha":"fecha",  # por si viene una fecha genérica
-    }
-    return [syn.get(slug(c), slug(c)) for c in cols]
-
-def build_nombre(df: pd.DataFrame) -> pd.Series:
-    if "apellido_p" in df.columns and "apellido_m" in df.columns:
-        df = df.rename(columns={"apellido_p":"apellido_paterno","apellido_m":"apellido_materno"})
-    if {"nombres","apellido_paterno","apellido_materno"}.issubset(df.columns):
-        nombre = (
-            df["nombres"].fillna("").str.strip()+" "+
-            df["apellido_paterno"].fillna("").str.strip()+" "+
-            df["apellido_materno"].fillna("").str.strip()
-        ).str.replace(r"\s+"," ",regex=True).str.strip()
-    elif "nombres" in df.columns:
-        nombre = df["nombres"].fillna("").astype(str).str.strip()
-    else:
-        nombre = pd.Series([""]*len(df))
-    return nombre
-
-def parse_dob(s: str) -> str:
-    if s is None or s=="" or pd.isna(s): return ""
-    for fmt in ("%d/%m/%Y","%Y-%m-%d","%d-%m-%Y","%m/%d/%Y"):
-        try:
-            return datetime.strptime(str(s), fmt).strftime("%Y-%m-%d")
-        except Exception:
-            pass
-    try:
-        dt = pd.to_datetime(s, errors="coerce")
-        if pd.notna(dt): return dt.strftime("%Y-%m-%d")
-    except Exception:
-        pass
-    return ""
-
-def edad_from_iso(iso: str) -> int | None:
-    if not iso: return None
-    try:
-        dob = datetime.strptime(iso,"%Y-%m-%d")
-    except Exception:
-        return None
-    today = datetime.today()
-    return today.year - dob.year - ((today.month,today.day) < (dob.month,dob.day))
-
-def canon_study(study_raw: str) -> str:
-    if not study_raw: return ""
-    key = _unidecode_local(study_raw).strip().upper()
-    return STUDY_SHORT.get(key, study_raw.strip())
-
-def canon_test(test_raw: str) -> str:
-    if not test_raw: return ""
-    key = _unidecode_local(test_raw).strip().lower()
-    return TEST_SYNONYMS.get(key, test_raw.strip())
-
-def first_nonempty(series: pd.Series) -> str:
-    for v in series:
-        if pd.notna(v) and str(v).strip() != "":
-            return str(v)
-    return ""
-
-def normalize_servicio(s: str) -> str:
-    """
-    Normaliza 'servicio' y mapea variantes/abreviaturas/typos a categorías canónicas.
-    Queremos conservar SOLO:
-      - 'consulta externa'
-      - 'urgencia general'  (incluye: 'urg. gral', 'urg gral', 'urgencias general', 'urgenciasl general', etc.)
-    """
-    if s is None or (isinstance(s, float) and pd.isna(s)):
-        return ""
-
-    raw = _unidecode_local(str(s)).lower().strip()
-
-    # Normalización básica
-    raw = raw.replace(".", " ").replace("-", " ").replace("/", " ")
-    raw = re.sub(r"\s+", " ", raw)
-
-    # Corrección de typos frecuentes
-    raw = raw.replace("urgenciasl", "urgencias")   # 'urgenciasl general' -> 'urgencias general'
-    raw = raw.replace("urgenc", "urgencia")        # 'urgenc gral' -> 'urgencia gral'
-    raw = raw.replace("genral", "general")         # 'genral' -> 'general'
-    raw = raw.replace("grl", "gral")               # 'grl' -> 'gral'
-
-    # ====== DETECCIÓN CONSULTA EXTERNA ======
-    if (
-        re.search(r"\bconsulta\s*externa\b", raw)
-        or re.search(r"\bconsulta\s*ext(erna)?\b", raw)
-        or re.search(r"\bcons?(\s*)ext(\s*erna)?\b", raw)
-        or re.search(r"\bc(\s*)externa\b", raw)
-    ):
-        return "consulta externa"
-
-    # ====== DETECCIÓN URGENCIA GENERAL ======
-    has_urg = (
-        re.search(r"\burgencia(s)?\b", raw) is not None
-        or re.search(r"\burg\b", raw) is not None
-        or re.search(r"\burgs\b", raw) is not None
-        or re.search(r"\burg\w*\b", raw) is not None  # urg., urg-
-    )
-    has_general = (
-        re.search(r"\bgeneral\b", raw) is not None
-        or re.search(r"\bgral\b", raw) is not None
-    )
-
-    if has_urg and has_general:
-        return "urgencia general"
-
-    # Si sólo dice 'urgencia' / 'urgencias' sin 'general', lo tratamos como urgencia general
-    if re.search(r"\burgencia(s)?\b", raw):
-        return "urgencia general"
-
-    # Cualquier otro servicio queda tal cual (y luego será excluido por el filtro)
-    return raw
-
-
-def cargar_y_preparar_df(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df.columns = normalize_headers(list(df.columns))
-    # Asegurar columnas base
-    for col in ["nombres","apellido_paterno","apellido_materno","sexo","servicio",
-                "fecha_nacimiento","estudio","prueba","resultado",
-                "fecha_creacion","fecha_validacion","fecha"]:
-        if col not in df.columns:
-            df[col] = ""
-
-    # --- Filtro por SERVICIO (SOLO consulta externa y urgencia gral/general) ---
-    df["servicio_norm"] = df["servicio"].apply(normalize_servicio)
-    df = df[df["servicio_norm"].isin(["consulta externa", "urgencia general"])].copy()
-
-    # Si todo quedó vacío tras el filtro, devolvemos DataFrame vacío con las columnas requeridas
-    if df.empty:
-        cols = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
-        return pd.DataFrame(columns=cols)
-
-    # Datos de persona
-    df["nombre"] = build_nombre(df)
-    df["fecha_nacimiento"] = df["fecha_nacimiento"].apply(parse_dob)
-    df["edad"] = df["fecha_nacimiento"].apply(edad_from_iso)
-    df["mayor_18"] = df["edad"].apply(lambda e: "Sí" if e is not None and e >= 18 else "No")
-
-    # --- FECHA DEL EVENTO (clave para separar filas por distintas atenciones) ---
-    df["fecha_validacion"] = df["fecha_validacion"].apply(parse_dob)
-    df["fecha_creacion"] = df["fecha_creacion"].apply(parse_dob)
-    # Si existe una 'fecha' genérica, úsala si ambas anteriores están vacías
-    df["fecha"] = df["fecha"].apply(parse_dob)
-
-    # Preferir fecha_validacion > fecha_creacion > fecha
-    df["fecha_evento"] = df["fecha_validacion"]
-    df.loc[df["fecha_evento"] == "", "fecha_evento"] = df.loc[df["fecha_evento"] == "", "fecha_creacion"]
-    df.loc[df["fecha_evento"] == "", "fecha_evento"] = df.loc[df["fecha_evento"] == "", "fecha"]
-
-    # Canon estudio/prueba y llave
-    df["study_canon"] = df["estudio"].fillna("").apply(canon_study)
-    df["test_canon"] = df["prueba"].fillna("").apply(canon_test)
-    df["col_key"] = (df["study_canon"].fillna("").astype(str).str.strip()
-                     + df["test_canon"].apply(lambda s: " – "+s if str(s).strip()!="" else ""))
-
-    return df
-
-def pivot_por_persona_cols_estudio_prueba(df: pd.DataFrame) -> pd.DataFrame:
-    # INCLUYE fecha_evento en el índice
-    base_cols = ["fecha_nacimiento","nombre","sexo","edad","mayor_18","servicio_norm","fecha_evento"]
-    df_base = df[base_cols + ["col_key","resultado"]].copy()
-    if df_base.empty or (df_base["col_key"].replace("", pd.NA).isna().all() and df_base["resultado"].replace("", pd.NA).isna().all()):
-        return pd.DataFrame(columns=["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"])
-    pivot = (df_base
-             .pivot_table(index=base_cols, columns="col_key", values="resultado",
-                          aggfunc=first_nonempty, fill_value="")
-             .reset_index())
-    pivot = pivot.sort_values(["fecha_nacimiento","nombre","fecha_evento"]).reset_index(drop=True)
-    fixed = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
-    tests = [c for c in pivot.columns if c not in fixed]
-    pivot = pivot[fixed + sorted(tests, key=lambda x: x.lower())]
-    return pivot
-
-def pick_first(df: pd.DataFrame, cols: list[str]) -> pd.Series:
-    vals = []
-    for _, row in df.iterrows():
-        val = ""
-        for c in cols:
-            if c in df.columns:
-                v = row[c]
-                if v is not None and str(v).strip() != "":
-                    val = str(v)
-                    break
-        vals.append(val)
-    return pd.Series(vals, index=df.index)
-
-def reducir_a_columnas_solicitadas(df: pd.DataFrame) -> pd.DataFrame:
-    # df trae columnas "ESTUDIO – PRUEBA"
-    base_cols = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
-    if df.empty:
-        out = pd.DataFrame(columns=["id_trabajador"] + base_cols + [w[0] for w in want])
-        return out
-
-    out = df[base_cols].copy()
-    for new_name, candidates in want:
-        out[new_name] = pick_first(df, candidates)
-
-    # ID incremental
-    out.insert(0, "id_trabajador", range(1, len(out)+1))
-    return out
-
-def consolidar_todas_las_hojas(path_xlsx: str) -> pd.DataFrame:
-    xls = pd.ExcelFile(path_xlsx, engine="openpyxl")
-    tablas = []
-    for sheet in xls.sheet_names:
-        df_raw = pd.read_excel(xls, sheet_name=sheet, dtype=str, header=0)
-        df_base = cargar_y_preparar_df(df_raw)
-        tabla = pivot_por_persona_cols_estudio_prueba(df_base)
-        if not tabla.empty:
-            tablas.append(tabla)
-
-    if not tablas:
-        cols = ["id_trabajador","nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"] + [w[0] for w in want]
-        return pd.DataFrame(columns=cols)
-
-    unido = pd.concat(tablas, ignore_index=True, sort=True).fillna("")
-    # OJO: ya NO usamos consulta_externa en 'fixed'
-    fixed = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
-    for c in fixed:
-        if c not in unido.columns:
-            unido[c] = ""
-    agg_dict = {col: first_nonempty for col in unido.columns}
-    consolidado = (unido.groupby(fixed, dropna=False, as_index=False).agg(agg_dict))
-    final = reducir_a_columnas_solicitadas(consolidado)
-    return final
-
 # ---------------- UI helpers ----------------
 def truncate(s: str, n: int) -> str:
     if s is None: return ""
     s = str(s)
     return (s[: n-1] + "…") if len(s) > n else s
 
-def df_to_datatable(df: pd.DataFrame, max_rows: int = 100, max_cols: int | None = None) -> ft.DataTable:
-    if df is None or df.empty:
-        return ft.DataTable(columns=[ft.DataColumn(ft.Text("Sin datos"))], rows=[])
-    view = df.head(max_rows)
-    if max_cols is not None and max_cols > 0:
-        view = view.iloc[:, :max_cols]
-    view = view.applymap(lambda v: truncate("" if pd.isna(v) else v, TRUNCATE_CELL_CHARS))
-    columns = [ft.DataColumn(ft.Text(str(c))) for c in view.columns]
-    rows = [
-        ft.DataRow(cells=[ft.DataCell(ft.Text("" if pd.isna(v) else str(v))) for v in view.iloc[i]])
-        for i in range(len(view))
-    ]
-    return ft.DataTable(
-        columns=columns,
-        rows=rows,
-        heading_row_height=40,
-        data_row_min_height=36,
-        divider_thickness=0.6,
-        column_spacing=28,
-    )
+def texto_formatos_fecha(conteo: dict[str, dict[str, int]]) -> str:
+    """Una línea por columna de fecha con los formatos reconocidos (más frecuente primero)."""
+    lineas = []
+    for col, formatos in conteo.items():
+        usados = sorted(((n, fmt) for fmt, n in formatos.items() if n and fmt != "vacío"), reverse=True)
+        if usados:
+            lineas.append(f"{col}: " + ", ".join(f"{fmt} ({n})" for n, fmt in usados))
+    return "\n".join(lineas)
+
+def texto_tiempos(tiempos: dict[str, float]) -> str:
+    return "Tiempos: " + " · ".join(f"{etapa} {seg:.1f} s" for etapa, seg in tiempos.items())
+
+def texto_metricas(hojas: list[dict], mas_lentas: int = 3) -> str:
+    """Resumen de las métricas por hoja: filas en cada paso y las hojas que más tardaron."""
+    if not hojas:
+        return ""
+    suma = lambda k: sum(h.get(k, 0) for h in hojas)
+    lectores = ", ".join(dict.fromkeys(h["lector"] for h in hojas if "lector" in h))
+    lineas = [(f"Lector: {lectores} · " if lectores else "")
+              + f"Filas: {suma('filas_leidas'):,} leídas · {suma('filas_descartadas_servicio'):,} fuera de servicio · "
+                f"{suma('filas_pivote'):,} al pivote · {suma('filas_salida'):,} en las tablas por hoja"]
+    if suma("bytes_pivote"):
+        lineas.append(f"Entrada del pivote: {suma('bytes_pivote') / 2**20:.1f} MB "
+                      f"({suma('bytes_pivote_texto') / 2**20:.1f} MB sin categorías)")
+    lentas = sorted(hojas, key=lambda h: -sum(h["tiempos"].values()))[:mas_lentas]
+    varios_libros = len({h.get("libro") for h in hojas}) > 1
+    detalle = []
+    for h in lentas:
+        memoria = h.get("memoria_delta")
+        detalle.append(f"{h['libro'] + ' / ' if varios_libros else ''}{h['hoja']} {sum(h['tiempos'].values()):.1f} s, {h.get('llaves_distintas', 0)} llaves"
+                       + (f", {memoria / 2**20:+.0f} MB" if memoria is not None else ""))
+    lineas.append("Hojas más lentas: " + " · ".join(detalle))
+    return "\n".join(lineas)
+
+def texto_canonizacion(resumen: dict) -> str:
+    """Grafías de estudio/prueba canonizadas por parecido y las dudosas que quedaron sin aplicar."""
+    lineas = []
+    aplicadas = C.canonizaciones(resumen, "aplicada")
+    if aplicadas:
+        lineas.append("Canonizadas por parecido: " + " · ".join(
+            f"{c['valor']} → {c['canonico']}" for c in aplicadas))
+    revisar = C.canonizaciones(resumen, "revisar")
+    if revisar:
+        lineas.append("Por revisar (no aplicadas; agregar a STUDY_SHORT / TEST_SYNONYMS si corresponde): " + " · ".join(
+            f"{c['valor']} ≈ {c['sinonimo']} ({c['puntaje']:.2f})" for c in revisar))
+    return "\n".join(lineas)
+
+def nombre_reporte(paths: list[str]) -> str:
+    """Nombre base sugerido para el reporte (sin extensión) según los libros consolidados."""
+    if len(paths) == 1:
+        return f"{Path(paths[0]).stem}_REPORTE_UNICO"
+    return f"REPORTE_UNICO_{len(paths)}_LIBROS"
+
+def orden_por_columna(df: pd.DataFrame, col, ascendente: bool):
+    """Posiciones de fila ordenadas por `col` (estable: a igual valor, el orden del reporte)."""
+    return df[col].reset_index(drop=True).sort_values(ascending=ascendente, kind="stable").index.to_numpy()
+
+def textos_ventana(df: pd.DataFrame, filas, columnas: list[int]) -> list[list[str]]:
+    """Celdas truncadas sólo de la ventana visible (filas × columnas, por posición)."""
+    # Primero las filas: iloc[filas, columnas] copiaría las columnas completas
+    ventana = df.take(filas).iloc[:, columnas]
+    por_columna = [[truncate("" if pd.isna(v) else v, TRUNCATE_CELL_CHARS) for v in ventana.iloc[:, j].tolist()]
+                   for j in range(len(columnas))]
+    return [list(fila) for fila in zip(*por_columna)]
 
 # ============================ APP ============================
 def main(page: ft.Page):
@@ -466,6 +167,7 @@ def main(page: ft.Page):
     page.window_min_height = 760
     page.theme_mode = "light"
     page.bgcolor = SURFACE_ALT
+    carga = threading.Event()  # se activa al terminar cargar_dependencias (bien o con error)
 
     # HERO
     hero = ft.Container(
@@ -496,44 +198,38 @@ def main(page: ft.Page):
     )
 
     # Estado
-    selected_file = {"path": None}
-    df_result = {"df": None}
+    selected_files = {"paths": []}
+    # El resultado vive en memoria ("df") o en la base local ("base": id, nombre, filas, columnas)
+    df_result = {"df": None, "base": None}
+    proceso = {"cancelar": None}
+    ruta_base = None  # la de ruta_base_predeterminada, al terminar la carga
+    guardados: dict[str, dict] = {}
 
     # Controles
     btn_select = ft.ElevatedButton("Seleccionar Excel…")
-    btn_process = ft.FilledButton("Procesar")
-    btn_export = ft.OutlinedButton("Exportar a Excel", disabled=True)
+    btn_process = ft.FilledButton("Procesar", disabled=True)  # hasta que terminen de cargar las dependencias
+    btn_export = ft.OutlinedButton("Exportar…", disabled=True)
+    btn_cancel = ft.OutlinedButton("Cancelar", visible=False)
+    chk_paralelo = ft.Checkbox(label="Procesar hojas en paralelo", value=False)
+    chk_base = ft.Checkbox(label="Guardar resultados en la base local", value=False)
+    chk_disco = ft.Checkbox(label="Consolidar fuera de memoria (libros muy grandes)", value=False)
+    chk_canon = ft.Checkbox(label="Reconocer grafías parecidas de estudio/prueba", value=True)
+    dd_guardados = ft.Dropdown(label="Resultados guardados", options=[], dense=True, text_size=12)
+    btn_abrir = ft.OutlinedButton("Abrir guardado", disabled=True)
+    btn_borrar = ft.TextButton("Borrar guardado", disabled=True)
 
     file_info = ft.Text("Archivo: (ninguno)", size=12, color=TEXT_MUTED, selectable=True)
-    status_ok = ft.Text("Estado: esperando acción", size=12, color=TEXT_MUTED)
+    # Una fila por libro (con varios seleccionados): nombre, avance de sus hojas y estado
+    lista_libros = ft.Column([], spacing=6, visible=False)
+    estado_libros: dict[str, dict] = {}
+    status_ok = ft.Text("Estado: cargando componentes…", size=12, color=TEXT_MUTED)
     status_err = ft.Text("", size=12, color=DANGER)
+    status_info = ft.Text("", size=11, color=TEXT_MUTED, selectable=True)
 
     # Barra de progreso
     progress_bar = ft.ProgressBar(width=240, visible=False)
     progress_text = ft.Text("", size=12, color=TEXT_MUTED)
 
-    # PREVIEW con scroll H/V (compat)
-    table_holder_inner = ft.Row([], scroll=ft.ScrollMode.ALWAYS)  # HORIZONTAL
-    preview_panel = ft.Container(
-        bgcolor=WHITE,
-        border=ft.border.all(1, tone("GREY_200", "#E5E7EB")),
-        border_radius=16,
-        padding=16,
-        content=ft.Column(
-            [
-                ft.Text("Vista previa", size=16, weight=ft.FontWeight.W_700, color=TEXT),
-                ft.Text(
-                    f"Se muestran {MAX_ROWS_PREVIEW} filas y {MAX_COLS_PREVIEW} columnas (máx.) para fluidez.",
-                    size=12, color=TEXT_MUTED),
-                ft.Container(
-                    height=420,
-                    content=ft.Column([table_holder_inner], scroll=ft.ScrollMode.ALWAYS),  # VERTICAL
-                ),
-            ],
-            spacing=8,
-        ),
-    )
-
     # Panel acciones
     actions_panel = ft.Container(
         bgcolor=WHITE,
@@ -543,10 +239,11 @@ def main(page: ft.Page):
         content=ft.Column(
             [
                 ft.Text("Acciones", size=16, weight=ft.FontWeight.W_700, color=TEXT),
-                btn_select, btn_process, btn_export,
+                btn_select, btn_process, btn_export, btn_cancel, chk_paralelo, chk_disco, chk_canon, chk_base,
                 ft.Row([progress_bar, progress_text], spacing=10),
+                dd_guardados, ft.Row([btn_abrir, btn_borrar], spacing=6, wrap=True),
                 ft.Divider(),
-                file_info, status_ok, status_err,
+                file_info, lista_libros, status_ok, status_info, status_err,
             ],
             spacing=10,
         ),
@@ -561,86 +258,604 @@ def main(page: ft.Page):
         ),
     )
 
+    # Primer pintado: encabezado y acciones; la vista previa se arma después en su lugar
+    contenedor_preview = ft.Container(col={"xs": 12, "md": 8, "lg": 9})
+    page.add(
+        ft.Container(padding=12, content=hero),
+        ft.Container(
+            padding=16,
+            content=ft.ResponsiveRow(
+                controls=[
+                    ft.Container(actions_panel, col={"xs": 12, "md": 4, "lg": 3}),
+                    contenedor_preview,
+                ],
+                columns=12, spacing=16, run_spacing=16,
+            ),
+        ),
+        footer,
+    )
+    marcar_inicio("ventana")
+
+    # Las dependencias se importan mientras se arma el resto; al_cargar espera a que la
+    # interfaz esté completa (sus funciones se definen más abajo)
+    interfaz = threading.Event()
+
+    def cargar_en_segundo_plano():
+        try:
+            cargar_dependencias()
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        interfaz.wait()
+        al_cargar(error)
+
+    threading.Thread(target=cargar_en_segundo_plano, daemon=True).start()
+
+    # PREVIEW paginada: la tabla se arma una vez por resultado; paginar, desplazar columnas
+    # u ordenar sólo cambia el texto de sus celdas (Flet envía únicamente lo que cambió)
+    # Con un resultado de la base ("base" = id), cada página es una consulta LIMIT/OFFSET.
+    # En memoria, los filtros usan los índices de indices_filtro (se arman una vez por
+    # resultado): "filas" son las posiciones que pasan y "orden" las de la vista ordenada
+    vista = {"df": None, "base": None, "columnas": [], "total": 0, "total_sin_filtro": 0,
+             "indices": None, "filtros": {}, "filas": None, "ms_filtro": None,
+             "orden": None, "orden_por": None, "ordenes": {}, "paginas": {}, "pagina": 0,
+             "col0": COLUMNAS_FIJAS_PREVIEW}
+    tabla_preview = ft.DataTable(
+        columns=[ft.DataColumn(ft.Text("Sin datos"))],
+        rows=[],
+        heading_row_height=40,
+        data_row_min_height=36,
+        divider_thickness=0.6,
+        column_spacing=28,
+    )
+    texto_ventana = ft.Text("", size=12, color=TEXT_MUTED)
+
+    def lista_filtro(etiqueta: str, ancho: int) -> ft.Dropdown:
+        return ft.Dropdown(label=etiqueta, width=ancho, dense=True, text_size=12, options=[],
+                           on_change=lambda e: aplicar_filtros())
+
+    dd_f_servicio = lista_filtro("Servicio", 190)
+    dd_f_sexo = lista_filtro("Sexo", 110)
+    dd_f_mayor = lista_filtro("Mayor de 18", 130)
+    dd_f_valor = lista_filtro("Con valor en", 260)
+    tf_f_desde = ft.TextField(label="Evento desde", hint_text="AAAA-MM-DD", width=140, dense=True, text_size=12,
+                              on_submit=lambda e: aplicar_filtros(), on_blur=lambda e: aplicar_filtros())
+    tf_f_hasta = ft.TextField(label="Evento hasta", hint_text="AAAA-MM-DD", width=140, dense=True, text_size=12,
+                              on_submit=lambda e: aplicar_filtros(), on_blur=lambda e: aplicar_filtros())
+    tf_f_nombre = ft.TextField(label="Nombre empieza con", width=200, dense=True, text_size=12,
+                               on_change=lambda e: aplicar_filtros())
+    btn_limpiar = ft.TextButton("Limpiar filtros", on_click=lambda e: limpiar_filtros(aplicar=True))
+    fila_filtros = ft.Row([dd_f_servicio, tf_f_desde, tf_f_hasta, dd_f_sexo, dd_f_mayor, tf_f_nombre,
+                           dd_f_valor, btn_limpiar], spacing=8, wrap=True, disabled=True)
+    listas_filtro = {"servicio_norm": dd_f_servicio, "sexo": dd_f_sexo, "mayor_18": dd_f_mayor}
+
+    def boton_nav(icono: str, texto: str, tooltip: str, delta: int, eje: str):
+        if getattr(ICONS, icono, None):
+            boton = ft.IconButton(icon=getattr(ICONS, icono), tooltip=tooltip, disabled=True)
+        else:
+            boton = ft.TextButton(texto, tooltip=tooltip, disabled=True)
+        boton.on_click = lambda e: mover_vista(eje, delta)
+        return boton
+
+    btn_primera = boton_nav("FIRST_PAGE", "⏮", "Primera página", -10**9, "pagina")
+    btn_anterior = boton_nav("CHEVRON_LEFT", "◀", "Página anterior", -1, "pagina")
+    btn_siguiente = boton_nav("CHEVRON_RIGHT", "▶", "Página siguiente", 1, "pagina")
+    btn_ultima = boton_nav("LAST_PAGE", "⏭", "Última página", 10**9, "pagina")
+    btn_cols_izq = boton_nav("KEYBOARD_DOUBLE_ARROW_LEFT", "«", "Columnas anteriores", -COLUMNAS_VISIBLES, "col0")
+    btn_cols_der = boton_nav("KEYBOARD_DOUBLE_ARROW_RIGHT", "»", "Columnas siguientes", COLUMNAS_VISIBLES, "col0")
+
+    def columnas_visibles() -> list[int]:
+        ncols = len(vista["columnas"])
+        fijas = list(range(min(COLUMNAS_FIJAS_PREVIEW, ncols)))
+        return fijas + list(range(vista["col0"], min(vista["col0"] + COLUMNAS_VISIBLES, ncols)))
+
+    def limites_vista() -> tuple[int, int]:
+        """Última página y primera columna desplazable máxima."""
+        total, ncols = vista["total"], len(vista["columnas"])
+        return max(0, (total - 1) // FILAS_POR_PAGINA), max(COLUMNAS_FIJAS_PREVIEW, ncols - COLUMNAS_VISIBLES)
+
+    def pintar_vista():
+        total, ncols = vista["total"], len(vista["columnas"])
+        if not total:
+            for fila in tabla_preview.rows:
+                fila.visible = False
+            for b in (btn_primera, btn_anterior, btn_siguiente, btn_ultima, btn_cols_izq, btn_cols_der):
+                b.disabled = True
+            texto_ventana.value = f"Ninguna de las {vista['total_sin_filtro']:,} filas cumple los filtros."
+            page.update()
+            return
+        inicio = vista["pagina"] * FILAS_POR_PAGINA
+        fin = min(inicio + FILAS_POR_PAGINA, total)
+        columnas = columnas_visibles()
+        llave = (vista["orden_por"], vista["pagina"], vista["col0"])
+        textos = vista["paginas"].pop(llave, None)
+        if textos is None:
+            if vista["base"] is not None:
+                orden_por = vista["orden_por"]
+                ventana = C.consultar_base(ruta_base, vista["base"], vista["filtros"],
+                                         orden=vista["columnas"][orden_por[0]] if orden_por else None,
+                                         ascendente=orden_por[1] if orden_por else True,
+                                         limite=FILAS_POR_PAGINA, desplazamiento=inicio,
+                                         columnas=[vista["columnas"][c] for c in columnas])
+                textos = textos_ventana(ventana, list(range(len(ventana))), list(range(len(columnas))))
+            else:
+                filas = vista["orden"][inicio:fin] if vista["orden"] is not None else list(range(inicio, fin))
+                textos = textos_ventana(vista["df"], filas, columnas)
+            if len(vista["paginas"]) >= PAGINAS_EN_CACHE:
+                vista["paginas"].pop(next(iter(vista["paginas"])))
+        vista["paginas"][llave] = textos  # al final del dict: la más reciente
+        for columna, c in zip(tabla_preview.columns, columnas):
+            columna.label.value = str(vista["columnas"][c])
+        for i, fila in enumerate(tabla_preview.rows):
+            fila.visible = i < len(textos)
+            if fila.visible:
+                for celda, texto in zip(fila.cells, textos[i]):
+                    celda.content.value = texto
+        orden_por = vista["orden_por"]
+        tabla_preview.sort_column_index = (columnas.index(orden_por[0])
+                                           if orden_por and orden_por[0] in columnas else None)
+        tabla_preview.sort_ascending = orden_por[1] if orden_por else None
+        ultima, col_max = limites_vista()
+        btn_primera.disabled = btn_anterior.disabled = vista["pagina"] == 0
+        btn_siguiente.disabled = btn_ultima.disabled = vista["pagina"] >= ultima
+        btn_cols_izq.disabled = vista["col0"] <= COLUMNAS_FIJAS_PREVIEW
+        btn_cols_der.disabled = vista["col0"] >= col_max
+        texto_ventana.value = (f"Filas {inicio+1:,}–{fin:,} de {total:,}"
+                               + (f" (filtradas de {vista['total_sin_filtro']:,}, {vista['ms_filtro']:.1f} ms)"
+                                  if vista["filtros"] else "")
+                               + f" · página {vista['pagina']+1:,} de {ultima+1:,} · "
+                               f"columnas {columnas[0]+1}, {vista['col0']+1}–{columnas[-1]+1} de {ncols}")
+        page.update()
+
+    def aplicar_orden_y_filtro():
+        """Filas a mostrar (y su total) según el orden y los filtros vigentes; vuelve a la primera página."""
+        vista["pagina"] = 0
+        if vista["base"] is not None:  # la base filtra y ordena en la consulta de cada página
+            vista["total"] = (C.contar_base(ruta_base, vista["base"], vista["filtros"]) if vista["filtros"]
+                              else vista["total_sin_filtro"])
+            return
+        filas, clave = vista["filas"], vista["orden_por"]
+        orden = filas
+        if clave is not None:
+            if clave not in vista["ordenes"]:
+                vista["ordenes"][clave] = orden_por_columna(vista["df"], vista["df"].columns[clave[0]], clave[1])
+            orden = vista["ordenes"][clave]
+            if filas is not None:
+                elegidas = np.zeros(len(vista["df"]), dtype=bool)
+                elegidas[filas] = True
+                orden = orden[elegidas[orden]]
+        vista["orden"] = orden
+        vista["total"] = vista["total_sin_filtro"] if orden is None else len(orden)
+
+    def leer_filtros() -> dict | None:
+        """Filtros de los controles; None si alguna fecha no es válida (se marca en su campo)."""
+        filtros = {col: [dd.value] for col, dd in listas_filtro.items() if dd.value and dd.value != TODOS}
+        valido = True
+        for clave, campo in (("fecha_desde", tf_f_desde), ("fecha_hasta", tf_f_hasta)):
+            texto = (campo.value or "").strip()
+            campo.error_text = None
+            if texto:
+                try:
+                    filtros[clave] = date.fromisoformat(texto).isoformat()
+                except ValueError:
+                    campo.error_text = "AAAA-MM-DD"
+                    valido = False
+        if (tf_f_nombre.value or "").strip():
+            filtros["nombre"] = tf_f_nombre.value
+        if dd_f_valor.value and dd_f_valor.value != TODOS:
+            filtros["con_valor"] = [dd_f_valor.value]
+        return filtros if valido else None
+
+    def aplicar_filtros():
+        if not vista["total_sin_filtro"]:
+            return
+        filtros = leer_filtros()
+        if filtros is None or filtros == vista["filtros"]:
+            page.update()
+            return
+        t0 = time.perf_counter()
+        vista["filtros"] = filtros
+        if vista["base"] is None:
+            vista["filas"] = C.filtrar(vista["indices"], filtros)
+        vista["paginas"] = {}
+        aplicar_orden_y_filtro()
+        vista["ms_filtro"] = (time.perf_counter() - t0) * 1000
+        pintar_vista()
+
+    def limpiar_filtros(aplicar: bool = False):
+        for dd in (*listas_filtro.values(), dd_f_valor):
+            dd.value = TODOS if dd.options else None
+        for campo in (tf_f_desde, tf_f_hasta, tf_f_nombre):
+            campo.value = ""
+            campo.error_text = None
+        if aplicar:
+            aplicar_filtros()
+
+    def preparar_filtros(valores: dict[str, list]):
+        """Opciones de los filtros para el resultado mostrado (los valores presentes en él)."""
+        for col, dd in listas_filtro.items():
+            dd.options = [ft.dropdown.Option(TODOS)] + [ft.dropdown.Option(str(v)) for v in valores.get(col, [])]
+        dd_f_valor.options = [ft.dropdown.Option(TODOS)] + [ft.dropdown.Option(c) for c, _ in C.want
+                                                            if c in vista["columnas"]]
+        limpiar_filtros()
+        fila_filtros.disabled = not vista["total_sin_filtro"]
+
+    def mostrar_resultado(df: pd.DataFrame | None = None, base: dict | None = None):
+        """Muestra un resultado en memoria (`df`) o uno guardado en la base (`base`)."""
+        if df is not None:
+            columnas, total = list(df.columns), len(df)
+        else:
+            columnas, total = (base["columnas"], base["filas"]) if base else ([], 0)
+        vista.update(df=df, base=base["id"] if base else None, columnas=columnas, total=total,
+                     total_sin_filtro=total, filtros={}, filas=None, ms_filtro=None,
+                     indices=C.indices_filtro(df) if df is not None and total else None,
+                     orden=None, orden_por=None, ordenes={}, paginas={},
+                     pagina=0, col0=COLUMNAS_FIJAS_PREVIEW)
+        if vista["indices"] is not None:
+            preparar_filtros(C.valores_filtro(vista["indices"]))
+        elif base and total:
+            preparar_filtros(C.valores_filtro_base(ruta_base, base["id"]))
+        else:
+            preparar_filtros({})
+        if not total:
+            tabla_preview.columns = [ft.DataColumn(ft.Text("Sin datos"))]
+            tabla_preview.rows = []
+            tabla_preview.sort_column_index = None
+            texto_ventana.value = ""
+            for b in (btn_primera, btn_anterior, btn_siguiente, btn_ultima, btn_cols_izq, btn_cols_der):
+                b.disabled = True
+            return
+        n = len(columnas_visibles())
+        tabla_preview.columns = [ft.DataColumn(ft.Text(""), on_sort=on_ordenar) for _ in range(n)]
+        tabla_preview.rows = [ft.DataRow(cells=[ft.DataCell(ft.Text("")) for _ in range(n)])
+                              for _ in range(min(FILAS_POR_PAGINA, total))]
+        pintar_vista()
+
+    def mover_vista(eje: str, delta: int):
+        if not vista["total"]:
+            return
+        ultima, col_max = limites_vista()
+        minimo, maximo = (0, ultima) if eje == "pagina" else (COLUMNAS_FIJAS_PREVIEW, col_max)
+        vista[eje] = min(max(vista[eje] + delta, minimo), maximo)
+        pintar_vista()
+
+    def on_ordenar(e):
+        col = columnas_visibles()[e.column_index]
+        vista["orden_por"] = (col, bool(e.ascending))
+        aplicar_orden_y_filtro()
+        pintar_vista()
+
+    table_holder_inner = ft.Row([tabla_preview], scroll=ft.ScrollMode.ALWAYS)  # HORIZONTAL
+    preview_panel = ft.Container(
+        bgcolor=WHITE,
+        border=ft.border.all(1, tone("GREY_200", "#E5E7EB")),
+        border_radius=16,
+        padding=16,
+        content=ft.Column(
+            [
+                ft.Text("Vista previa", size=16, weight=ft.FontWeight.W_700, color=TEXT),
+                fila_filtros,
+                ft.Row([btn_primera, btn_anterior, btn_siguiente, btn_ultima, ft.VerticalDivider(width=12),
+                        btn_cols_izq, btn_cols_der, texto_ventana],
+                       spacing=2, vertical_alignment=ft.CrossAxisAlignment.CENTER, wrap=True),
+                ft.Container(
+                    height=420,
+                    content=ft.Column([table_holder_inner], scroll=ft.ScrollMode.ALWAYS),  # VERTICAL
+                ),
+            ],
+            spacing=8,
+        ),
+    )
+
     # File pickers
     fp_open = ft.FilePicker()
     fp_save = ft.FilePicker()
     page.overlay.extend([fp_open, fp_save])
 
+    def preparar_lista_libros(paths: list[str]):
+        estado_libros.clear()
+        lista_libros.controls.clear()
+        for path in paths:
+            barra = ft.ProgressBar(value=0, width=240)
+            texto = ft.Text("En espera", size=11, color=TEXT_MUTED)
+            estado_libros[path] = {"barra": barra, "texto": texto, "hojas_hechas": 0}
+            lista_libros.controls.append(ft.Column(
+                [ft.Text(Path(path).name, size=12, weight=ft.FontWeight.W_600, color=TEXT), barra, texto],
+                spacing=2))
+        lista_libros.visible = len(paths) > 1
+
     def on_file_selected(e: ft.FilePickerResultEvent):
         status_err.value = ""
         if e.files:
-            selected_file["path"] = e.files[0].path
-            file_info.value = f"Archivo: {selected_file['path']}"
+            selected_files["paths"] = list(dict.fromkeys(f.path for f in e.files))
+            paths = selected_files["paths"]
+            file_info.value = (f"Archivo: {paths[0]}" if len(paths) == 1 else
+                               f"Archivos ({len(paths)}): " + ", ".join(Path(p).name for p in paths))
+            preparar_lista_libros(paths)
             status_ok.value = "Listo para procesar."
             btn_export.disabled = True
-            df_result["df"] = None
-            table_holder_inner.controls = []
+            df_result.update(df=None, base=None)
+            status_info.value = ""
+            mostrar_resultado(None)
         page.update()
     fp_open.on_result = on_file_selected
 
-    def set_processing(is_on: bool, msg: str = ""):
+    def set_processing(is_on: bool, msg: str = "", cancelable: bool = False):
         btn_select.disabled = is_on
         btn_process.disabled = is_on
+        dd_guardados.disabled = is_on
+        btn_abrir.disabled = btn_borrar.disabled = is_on or not dd_guardados.value
         btn_export.disabled = True if is_on else btn_export.disabled
+        btn_cancel.visible = is_on and cancelable
+        btn_cancel.disabled = False
         progress_bar.visible = is_on
+        progress_bar.value = 0 if cancelable else None  # determinada sólo al procesar
         progress_text.value = msg if is_on else ""
         page.update()
 
     # -------- Procesar --------
     def do_select(e):
+        carga.wait()  # las extensiones legibles dependen de los lectores instalados
+        if C is None:
+            return
         fp_open.pick_files(
-            allow_multiple=False,
-            allowed_extensions=["xlsx", "xls"],
-            dialog_title="Selecciona el Excel con pestañas"
+            allow_multiple=True,
+            allowed_extensions=C.extensiones_legibles(),
+            dialog_title="Selecciona uno o varios Excel con pestañas"
         )
 
     def do_process(e):
         status_err.value = ""
-        if not selected_file["path"]:
+        if not selected_files["paths"]:
             status_err.value = "Primero selecciona un archivo Excel."
             page.update()
             return
-        try:
-            set_processing(True, "Procesando datos…")
-            status_ok.value = "Procesando…"
-
-            df_all = consolidar_todas_las_hojas(selected_file["path"])
-            df_result["df"] = df_all
+        procesos = (os.cpu_count() or 1) if chk_paralelo.value else None
+        proceso["cancelar"] = threading.Event()
+        set_processing(True, "Procesando datos…", cancelable=True)
+        status_ok.value = "Procesando…"
+        page.update()
+        # El proceso corre en un hilo para no congelar la ventana; la UI se actualiza con sus eventos
+        preparar_lista_libros(selected_files["paths"])
+        threading.Thread(target=procesar_en_segundo_plano,
+                         args=(list(selected_files["paths"]), procesos, proceso["cancelar"]),
+                         daemon=True).start()
+
+    def procesar_en_segundo_plano(paths: list[str], procesos: int | None, cancelar: threading.Event):
+        resumen = {}
+        avance = dict.fromkeys(paths, 0.0)  # fracción de hojas terminadas por libro
+
+        def on_progreso(ev: dict):
+            tipo = ev["evento"]
+            libro = estado_libros.get(ev.get("libro"))
+            prefijo = f"{Path(ev['libro']).name} · " if len(paths) > 1 and "libro" in ev else ""
+            if tipo == "libro":
+                libro["texto"].value = "Leyendo…"
+            elif tipo == "hoja":
+                progress_text.value = f"{prefijo}Hoja {ev['indice']+1}/{ev['total']}: {ev['hoja']}…"
+            elif tipo == "bloque":
+                texto = (f"Hoja {ev['indice']+1}/{ev['total']}: {ev['hoja']} — "
+                         f"{ev['filas_leidas']:,} filas leídas, {ev['filas_conservadas']:,} conservadas")
+                progress_text.value = prefijo + texto
+                libro["texto"].value = texto
+            elif tipo == "hoja_fin":
+                libro["hojas_hechas"] += 1
+                hechas = libro["hojas_hechas"]
+                avance[ev["libro"]] = libro["barra"].value = hechas / max(ev["total"], 1)
+                progress_bar.value = sum(avance.values()) / len(avance)
+                progress_text.value = (f"{prefijo}{hechas}/{ev['total']} hojas — {ev['hoja']}: "
+                                       f"{ev['filas_leidas']:,} leídas, {ev['filas_conservadas']:,} conservadas")
+                libro["texto"].value = f"{hechas}/{ev['total']} hojas"
+            elif tipo == "libro_fin":
+                avance[ev["libro"]] = libro["barra"].value = 1.0
+                progress_bar.value = sum(avance.values()) / len(avance)
+                if ev["error"]:
+                    libro["texto"].value = "Error: " + ev["error"].strip().splitlines()[-1]
+                    libro["texto"].color = DANGER
+                else:
+                    libro["texto"].value = (f"Listo: {ev['hojas']} hojas en {ev['segundos']:.1f} s"
+                                            + (f" · {ev['hojas_omitidas']} omitidas" if ev["hojas_omitidas"] else ""))
+            elif tipo == "consolidacion":
+                progress_text.value = f"Consolidado: {ev['filas']:,} filas"
+            elif tipo == "base":
+                progress_bar.value = ev["filas"] / max(ev["total"], 1)
+                progress_text.value = f"Guardando en la base local: {ev['filas']:,}/{ev['total']:,} filas"
+            page.update()
 
+        try:
+            df_all = C.consolidar_libros(paths, resumen, procesos=procesos,
+                                       progreso=on_progreso, cancelar=cancelar,
+                                       cache=C.directorio_cache_predeterminado(),
+                                       derrame=tempfile.gettempdir() if chk_disco.value else None,
+                                       canon_difusa=chk_canon.value)
+        except C.ProcesoCancelado:
             set_processing(False)
-            if df_all.empty:
-                status_ok.value = "Procesado: no se encontraron datos útiles (tras filtro por servicio)."
-                btn_export.disabled = True
-                table_holder_inner.controls = []
-            else:
-                total_rows, total_cols = df_all.shape
-                page.snack_bar = ft.SnackBar(ft.Text(f"Procesado: {total_rows} filas, {total_cols} columnas"), open=True)
-                status_ok.value = f"Procesado: {total_rows} filas. (Preview: {MAX_ROWS_PREVIEW} filas / {MAX_COLS_PREVIEW} columnas)"
-                btn_export.disabled = False
-                dt = df_to_datatable(df_all, max_rows=MAX_ROWS_PREVIEW, max_cols=MAX_COLS_PREVIEW)
-                table_holder_inner.controls = [dt]
+            status_ok.value = "Proceso cancelado; se conserva el resultado anterior."
+            page.update()
+            return
         except Exception:
             set_processing(False)
             status_err.value = "Error procesando:\n" + traceback.format_exc()
+            page.update()
+            return
+
+        # Guardado en la base: a partir de aquí la vista previa y la exportación la consultan
+        base, aviso_base = None, ""
+        if chk_base.value and not df_all.empty:
+            try:
+                id_base = C.guardar_en_base(df_all, ruta_base, nombre_reporte(paths), paths,
+                                          progreso=on_progreso, cancelar=cancelar)
+                base = {"id": id_base, "nombre": nombre_reporte(paths), "filas": len(df_all),
+                        "origenes": paths, "columnas": list(df_all.columns)}
+            except C.ProcesoCancelado:
+                aviso_base = "Guardado en la base cancelado; el resultado queda sólo en memoria."
+            except Exception:
+                aviso_base = "Error al guardar en la base local:\n" + traceback.format_exc()
+        df_result.update(df=None if base else df_all, base=base)
+        fusionados = resumen.get("grupos_fusionados", 0)
+        desde_cache = sum(bool(h.get("desde_cache")) for h in resumen.get("hojas", []))
+        status_info.value = "\n".join(t for t in (texto_tiempos(resumen["tiempos"]) if resumen.get("tiempos") else "",
+                                                  texto_metricas(resumen.get("hojas", [])),
+                                                  f"Personas/eventos presentes en más de una hoja: {fusionados:,}" if fusionados else "",
+                                                  f"Hojas leídas de la caché: {desde_cache}" if desde_cache else "",
+                                                  texto_canonizacion(resumen),
+                                                  texto_formatos_fecha(resumen.get("formatos_fecha", {}))) if t)
+        errores = []
+        fallidos = resumen.get("libros_fallidos", [])
+        if len(paths) == 1 and fallidos:
+            errores.append("Error procesando:\n" + fallidos[0]["error"])
+        elif fallidos:
+            errores.append("Libros omitidos por error:\n" + "\n".join(
+                f"- {Path(f['libro']).name}: {f['error'].strip().splitlines()[-1]}" for f in fallidos))
+        if resumen.get("errores"):
+            errores.append("Hojas omitidas por error:\n" + "\n".join(
+                f"- {Path(e['libro']).name + ' / ' if len(paths) > 1 else ''}{e['hoja']}: "
+                f"{e['error'].strip().splitlines()[-1]}" for e in resumen["errores"]))
+        if aviso_base:
+            errores.append(aviso_base)
+        status_err.value = "\n".join(errores)
+        set_processing(False)
+        if len(fallidos) == len(paths):
+            status_ok.value = "No se pudo procesar " + ("el libro." if len(paths) == 1 else "ningún libro.")
+            btn_export.disabled = True
+            mostrar_resultado(None)
+        elif df_all.empty:
+            status_ok.value = "Procesado: no se encontraron datos útiles (tras filtro por servicio)."
+            btn_export.disabled = True
+            mostrar_resultado(None)
+        else:
+            total_rows, total_cols = df_all.shape
+            page.snack_bar = ft.SnackBar(ft.Text(f"Procesado: {total_rows} filas, {total_cols} columnas"), open=True)
+            status_ok.value = f"Procesado: {total_rows} filas" + (
+                f" de {len(paths) - len(fallidos)}/{len(paths)} libros." if len(paths) > 1 else ".") + (
+                " Guardado en la base local." if base else "")
+            btn_export.disabled = False
+            if base:
+                refrescar_guardados(str(base["id"]))
+            mostrar_resultado(df_result["df"], base)
+        page.update()
+
+    def do_cancel(e):
+        if proceso["cancelar"] is not None:
+            proceso["cancelar"].set()
+            btn_cancel.disabled = True
+            progress_text.value = "Cancelando…"
+            page.update()
+
+    # -------- Base local --------
+    def refrescar_guardados(elegido: str | None = None):
+        try:
+            resultados = C.listar_resultados(ruta_base)
+        except Exception:
+            resultados = []
+            status_err.value = "No se pudo leer la base local:\n" + traceback.format_exc()
+        guardados.clear()
+        guardados.update((str(r["id"]), r) for r in resultados)
+        dd_guardados.options = [ft.dropdown.Option(key=k, text=f"{r['nombre']} · {r['creado'].replace('T', ' ')} · {r['filas']:,} filas")
+                                for k, r in guardados.items()]
+        dd_guardados.value = elegido if elegido in guardados else None
+        btn_abrir.disabled = btn_borrar.disabled = dd_guardados.value is None
+
+    def on_guardado_elegido(e):
+        btn_abrir.disabled = btn_borrar.disabled = not dd_guardados.value
         page.update()
 
+    def do_abrir(e):
+        r = guardados.get(dd_guardados.value or "")
+        if r is None:
+            return
+        status_err.value = ""
+        try:
+            base = {**r, "columnas": C.columnas_base(ruta_base, r["id"])}
+            df_result.update(df=None, base=base)
+            mostrar_resultado(base=base)
+        except Exception:
+            status_err.value = "No se pudo abrir el resultado guardado:\n" + traceback.format_exc()
+            page.update()
+            return
+        status_ok.value = f"Abierto de la base local: {r['nombre']} ({r['filas']:,} filas)."
+        status_info.value = "Libros de origen: " + ", ".join(Path(p).name for p in r["origenes"])
+        btn_export.disabled = not r["filas"]
+        page.update()
+
+    def do_borrar(e):
+        r = guardados.get(dd_guardados.value or "")
+        if r is None:
+            return
+        try:
+            C.borrar_resultado(ruta_base, r["id"])
+        except Exception:
+            status_err.value = "No se pudo borrar el resultado guardado:\n" + traceback.format_exc()
+            page.update()
+            return
+        if df_result["base"] and df_result["base"]["id"] == r["id"]:
+            df_result.update(df=None, base=None)
+            btn_export.disabled = True
+            mostrar_resultado(None)
+        status_ok.value = f"Borrado de la base local: {r['nombre']}."
+        refrescar_guardados()
+        page.update()
+
+    def hay_resultado() -> bool:
+        if df_result["base"] is not None:
+            return df_result["base"]["filas"] > 0
+        return df_result["df"] is not None and not df_result["df"].empty
+
+    def nombre_sugerido() -> str:
+        if df_result["base"] is not None:
+            return df_result["base"]["nombre"]
+        return nombre_reporte(selected_files["paths"])
+
     # -------- Exportar --------
     def perform_export(target_path: str):
+        # Sin extensión reconocida se exporta a Excel
+        if Path(target_path).suffix.lower().lstrip(".") not in C.formatos_exportacion_disponibles():
+            target_path = str(Path(target_path).with_suffix(".xlsx"))
+        proceso["cancelar"] = threading.Event()
+        set_processing(True, "Exportando…", cancelable=True)
+        threading.Thread(target=exportar_en_segundo_plano,
+                         args=(df_result["df"], df_result["base"], dict(vista["filtros"]), vista["filas"],
+                               target_path, proceso["cancelar"]),
+                         daemon=True).start()
+
+    def exportar_en_segundo_plano(df: pd.DataFrame | None, base: dict | None, filtros: dict, filas,
+                                  target_path: str, cancelar: threading.Event):
+        """Exporta la vista filtrada (todas las filas si no hay filtros), en el orden del reporte."""
+        def on_progreso(ev: dict):
+            progress_bar.value = ev["filas"] / max(ev["total"], 1)
+            progress_text.value = (f"Exportando a {ev['formato']}: {ev['filas']:,}/{ev['total']:,} filas "
+                                   f"({progress_bar.value:.0%})")
+            page.update()
+
         try:
-            set_processing(True, "Exportando a Excel…")
-            with pd.ExcelWriter(target_path, engine="openpyxl") as writer:
-                df_result["df"].to_excel(writer, sheet_name="REPORTE", index=False)
+            if base is not None:
+                escritas = C.exportar_desde_base(ruta_base, base["id"], target_path, filtros=filtros,
+                                               progreso=on_progreso, cancelar=cancelar)
+            else:
+                datos = df if filas is None else df.take(filas)
+                C.exportar(datos, target_path, progreso=on_progreso, cancelar=cancelar)
+                escritas = len(datos)
+        except C.ProcesoCancelado:
             set_processing(False)
-            status_ok.value = f"Exportado: {target_path}"
-            status_err.value = ""
-            page.snack_bar = ft.SnackBar(ft.Text("Archivo exportado correctamente."), open=True)
+            btn_export.disabled = False
+            status_ok.value = "Exportación cancelada; no se dejó archivo parcial."
+            page.update()
+            return
         except Exception:
             set_processing(False)
+            btn_export.disabled = False
             status_err.value = "Error al exportar:\n" + traceback.format_exc()
+            page.update()
+            return
+        set_processing(False)
+        btn_export.disabled = False
+        status_ok.value = f"Exportado: {target_path}" + (f" ({escritas:,} filas filtradas)" if filtros else "")
+        status_err.value = ""
+        page.snack_bar = ft.SnackBar(ft.Text("Archivo exportado correctamente."), open=True)
         page.update()
 
     def on_save_selected(e: ft.FilePickerResultEvent):
-        if df_result["df"] is None or df_result["df"].empty:
+        if not hay_resultado():
             status_err.value = "No hay datos para exportar."
             page.update()
             return
@@ -648,9 +863,10 @@ def main(page: ft.Page):
             perform_export(e.path)
             return
         try:
-            base = Path(selected_file["path"]).with_suffix("")
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            target = str(base.parent / f"{base.stem}_REPORTE_UNICO_{ts}.xlsx")
+            carpeta = (Path(df_result["base"]["origenes"][0]).parent if df_result["base"] is not None
+                       else Path(selected_files["paths"][0]).parent)
+            target = str(carpeta / f"{nombre_sugerido()}_{ts}.xlsx")
         except Exception:
             target = f"REPORTE_UNICO_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         perform_export(target)
@@ -658,44 +874,61 @@ def main(page: ft.Page):
     fp_save.on_result = on_save_selected
 
     def do_export(e):
-        if df_result["df"] is None or df_result["df"].empty:
+        if not hay_resultado():
             status_err.value = "No hay datos para exportar."
             page.update()
             return
         try:
-            base = Path(selected_file["path"]).with_suffix("")
-            suggested = f"{base.stem}_REPORTE_UNICO.xlsx"
+            suggested = f"{nombre_sugerido()}.xlsx"
         except Exception:
             suggested = "REPORTE_UNICO.xlsx"
         # Compatibilidad Flet antiguo
         try:
-            fp_save.save_file(file_name=suggested)
+            fp_save.save_file(file_name=suggested, allowed_extensions=C.formatos_exportacion_disponibles())
         except TypeError:
             try:
                 fp_save.save_file()
             except Exception:
                 on_save_selected(ft.FilePickerResultEvent(path=None, files=None, file_name=None, action=None))
 
+    # -------- Arranque --------
+    def al_cargar(error: str | None):
+        """Fin de la carga en segundo plano: habilita el proceso y lista los resultados guardados."""
+        nonlocal ruta_base
+        if error is None:
+            ruta_base = C.ruta_base_predeterminada()
+            refrescar_guardados()
+            btn_process.disabled = False
+            status_ok.value = "Estado: esperando acción"
+            marcar_inicio("listo")
+            status_info.value = (f"Inicio: ventana en {TIEMPOS_INICIO['ventana']:.2f} s · "
+                                 f"listo en {TIEMPOS_INICIO['listo']:.2f} s")
+        else:
+            status_ok.value = "Estado: no se pudieron cargar los componentes"
+            status_err.value = "Error al cargar pandas/consolidador:\n" + error
+        carga.set()
+        page.update()
+        destino = os.environ.get("REDLAB_TIEMPOS_INICIO")
+        if destino:
+            try:
+                Path(destino).write_text(json.dumps(TIEMPOS_INICIO, indent=2), encoding="utf-8")
+            except OSError:
+                pass
+
     # Vincular
     btn_select.on_click = do_select
     btn_process.on_click = do_process
     btn_export.on_click = do_export
+    btn_cancel.on_click = do_cancel
+    btn_abrir.on_click = do_abrir
+    btn_borrar.on_click = do_borrar
+    dd_guardados.on_change = on_guardado_elegido
 
-    # Layout
-    page.add(
-        ft.Container(padding=12, content=hero),
-        ft.Container(
-            padding=16,
-            content=ft.ResponsiveRow(
-                controls=[
-                    ft.Container(actions_panel, col={"xs": 12, "md": 4, "lg": 3}),
-                    ft.Container(preview_panel, col={"xs": 12, "md": 8, "lg": 9}),
-                ],
-                columns=12, spacing=16, run_spacing=16,
-            ),
-        ),
-        footer,
-    )
+    contenedor_preview.content = preview_panel
+    page.update()
+    marcar_inicio("interfaz")
+    interfaz.set()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # necesario para el pool de procesos en el ejecutable empaquetado
     ft.app(target=main)
@@ -0,0 +1,414 @@
+# benchmark.py
+# Mediciones del pipeline de consolidador.py sobre libros sintéticos (o uno real):
+# - Generador de libros de laboratorio configurable (hojas, filas, pacientes, variantes
+#   de servicio, formatos de fecha, proporción de pruebas solicitadas en `want`)
+# - Tiempo por etapa (el que mide el propio pipeline) y pico de memoria; resultados en JSON
+#   para comparar corridas:
+#     python benchmark.py --filas 50000 -o antes.json
+#     python benchmark.py --filas 50000 -o despues.json --comparar antes.json
+# - Arranque de la app (importar app_dashboard_full y cargar sus dependencias), si flet está instalado
+# Requisitos: pip install pandas openpyxl
+
+from __future__ import annotations
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import openpyxl
+from openpyxl import Workbook
+
+import consolidador as C
+
+VERSION_RESULTADOS = 1
+
+# ====================== GENERADOR DE LIBROS ======================
+# Servicios como los escriben los LIS: los canónicos, variantes/typos que normalize_servicio
+# reconoce y servicios que el filtro descarta.
+SERVICIOS_CANONICOS = ["CONSULTA EXTERNA", "URGENCIAS GENERAL"]
+SERVICIOS_VARIANTES = ["Consulta Ext.", "C. EXTERNA", "cons ext", "consulta   externa ", "CONSULTA EXT",
+                       "Urg. Gral", "urg gral", "urgenciasl general", "Urgenc gral", "urg-grl",
+                       "genral urg", "URGENCIAS GRAL", "URG. GRAL."]
+SERVICIOS_OTROS = ["HOSPITALIZACION", "UCI", "PEDIATRIA", "GINECOLOGIA", "QUIROFANO", None, ""]
+
+# Formatos en que llegan las fechas, del más al menos común ("excel" = fecha nativa de la celda)
+FORMATOS_FECHA_SINTETICOS = ("excel", "%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%Y-%m-%d %H:%M:%S",
+                             "%m/%d/%Y", "%d/%m/%y")
+FECHAS_INVALIDAS = ("", "no sé", "00/00/0000", "pendiente")
+
+CABECERA_SINTETICA = ["FOLIO", "NOMBRES", "APELLIDOP", "APELLIDOM", "SEXO", "SERVICIO", "FECNACIMIENTO",
+                      "ESTUDIO", "PRUEBA", "RESULTADO", "FECHACREA", "FECHAVAL", "USRVAL"]
+_NOMBRES = ["ANA", "LUIS", "MARIA", "JOSE", "JUAN", "ROSA", "CARLOS", "ELENA", "PEDRO", "SOFIA",
+            "MIGUEL", "LAURA", "JORGE", "CARMEN", "RAUL", "PATRICIA"]
+_APELLIDOS = ["PEREZ", "LOPEZ", "GARCIA", "HERNANDEZ", "MARTINEZ", "GONZALEZ", "RODRIGUEZ", "SANCHEZ",
+              "RAMIREZ", "CRUZ", "FLORES", "GOMEZ", "MORALES", "REYES", "JIMENEZ", "TORRES", "RUIZ", None]
+# Pruebas que no alimentan ninguna columna de `want`
+_OTRAS_PRUEBAS = [("PERFIL DE LIPIDOS", "Colesterol"), ("PERFIL DE LIPIDOS", "Triglicéridos"),
+                  ("BIOMETRIA HEMATICA", "Leucocitos"), ("BIOMETRIA HEMATICA", "Plaquetas"),
+                  ("EXAMEN GENERAL DE ORINA", "Color"), ("EXAMEN GENERAL DE ORINA", "Densidad"),
+                  ("QUIMICA SANGUINEA 6 ELEMENTOS", "Colesterol"), ("TIEMPOS DE COAGULACION", "TP"),
+                  ("ELECTROLITOS SERICOS", "Sodio"), ("ELECTROLITOS SERICOS", "Potasio")]
+
+def _llave_canonica(estudio: str, prueba: str) -> str:
+    test = C.canon_test(prueba)
+    return C.canon_study(estudio).strip() + (" – " + test if test.strip() else "")
+
+def pares_want() -> list[tuple[str, str]]:
+    """(estudio, prueba) crudos, con sus sinónimos, cuya llave canónica pide `want`."""
+    estudios: dict[str, list[str]] = {}
+    for crudo, corto in C.STUDY_SHORT.items():
+        estudios.setdefault(corto, []).append(crudo)
+    pruebas: dict[str, list[str]] = {}
+    for crudo, canon in C.TEST_SYNONYMS.items():
+        pruebas.setdefault(canon, []).append(crudo)
+    pares = set()
+    for llave in C.LLAVES_WANT:
+        sep = next(s for s in C.SEP_KEYS if s in llave)
+        estudio, prueba = llave.split(sep, 1)
+        for e in estudios.get(estudio, []) + [estudio]:
+            for p in pruebas.get(prueba, []) + [prueba]:
+                if _llave_canonica(e, p) in C.LLAVES_WANT:
+                    pares.add((e, p))
+    return sorted(pares)
+
+def _texto_fecha(r: random.Random, d: date, formatos: tuple[str, ...], invalidas: float):
+    if r.random() < invalidas:
+        return r.choice(FECHAS_INVALIDAS)
+    fmt = r.choice(formatos)
+    return datetime(d.year, d.month, d.day) if fmt == "excel" else d.strftime(fmt)
+
+def _resultado(r: random.Random) -> str:
+    k = r.random()
+    if k < 0.05:
+        return ""
+    if k < 0.15:
+        return r.choice(["NEGATIVO", "POSITIVO", "TRAZAS", "NO SE OBSERVAN"])
+    return f"{r.uniform(0.1, 250):.1f}"
+
+def filas_hoja(r: random.Random, filas: int, pacientes: list[tuple], servicios_validos: float,
+               variantes_servicio: float, formatos: tuple[str, ...], fechas_invalidas: float,
+               prop_want: float, con_want: list[tuple[str, str]]):
+    """Filas de una hoja: eventos (persona, servicio, fecha) con 3–12 pruebas cada uno."""
+    escritas, folio = 0, r.randrange(10**6)
+    while escritas < filas:
+        nombres, ap, am, sexo, nacimiento = r.choice(pacientes)
+        if r.random() < servicios_validos:
+            servicio = r.choice(SERVICIOS_VARIANTES if r.random() < variantes_servicio else SERVICIOS_CANONICOS)
+        else:
+            servicio = r.choice(SERVICIOS_OTROS)
+        evento = date(2022, 1, 1) + timedelta(days=r.randrange(3 * 365))
+        validacion = _texto_fecha(r, evento, formatos, fechas_invalidas) if r.random() < 0.9 else None
+        creacion = _texto_fecha(r, evento, formatos, fechas_invalidas)
+        dob = _texto_fecha(r, nacimiento, formatos, fechas_invalidas)
+        folio += 1
+        for _ in range(min(r.randint(3, 12), filas - escritas)):
+            estudio, prueba = r.choice(con_want) if r.random() < prop_want else r.choice(_OTRAS_PRUEBAS)
+            if r.random() < 0.2:
+                prueba = prueba.upper()
+            yield [folio, nombres, ap, am, sexo, servicio, dob, estudio, prueba, _resultado(r),
+                   creacion, validacion, "QFB"]
+            escritas += 1
+
+def generar_libro(ruta: str | os.PathLike, hojas: int = 4, filas: int = 20_000, pacientes: int = 2_000,
+                  servicios_validos: float = 0.6, variantes_servicio: float = 0.3,
+                  formatos_fecha: int = 4, fechas_invalidas: float = 0.01,
+                  prop_want: float = 0.6, semilla: int = 0) -> Path:
+    """
+    Escribe un libro sintético con `hojas` hojas de `filas` filas cada una.
+    - servicios_validos: fracción de filas de consulta externa / urgencia general
+    - variantes_servicio: de ésas, fracción escrita con abreviaturas o typos
+    - formatos_fecha: cuántos de FORMATOS_FECHA_SINTETICOS se mezclan (1 = sólo fechas nativas)
+    - fechas_invalidas: fracción de fechas vacías o ilegibles
+    - prop_want: fracción de pruebas que alimentan alguna columna de `want`
+    El mismo juego de parámetros y semilla produce el mismo contenido.
+    """
+    r = random.Random(semilla)
+    formatos = FORMATOS_FECHA_SINTETICOS[:max(1, min(formatos_fecha, len(FORMATOS_FECHA_SINTETICOS)))]
+    personas = [(r.choice(_NOMBRES) + (" " + r.choice(_NOMBRES) if r.random() < 0.3 else ""),
+                 r.choice(_APELLIDOS[:-1]), r.choice(_APELLIDOS), r.choice(["F", "M", "F", "M", None]),
+                 date(1935, 1, 1) + timedelta(days=r.randrange(85 * 365)))
+                for _ in range(max(pacientes, 1))]
+    con_want = pares_want()
+    ruta = Path(ruta)
+    wb = Workbook(write_only=True)
+    for i in range(hojas):
+        ws = wb.create_sheet(f"Clínica {i + 1}")
+        ws.append(CABECERA_SINTETICA)
+        for fila in filas_hoja(r, filas, personas, servicios_validos, variantes_servicio, formatos,
+                               fechas_invalidas, prop_want, con_want):
+            ws.append(fila)
+    temporal = ruta.with_name(ruta.name + ".tmp")
+    wb.save(temporal)
+    os.replace(temporal, ruta)
+    return ruta
+
+def libro_sintetico(directorio: Path, **parametros) -> Path:
+    """Ruta del libro generado con `parametros`; se reutiliza si ya existe."""
+    huella = hashlib.sha256(json.dumps(parametros, sort_keys=True).encode()).hexdigest()[:12]
+    ruta = directorio / f"sintetico_{huella}.xlsx"
+    if not ruta.exists():
+        directorio.mkdir(parents=True, exist_ok=True)
+        generar_libro(ruta, **parametros)
+    return ruta
+
+# ====================== MEDICIÓN ======================
+# Etapas de resumen["tiempos"] (las de cada hoja y las de la fusión) y su nombre en los resultados
+ETAPAS_RESUMEN = {"lectura": "lectura", "servicio": "servicio", "preparación": "normalizacion",
+                  "fechas": "fechas", "pivote": "pivote", "consolidación": "consolidacion",
+                  "reducción": "reduccion"}
+
+@contextmanager
+def _etapa(nombre: str, segundos: dict[str, float], picos: dict[str, int] | None):
+    if picos is not None:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos[nombre] = segundos.get(nombre, 0.0) + time.perf_counter() - t0
+        if picos is not None:
+            picos[nombre] = max(picos.get(nombre, 0), tracemalloc.get_traced_memory()[1] - base)
+
+def medir_pipeline(path: str, fecha_ref: date, procesos: int | None,
+                   lector: str | None = None, resumen: dict | None = None) -> tuple[float, pd.DataFrame]:
+    """consolidar_todas_las_hojas de punta a punta, sin caché; `resumen` recibe sus métricas."""
+    C.limpiar_memo_servicio()  # cada corrida empieza en frío, como el CLI
+    t0 = time.perf_counter()
+    final = C.consolidar_todas_las_hojas(path, {} if resumen is None else resumen,
+                                         fecha_ref=fecha_ref, procesos=procesos, lector=lector)
+    return time.perf_counter() - t0, final
+
+def medir_etapas(path: str, fecha_ref: date, formatos: list[str], directorio: Path,
+                 memoria: bool = False, lector: str | None = None) -> tuple[dict[str, float], dict[str, int] | None, dict[str, int], pd.DataFrame]:
+    """
+    Corrida secuencial de consolidar_todas_las_hojas y exportación del reporte a cada
+    formato; devuelve (segundos, bytes pico, filas, reporte). Los segundos por etapa son
+    los que el pipeline acumula en resumen["tiempos"] (ETAPAS_RESUMEN); "secuencial" es
+    la corrida completa. Con `memoria`, los picos salen de tracemalloc (por encima de lo
+    ya asignado al empezar): uno para la corrida y uno por exportación; tracemalloc hace
+    lento el código, así que esa corrida va aparte.
+    """
+    segundos: dict[str, float] = {}
+    picos = {} if memoria else None
+    if memoria:
+        tracemalloc.start()
+    try:
+        resumen: dict = {}
+        with _etapa("secuencial", segundos, picos):
+            final = medir_pipeline(path, fecha_ref, None, lector, resumen)[1]
+        for etapa, nombre in ETAPAS_RESUMEN.items():
+            segundos[nombre] = resumen.get("tiempos", {}).get(etapa, 0.0)
+        hojas = resumen.get("hojas", [])
+        filas = {"leidas": sum(h.get("filas_leidas", 0) for h in hojas),
+                 "conservadas": sum(h.get("filas_conservadas", 0) for h in hojas),
+                 "pivote": sum(h.get("filas_salida", 0) for h in hojas),
+                 "reporte": len(final)}
+
+        for formato in formatos:
+            destino = directorio / f"reporte.{formato}"
+            with _etapa(f"exportacion_{formato}", segundos, picos):
+                C.exportar(final, destino, formato)
+            filas[f"bytes_{formato}"] = destino.stat().st_size
+            destino.unlink()
+    finally:
+        if memoria:
+            tracemalloc.stop()
+    return segundos, picos, filas, final
+
+def pico_rss_mb() -> float | None:
+    """Pico de memoria residente del proceso (no disponible en Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (2**20 if sys.platform == "darwin" else 2**10), 1)  # bytes en macOS, KiB en Linux
+
+def _git(*args: str) -> str | None:
+    try:
+        salida = subprocess.run(["git", *args], cwd=Path(__file__).resolve().parent,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return salida.stdout.strip() if salida.returncode == 0 else None
+
+def entorno() -> dict:
+    cambios = _git("status", "--porcelain", "--untracked-files=no")
+    return {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+            "openpyxl": openpyxl.__version__, "plataforma": platform.platform(),
+            "cpus": os.cpu_count(), "commit": _git("rev-parse", "--short", "HEAD"),
+            "cambios_sin_commit": bool(cambios) if cambios is not None else None}
+
+def _estadisticas(valores: list[float]) -> dict:
+    return {"segundos": [round(v, 4) for v in valores], "mediana": round(statistics.median(valores), 4),
+            "minimo": round(min(valores), 4)}
+
+def correr(path: str, repeticiones: int, fecha_ref: date, formatos: list[str],
+           procesos: int | None, memoria: bool, lector: str | None = None) -> dict:
+    """Repite las mediciones y arma el dict de resultados (lo que se guarda en JSON)."""
+    tiempos: dict[str, list[float]] = {}
+    with tempfile.TemporaryDirectory(prefix="redlab_benchmark_") as tmp:
+        for _ in range(repeticiones):
+            segundos, _, filas, secuencial = medir_etapas(path, fecha_ref, formatos, Path(tmp), lector=lector)
+            for nombre, seg in segundos.items():
+                tiempos.setdefault(nombre, []).append(seg)
+            seg, final = medir_pipeline(path, fecha_ref, procesos, lector)
+            tiempos.setdefault("pipeline", []).append(seg)
+        picos = medir_etapas(path, fecha_ref, formatos, Path(tmp), memoria=True, lector=lector)[1] if memoria else {}
+    try:
+        pd.testing.assert_frame_equal(secuencial.reset_index(drop=True), final.reset_index(drop=True))
+        coincide = True
+    except AssertionError:
+        coincide = False
+    etapas = {}
+    for nombre, valores in tiempos.items():
+        etapas[nombre] = _estadisticas(valores)
+        if nombre in picos:
+            etapas[nombre]["pico_mb"] = round(picos[nombre] / 2**20, 1)
+    return {"version": VERSION_RESULTADOS, "fecha": datetime.now().isoformat(timespec="seconds"),
+            "entorno": entorno(), "repeticiones": repeticiones, "procesos": procesos,
+            "fecha_ref": fecha_ref.isoformat(), "lector": C.elegir_lector(path, lector), "etapas": etapas, "filas": filas,
+            "pico_rss_mb": pico_rss_mb(), "coincide_con_pipeline": coincide}
+
+# ====================== ARRANQUE DE LA APP ======================
+# En un intérprete nuevo cada vez: importar app_dashboard_full (lo que precede al primer
+# pintado) y después cargar_dependencias (lo que la app hace en segundo plano)
+_CODIGO_INICIO = """
+import json
+import sys
+import time
+t0 = time.perf_counter()
+import app_dashboard_full as A
+t1 = time.perf_counter()
+pesados = sorted(m for m in ("pandas", "numpy", "openpyxl", "consolidador") if m in sys.modules)
+A.cargar_dependencias()
+print(json.dumps({"importar": t1 - t0, "dependencias": time.perf_counter() - t1, "pesados": pesados}))
+"""
+
+def medir_inicio(repeticiones: int) -> tuple[dict[str, dict], list[str]]:
+    """Etapas inicio_app / inicio_dependencias y los módulos pesados que se importaron antes de pintar."""
+    tiempos: dict[str, list[float]] = {"inicio_app": [], "inicio_dependencias": []}
+    pesados: set[str] = set()
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", _CODIGO_INICIO], cwd=Path(__file__).resolve().parent,
+                                capture_output=True, text=True, check=True)
+        medicion = json.loads(salida.stdout.splitlines()[-1])
+        tiempos["inicio_app"].append(medicion["importar"])
+        tiempos["inicio_dependencias"].append(medicion["dependencias"])
+        pesados.update(medicion["pesados"])
+    return {nombre: _estadisticas(valores) for nombre, valores in tiempos.items()}, sorted(pesados)
+
+# ====================== REPORTE ======================
+def texto_resultados(res: dict, anterior: dict | None = None) -> str:
+    """Tabla de medianas y picos por etapa; con `anterior`, agrega el cambio relativo."""
+    lineas = [f"{'etapa':<20}{'mediana s':>11}{'mín s':>9}{'pico MB':>9}" + (f"{'antes s':>10}{'cambio':>9}" if anterior else "")]
+    for nombre, e in res["etapas"].items():
+        pico = f"{e['pico_mb']:>9.1f}" if "pico_mb" in e else f"{'—':>9}"
+        linea = f"{nombre:<20}{e['mediana']:>11.3f}{e['minimo']:>9.3f}{pico}"
+        previo = (anterior or {}).get("etapas", {}).get(nombre)
+        if previo:
+            cambio = (e["mediana"] - previo["mediana"]) / previo["mediana"] if previo["mediana"] else float("nan")
+            linea += f"{previo['mediana']:>10.3f}{cambio:>+9.1%}"
+        elif anterior:
+            linea += f"{'—':>10}{'':>9}"
+        lineas.append(linea)
+    f = res["filas"]
+    lineas.append(f"filas: {f['leidas']:,} leídas, {f['conservadas']:,} tras el filtro, "
+                  f"{f['pivote']:,} tras el pivote, {f['reporte']:,} en el reporte")
+    lineas.append(f"lector: {res.get('lector', 'openpyxl')}")
+    if res.get("pico_rss_mb") is not None:
+        lineas.append(f"pico de memoria del proceso: {res['pico_rss_mb']:,.1f} MB")
+    if not res["coincide_con_pipeline"]:
+        lineas.append("AVISO: el reporte de la corrida con --procesos no coincide con el secuencial")
+    if res.get("inicio_pesados"):
+        lineas.append(f"AVISO: la app importa {', '.join(res['inicio_pesados'])} antes de pintar la ventana")
+    if anterior and anterior.get("lector", "openpyxl") != res.get("lector", "openpyxl"):
+        lineas.append(f"AVISO: la corrida anterior usó el lector {anterior.get('lector', 'openpyxl')}")
+    if anterior and anterior.get("libro", {}).get("parametros") != res.get("libro", {}).get("parametros"):
+        lineas.append("AVISO: la corrida anterior usó otro libro o parámetros")
+    return "\n".join(lineas)
+
+# ============================ CLI ============================
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Mide cada etapa del consolidador sobre un libro sintético (o uno real con --libro).")
+    g = parser.add_argument_group("libro sintético")
+    g.add_argument("--hojas", type=int, default=4)
+    g.add_argument("--filas", type=int, default=20_000, help="filas por hoja")
+    g.add_argument("--pacientes", type=int, default=2_000)
+    g.add_argument("--servicios-validos", type=float, default=0.6, metavar="FRACCIÓN",
+                   help="filas de consulta externa / urgencia general")
+    g.add_argument("--variantes-servicio", type=float, default=0.3, metavar="FRACCIÓN",
+                   help="de ésas, escritas con abreviaturas o typos")
+    g.add_argument("--formatos-fecha", type=int, default=4, metavar="N",
+                   help=f"formatos de fecha mezclados (1–{len(FORMATOS_FECHA_SINTETICOS)})")
+    g.add_argument("--fechas-invalidas", type=float, default=0.01, metavar="FRACCIÓN")
+    g.add_argument("--want", type=float, default=0.6, metavar="FRACCIÓN",
+                   help="pruebas que alimentan alguna columna del reporte")
+    g.add_argument("--semilla", type=int, default=0)
+    g.add_argument("--directorio", default=None, metavar="DIR",
+                   help="dónde guardar/reutilizar los libros generados (por omisión, el temporal del sistema)")
+    parser.add_argument("--libro", default=None, help="medir este libro en vez de generar uno")
+    parser.add_argument("-r", "--repeticiones", type=int, default=3)
+    parser.add_argument("-p", "--procesos", type=int, default=None,
+                        help="procesos para la corrida de punta a punta (las etapas siempre son secuenciales)")
+    parser.add_argument("--exportar", default="xlsx,csv", metavar="FORMATOS",
+                        help="formatos de exportación a medir, separados por comas ('' = ninguno)")
+    parser.add_argument("--sin-memoria", action="store_true", help="omitir la corrida con tracemalloc")
+    parser.add_argument("--sin-inicio", action="store_true", help="omitir la medición del arranque de la app")
+    parser.add_argument("--lector", choices=C.lectores_disponibles(), default=None,
+                        help="lector de libros (por omisión, el que elige consolidador)")
+    parser.add_argument("--fecha-ref", type=C.parse_fecha_ref, default=date(2025, 1, 1), metavar="AAAA-MM-DD")
+    parser.add_argument("-o", "--salida", default=None, metavar="JSON", help="guardar los resultados en este archivo")
+    parser.add_argument("--comparar", default=None, metavar="JSON", help="resultados anteriores contra los que comparar")
+    args = parser.parse_args(argv)
+
+    formatos = [f for f in args.exportar.split(",") if f]
+    no_disponibles = set(formatos) - set(C.formatos_exportacion_disponibles())
+    if no_disponibles:
+        parser.error(f"formato(s) no disponibles: {', '.join(sorted(no_disponibles))}")
+    anterior = json.loads(Path(args.comparar).read_text(encoding="utf-8")) if args.comparar else None
+
+    if args.libro:
+        libro = {"ruta": str(Path(args.libro).resolve()), "parametros": None}
+    else:
+        parametros = {"hojas": args.hojas, "filas": args.filas, "pacientes": args.pacientes,
+                      "servicios_validos": args.servicios_validos, "variantes_servicio": args.variantes_servicio,
+                      "formatos_fecha": args.formatos_fecha, "fechas_invalidas": args.fechas_invalidas,
+                      "prop_want": args.want, "semilla": args.semilla}
+        directorio = Path(args.directorio) if args.directorio else Path(tempfile.gettempdir()) / "redlab_benchmark"
+        t0 = time.perf_counter()
+        ruta = libro_sintetico(directorio, **parametros)
+        print(f"Libro: {ruta} ({time.perf_counter() - t0:.1f} s)", file=sys.stderr)
+        libro = {"ruta": str(ruta), "parametros": parametros}
+    libro["bytes"] = Path(libro["ruta"]).stat().st_size
+
+    res = correr(libro["ruta"], max(args.repeticiones, 1), args.fecha_ref, formatos,
+                 args.procesos, not args.sin_memoria, args.lector)
+    res["libro"] = libro
+    if not args.sin_inicio and importlib.util.find_spec("flet") is not None:
+        etapas_inicio, res["inicio_pesados"] = medir_inicio(max(args.repeticiones, 1))
+        res["etapas"].update(etapas_inicio)
+    print(texto_resultados(res, anterior))
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(res, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0 if res["coincide_con_pipeline"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2874 @@
+# consolidador.py
+# Pipeline de consolidación de reportes de laboratorio (sin interfaz):
+# - Lectura por bloques de todas las hojas, filtro por SERVICIO y pivote por persona/evento
+# - Columnas finales según `want`
+# - Modo por lotes desde la línea de comandos (no importa Flet):
+#     python consolidador.py ENTRADA [ENTRADA ...] [-o SALIDA] [--procesos N]
+# Requisitos: pip install pandas openpyxl (opcionales: python-calamine, lector más rápido y .xls;
+# pyarrow, exportar a Parquet; ver requirements.txt)
+
+from __future__ import annotations
+import argparse
+import bisect
+import codecs
+import cProfile
+import csv
+import glob
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import pickle
+import posixpath
+import pstats
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import unicodedata
+import warnings
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterator
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from openpyxl.utils import get_column_letter
+
+# --------- Config lectura ---------
+FILAS_POR_BLOQUE = 50_000   # filas (ya filtradas por servicio) por bloque de lectura
+FILAS_AVISO = 10_000        # cada cuántas filas leídas se reporta avance / se revisa cancelación
+LIBROS_CONCURRENTES = 2     # libros que consolidar_libros lee y prepara a la vez
+PARTICIONES_DERRAME = 64    # particiones por llave persona/evento en el modo fuera de memoria
+# ----------------------------------
+
+# ====================== NORMALIZACIÓN / SINÓNIMOS ======================
+def _unidecode_local(x: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", str(x)) if not unicodedata.combining(c))
+
+def slug(s: str) -> str:
+    if s is None: return ""
+    s = _unidecode_local(str(s)).strip().lower()
+    s = "".join(ch if ch.isalnum() else "_" for ch in s)
+    return re.sub(r"_+", "_", s).strip("_")
+
+# ---- Estudio (manteniendo lo tuyo + añadidos) ----
+STUDY_SHORT = {
+    "QUIMICA SANGUINEA 6 ELEMENTOS": "QS6",
+    "QUIMICA SANGUINEA 3 ELEMENTOS" : "QS3",
+    "QUIMICA SANGUINEA 5 ELEMENTOS" : "QS5",
+    "GLUCOSA": "GLU",
+    "UREA":"UREA",
+    "CREATININA": "CREATININA",
+    "ACIDO URICO": "ACH",
+    "COLESTEROL": "COL",
+    "TRIGLICERIDOS": "TRIG",
+    "TASA DE FILTRACION GLOMERULAR":"TFG",
+    "QUIMICA SANGUINEA 4": "QS4",
+    "EXAMEN GENERAL DE ORINA": "EGO",
+    "BIOMETRIA HEMATICA": "BH",
+    "HEMOGLOBINA GLICOSILADA": "HbA1c",
+    "PERFIL DE LIPIDOS": "PL",
+
+    # AÑADIDOS (no quitan nada)
+    "QUIMICA SANGUINEA 6": "QS6",
+    "BIOQUIMICA SANGUINEA 6 ELEMENTOS": "QS6",
+    "EXAMEN GENERAL DE ORINA (EGO)": "EGO",
+    "ORINA EXAMEN GENERAL": "EGO",
+    "BIOMETRIA HEMATICA B4": "BH",
+}
+
+# ---- Prueba (manteniendo lo tuyo + añadidos) ----
+TEST_SYNONYMS = {
+    "glucosa":"Glucosa",
+    "creatinina serica":"Creatinina","creatinina":"Creatinina","creatinina sérica":"Creatinina",
+    "urea":"Urea",
+    "acido urico":"Ácido Úrico","ácido úrico":"Ácido Úrico",
+    "bun":"BUN","colesterol":"Colesterol",
+    "trigliceridos":"Triglicéridos","triglicéridos":"Triglicéridos",
+    "hemoglobina glicosilada":"Hemoglobina Glicosilada",
+    "tasa de filtracion glomerular":"Tasa de Filtración Glomerular",
+    "tasa de filtración glomerular":"Tasa de Filtración Glomerular",
+    "ph":"pH",
+    "proteinas":"Proteínas","proteínas":"Proteínas",
+    "nitrito":"Nitrito","nitritos":"Nitrito",
+    "hemoglobina":"Hemoglobina",
+
+    # AÑADIDOS
+    "proteinas totales": "Proteínas",
+    "proteina": "Proteínas",
+    "tfg": "Tasa de Filtración Glomerular",
+}
+
+# Aceptar ambos separadores en las llaves (en-dash y guion corto)
+SEP_KEYS = [" – ", " - "]
+def key_variants(study: str, test: str) -> list[str]:
+    return [f"{study}{sep}{test}" for sep in SEP_KEYS]
+
+# ===== Columnas finales (mismas cabeceras, agregadas variantes de llave) =====
+want = [
+    # Glucosa
+    ("Glucosa (EGO)", [
+        "EGO – Glucosa", "EGO - Glucosa",
+        "ORINA – Glucosa", "ORINA - Glucosa"
+    ]),
+    ("Glucosa (QS)", [
+        "QS6 – Glucosa", "QS6 - Glucosa",
+        "QS4 – Glucosa", "QS4 - Glucosa"
+    ]),
+
+    # Urea
+    ("Urea (Orina)", [
+        "EGO – Urea", "EGO - Urea",
+        "ORINA – Urea", "ORINA - Urea"
+    ]),
+    ("Urea (QS)", [
+        "QS6 – Urea", "QS6 - Urea",
+        "QS4 – Urea", "QS4 - Urea"
+    ]),
+
+    # Creatinina sérica (QS)
+    ("Creatinina sérica (QS)", [
+        "QS6 – Creatinina", "QS6 - Creatinina",
+        "QS4 – Creatinina", "QS4 - Creatinina"
+    ]),
+
+    # TFG (QS)
+    ("Tasa de filtración glomerular (QS)", [
+        "QS6 – Tasa de Filtración Glomerular", "QS6 - Tasa de Filtración Glomerular",
+        "QS4 – Tasa de Filtración Glomerular", "QS4 - Tasa de Filtración Glomerular",
+        "QS6 – TFG", "QS6 - TFG", "QS4 – TFG", "QS4 - TFG"
+    ]),
+
+    # Hemoglobina
+    ("Hemoglobina (Biometría Hemática)", [
+        "BH – Hemoglobina", "BH - Hemoglobina"
+    ]),
+    ("Hemoglobina (Sanguínea)", [
+        "QS6 – Hemoglobina", "QS6 - Hemoglobina",
+        "QS4 – Hemoglobina", "QS4 - Hemoglobina"
+    ]),
+
+    # HbA1c
+    ("Hemoglobina glicosilada", [
+        "HbA1c – Hemoglobina Glicosilada", "HbA1c - Hemoglobina Glicosilada",
+        "HEMOGLOBINA GLICOSILADA – Hemoglobina Glicosilada",
+        "HEMOGLOBINA GLICOSILADA - Hemoglobina Glicosilada"
+    ]),
+
+    # EGO: Proteínas y Nitritos
+    ("Proteínas (EGO)", [
+        "EGO – Proteínas", "EGO - Proteínas",
+        "ORINA – Proteínas", "ORINA - Proteínas"
+    ]),
+    ("Nitritos (EGO)", [
+        "EGO – Nitrito", "EGO - Nitrito",
+        "EGO – Nitritos", "EGO - Nitritos",
+        "ORINA – Nitrito", "ORINA - Nitrito",
+        "ORINA – Nitritos", "ORINA - Nitritos"
+    ]),
+
+    # pH (Sanguínea) — QS; si no existe, EGO como respaldo
+    ("pH (Sanguínea)", [
+        "QS6 – pH", "QS6 - pH",
+        "QS4 – pH", "QS4 - pH",
+        "EGO – pH", "EGO - pH"
+    ]),
+
+    # Hemoglobina en orina (EGO)
+    ("Hemoglobina (orina EGO)", [
+        "EGO – Hemoglobina", "EGO - Hemoglobina",
+        "ORINA – Hemoglobina", "ORINA - Hemoglobina"
+    ]),
+]
+
+def compilar_want(spec: list[tuple[str, list[str]]]) -> dict[str, tuple[tuple[int, int], ...]]:
+    """
+    Llave ESTUDIO – PRUEBA (ya canónica vía STUDY_SHORT/TEST_SYNONYMS) → pares
+    (índice de la columna final, prioridad de la candidata), con la misma prioridad
+    que aplica pick_first: 0 es la primera candidata de la lista.
+    """
+    llaves: dict[str, list[tuple[int, int]]] = {}
+    for j, (_, candidatas) in enumerate(spec):
+        for rango, llave in enumerate(dict.fromkeys(candidatas)):
+            llaves.setdefault(llave, []).append((j, rango))
+    return {k: tuple(v) for k, v in llaves.items()}
+
+LLAVES_WANT = compilar_want(want)
+# Columnas auxiliares del pivote: prioridad de la candidata que dio cada valor (-1 = sin valor)
+PREFIJO_RANGO = "__rango__ "
+
+# ====================== MÉTRICAS ======================
+# Etapas que se miden por hoja (info["tiempos"]) y, al final, sobre el reporte
+ETAPAS_HOJA = ("lectura", "servicio", "preparación", "fechas", "pivote")
+ETAPAS_REPORTE = ("consolidación", "reducción")
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    class _PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+def memoria_residente() -> int | None:
+    """Memoria residente actual del proceso en bytes (None si la plataforma no la expone)."""
+    try:
+        if sys.platform == "win32":
+            contadores = _PROCESS_MEMORY_COUNTERS()
+            contadores.cb = ctypes.sizeof(contadores)
+            proceso = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(proceso, ctypes.byref(contadores), contadores.cb):
+                return contadores.WorkingSetSize
+            return None
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def bytes_tabla(df: pd.DataFrame) -> tuple[int, int]:
+    """
+    Bytes que ocupa df (memory_usage profundo) y los que ocuparía con sus columnas
+    categóricas como texto: 8 bytes por puntero más el tamaño de cada valor repetido,
+    igual que cuenta pandas una columna object.
+    """
+    real = int(df.memory_usage(deep=True, index=False).sum())
+    como_texto = real
+    for col in df.columns:
+        serie = df[col]
+        if not isinstance(serie.dtype, pd.CategoricalDtype):
+            continue
+        tamanos = np.array([sys.getsizeof(v) for v in serie.cat.categories], dtype=np.int64)
+        codes = serie.cat.codes.to_numpy()
+        como_texto += (8 * len(serie) + int(tamanos[codes[codes >= 0]].sum())
+                       - int(serie.memory_usage(deep=True, index=False)))
+    return real, como_texto
+
+# ====================== LECTORES ======================
+# Un lector abre un archivo y entrega, por hoja, sus filas como secuencias de valores de
+# celda (None o "" = vacía; números, fechas y booleanos con sus tipos de Python). Desde
+# ahí todo es común: cabeceras por normalize_headers, celdas por _celda_a_texto.
+# Se elige el primero de LECTORES (el más rápido) que esté instalado y acepte la extensión.
+def _libro_calamine(path: str) -> tuple[list[str], Callable[[str], Iterator], Callable[[], None]]:
+    from python_calamine import CalamineWorkbook, SheetTypeEnum
+    wb = CalamineWorkbook.from_path(str(path))
+    hojas = [m.name for m in wb.sheets_metadata if m.typ == SheetTypeEnum.WorkSheet]
+
+    def filas(hoja: str) -> Iterator:
+        ws = wb.get_sheet_by_name(hoja)
+        # calamine recorta las columnas vacías de la izquierda (las filas no)
+        relleno = ("",) * ws.start[1] if ws.start else ()
+        return (relleno + tuple(f) for f in ws.iter_rows()) if relleno else ws.iter_rows()
+    return hojas, filas, wb.close
+
+def _libro_openpyxl(path: str) -> tuple[list[str], Callable[[str], Iterator], Callable[[], None]]:
+    wb = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+
+    def filas(hoja: str) -> Iterator:
+        ws = wb[hoja]
+        ws.reset_dimensions()  # algunos LIS escriben dimensiones erróneas (como hace pandas)
+        return ws.iter_rows(values_only=True)
+    return [ws.title for ws in wb.worksheets], filas, wb.close
+
+def _codificacion_texto(path: str) -> str:
+    """utf-8 (con o sin BOM) si todo el archivo lo es; si no, cp1252 (lo que exporta un LIS en Windows)."""
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as f:
+            while bloque := f.read(2**20):
+                decodificador.decode(bloque)
+            decodificador.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "cp1252"
+    return "utf-8-sig"
+
+def _libro_texto(path: str) -> tuple[list[str], Callable[[str], Iterator], Callable[[], None]]:
+    """CSV/TSV exportado del LIS: una sola hoja, con el nombre del archivo."""
+    codificacion = _codificacion_texto(path)
+    if Path(path).suffix.lower() == ".tsv":
+        separador = "\t"
+    else:
+        with open(path, encoding=codificacion, newline="") as f:
+            muestra = f.read(64 * 1024)
+        try:
+            separador = csv.Sniffer().sniff(muestra, delimiters=",;\t|").delimiter
+        except csv.Error:
+            separador = ","
+
+    def filas(hoja: str) -> Iterator:
+        with open(path, encoding=codificacion, newline="") as f:
+            yield from csv.reader(f, delimiter=separador)
+    return [Path(path).stem], filas, lambda: None
+
+# Orden de preferencia (más rápido primero) → extensiones, módulo requerido y apertura
+LECTORES = {
+    "calamine": {"extensiones": (".xlsx", ".xlsm", ".xls", ".xlsb", ".ods"), "modulo": "python_calamine",
+                 "abrir": _libro_calamine},
+    "openpyxl": {"extensiones": (".xlsx", ".xlsm"), "modulo": "openpyxl", "abrir": _libro_openpyxl},
+    "texto": {"extensiones": (".csv", ".tsv", ".txt"), "modulo": None, "abrir": _libro_texto},
+}
+
+def lectores_disponibles() -> list[str]:
+    return [nombre for nombre, l in LECTORES.items()
+            if l["modulo"] is None or importlib.util.find_spec(l["modulo"])]
+
+def extensiones_legibles() -> list[str]:
+    """Extensiones (sin punto) que algún lector instalado puede abrir."""
+    return list(dict.fromkeys(e[1:] for nombre in lectores_disponibles() for e in LECTORES[nombre]["extensiones"]))
+
+def elegir_lector(path: str | os.PathLike, lector: str | None = None) -> str:
+    """
+    Nombre del lector para `path`: `lector` si se pidió uno (debe estar instalado y aceptar
+    la extensión) o, si no, el primero disponible de LECTORES que la acepte. Si para esa
+    extensión falta uno preferido, lo avisa con un warning que nombra el lector usado.
+    """
+    extension = Path(path).suffix.lower()
+    if lector is not None:
+        if lector not in LECTORES:
+            raise ValueError(f"Lector desconocido {lector!r} (opciones: {', '.join(LECTORES)})")
+        if lector not in lectores_disponibles():
+            raise ValueError(f"El lector {lector} no está instalado (pip install {LECTORES[lector]['modulo']})")
+        if extension not in LECTORES[lector]["extensiones"]:
+            raise ValueError(f"{path}: el lector {lector} no abre archivos {extension or 'sin extensión'}")
+        return lector
+    aceptan = [nombre for nombre, l in LECTORES.items() if extension in l["extensiones"]]
+    disponibles = lectores_disponibles()
+    for nombre in aceptan:
+        if nombre in disponibles:
+            if nombre != aceptan[0]:  # falta uno más rápido: se avisa con qué se lee
+                modulo = LECTORES[aceptan[0]]["modulo"]
+                warnings.warn(f"{modulo} no está instalado: los archivos {extension} se leen con el lector "
+                              f"{nombre}, más lento (pip install {modulo.replace('_', '-')})", stacklevel=2)
+            return nombre
+    if extension in LECTORES["calamine"]["extensiones"]:
+        raise ValueError(f"{path}: los archivos {extension} requieren python-calamine (pip install python-calamine)")
+    raise ValueError(f"{path}: formato {extension or 'sin extensión'} no soportado "
+                     f"(se aceptan {', '.join(extensiones_legibles())})")
+
+@contextmanager
+def abrir_libro(path: str | os.PathLike, lector: str | None = None) -> Iterator[dict]:
+    """
+    Abre `path` con el lector elegido por elegir_lector y entrega {"lector": nombre,
+    "hojas": títulos de las hojas de cálculo en orden, "filas": función título → filas}.
+    """
+    nombre = elegir_lector(path, lector)
+    hojas, filas, cerrar = LECTORES[nombre]["abrir"](str(path))
+    try:
+        yield {"lector": nombre, "hojas": hojas, "filas": filas}
+    finally:
+        cerrar()
+
+# ====================== PIPELINE ======================
+# Cabecera (ya en slug) → nombre de columna del pipeline
+SINONIMOS_CABECERA = {
+    "nombres":"nombres","nombre":"nombres",
+    "apellidop":"apellido_paterno","apellido_p":"apellido_paterno",
+    "apellidom":"apellido_materno","apellido_m":"apellido_materno",
+    "sexo":"sexo",
+    "servicio":"servicio",
+    "fecnacimiento":"fecha_nacimiento","fecnacimien":"fecha_nacimiento",
+    "fec_nacimiento":"fecha_nacimiento","fecha_nac":"fecha_nacimiento",
+    "estudio":"estudio",
+    "prueba":"prueba","resultado":"resultado",
+    "rangoinferior":"rango_inferior","rangosuperior":"rango_superior",
+    "rangoalterno":"rango_alternativo","rangoaltern":"rango_alternativo",
+    "ide":"ide","nss":"nss","codigo":"codigo","loinc":"loinc","p_loinc":"p_loinc",
+    "fechacrea":"fecha_creacion","fechaval":"fecha_validacion","usrval":"usuario_validador",
+    "fecha":"fecha",  # por si viene una fecha genérica
+}
+
+def normalize_headers(cols: list[str]) -> list[str]:
+    return [SINONIMOS_CABECERA.get(slug(c), slug(c)) for c in cols]
+
+def build_nombre(df: pd.DataFrame) -> pd.Series:
+    if "apellido_p" in df.columns and "apellido_m" in df.columns:
+        df = df.rename(columns={"apellido_p":"apellido_paterno","apellido_m":"apellido_materno"})
+    if {"nombres","apellido_paterno","apellido_materno"}.issubset(df.columns):
+        nombre = (
+            df["nombres"].fillna("").str.strip()+" "+
+            df["apellido_paterno"].fillna("").str.strip()+" "+
+            df["apellido_materno"].fillna("").str.strip()
+        ).str.replace(r"\s+"," ",regex=True).str.strip()
+    elif "nombres" in df.columns:
+        nombre = df["nombres"].fillna("").astype(str).str.strip()
+    else:
+        nombre = pd.Series([""]*len(df))
+    return nombre
+
+FORMATOS_FECHA = ("%d/%m/%Y","%Y-%m-%d","%d-%m-%Y","%m/%d/%Y")
+# Año-mes-día con hora: así llegan las celdas de fecha de Excel leídas como texto.
+# No son ambiguos, así que pd.to_datetime los infiere igual celda por celda.
+FORMATOS_FECHA_HORA = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f")
+
+def _parse_fecha(s) -> tuple[datetime | None, str]:
+    """Lógica por celda de parse_dob; devuelve la fecha y la etiqueta del formato que la reconoció."""
+    if s is None or s=="" or pd.isna(s): return None, "vacío"
+    for fmt in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(str(s), fmt), fmt
+        except Exception:
+            pass
+    try:
+        dt = pd.to_datetime(s, errors="coerce")
+        if pd.notna(dt): return dt, "inferido"
+    except Exception:
+        pass
+    return None, "sin formato"
+
+def parse_dob(s: str) -> str:
+    dt, _ = _parse_fecha(s)
+    return dt.strftime("%Y-%m-%d") if dt is not None else ""
+
+def _parse_fechas_codigos(serie: pd.Series, conteo: dict[str, int] | None = None
+                          ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Núcleo de parse_fechas: códigos de factorize más la fecha ISO y datetime64[D] de
+    cada valor distinto (la última posición corresponde a los nulos, código -1).
+    """
+    codes, uniques = pd.factorize(serie)
+    textos = np.array([str(u) for u in uniques], dtype=object)
+    n = len(textos)
+    # Una posición extra al final para los nulos (código -1 de factorize)
+    iso = np.full(n + 1, "", dtype=object)
+    fechas = np.full(n + 1, np.datetime64("NaT"), dtype="datetime64[D]")
+    etiquetas = np.full(n, "sin formato", dtype=object)
+    etiquetas[textos == ""] = "vacío"
+
+    pendientes = np.flatnonzero(textos != "")
+    por_celda = []
+    for fmt in FORMATOS_FECHA + FORMATOS_FECHA_HORA:
+        if len(pendientes) == 0:
+            break
+        parsed = pd.to_datetime(pd.Series(textos[pendientes]), format=fmt, errors="coerce")
+        ok = parsed.notna().to_numpy()
+        # En los años límite del rango de pandas un formato anterior pudo fallar sólo por
+        # desbordamiento (p. ej. 10/08/1677 como %d/%m/%Y): esos se resuelven por celda.
+        borde = ok & parsed.dt.year.isin([1677, 2262]).to_numpy()
+        por_celda.append(pendientes[borde])
+        ok &= ~borde
+        if ok.any():
+            idx = pendientes[ok]
+            dias = parsed.to_numpy()[ok].astype("datetime64[D]")
+            fechas[idx] = dias
+            iso[idx] = np.datetime_as_string(dias, unit="D")
+            etiquetas[idx] = fmt
+        pendientes = pendientes[~(ok | borde)]
+    for i in np.concatenate([pendientes, *por_celda]):
+        dt, etiquetas[i] = _parse_fecha(textos[i])
+        if dt is not None:
+            iso[i] = dt.strftime("%Y-%m-%d")
+            fechas[i] = np.datetime64(datetime(dt.year, dt.month, dt.day), "D")
+
+    if conteo is not None:
+        filas = pd.Series(np.bincount(codes[codes >= 0], minlength=n)).groupby(etiquetas).sum()
+        for etiqueta, total in filas.items():
+            conteo[etiqueta] = conteo.get(etiqueta, 0) + int(total)
+        nulos = int((codes < 0).sum())
+        if nulos:
+            conteo["vacío"] = conteo.get("vacío", 0) + nulos
+
+    return codes, iso, fechas
+
+def parse_fechas(serie: pd.Series, conteo: dict[str, int] | None = None,
+                 como_datetime: bool = False) -> pd.Series:
+    """
+    Versión por lotes de parse_dob (misma precedencia, mismo resultado).
+    Deduplica los valores y prueba cada formato con una pasada vectorizada de
+    pd.to_datetime(format=...) sólo sobre los que siguen sin reconocer; el resto
+    (fechas fuera del rango de pandas, formatos inferidos) pasa por _parse_fecha.
+    `conteo` acumula cuántas filas reconoció cada formato.
+    Devuelve cadenas ISO ("" sin fecha) o, con como_datetime, una columna datetime64.
+    """
+    codes, iso, fechas = _parse_fechas_codigos(serie, conteo)
+    valores = fechas[codes] if como_datetime else iso[codes]
+    return pd.Series(valores, index=serie.index, name=serie.name)
+
+def calcular_edades(nacimiento, fecha_ref: date | None = None) -> pd.arrays.IntegerArray:
+    """
+    Edad cumplida a `fecha_ref` (hoy si no se indica) para una columna datetime64,
+    en aritmética de arreglo. Las fechas desconocidas quedan como <NA> (Int64).
+    """
+    ref = fecha_ref or date.today()
+    nac = np.asarray(nacimiento, dtype="datetime64[D]")
+    inicio_mes = nac.astype("datetime64[M]")
+    anio = nac.astype("datetime64[Y]").astype(np.int64) + 1970
+    mes = inicio_mes.astype(np.int64) % 12 + 1
+    dia = (nac - inicio_mes).astype(np.int64) + 1
+    antes_de_cumple = (ref.month * 100 + ref.day) < (mes * 100 + dia)
+    desconocida = np.isnat(nac)
+    edades = np.where(desconocida, 0, ref.year - anio - antes_de_cumple)
+    return pd.arrays.IntegerArray(edades.astype(np.int64), desconocida)
+
+def edad_from_iso(iso: str) -> int | None:
+    if not iso: return None
+    try:
+        dob = datetime.strptime(iso,"%Y-%m-%d")
+    except Exception:
+        return None
+    today = datetime.today()
+    return today.year - dob.year - ((today.month,today.day) < (dob.month,dob.day))
+
+def canon_study(study_raw: str) -> str:
+    if not study_raw: return ""
+    key = _unidecode_local(study_raw).strip().upper()
+    return STUDY_SHORT.get(key, study_raw.strip())
+
+def canon_test(test_raw: str) -> str:
+    if not test_raw: return ""
+    key = _unidecode_local(test_raw).strip().lower()
+    return TEST_SYNONYMS.get(key, test_raw.strip())
+
+# ====================== CANONIZACIÓN DIFUSA ======================
+# Grafías de estudio/prueba sin sinónimo exacto en STUDY_SHORT / TEST_SYNONYMS ("QUIMICA
+# SANG. 6 ELEM"): se comparan por trigramas de caracteres contra los sinónimos conocidos
+# (índice invertido, con las abreviaturas expandidas contra su vocabulario). El canónico
+# del más parecido se aplica sólo con un parecido alto, sin empate con otro canónico y con
+# los mismos números; los parecidos dudosos se reportan para revisión sin aplicarse.
+# Las decisiones viven en un almacén que el pipeline recibe explícitamente
+# (nuevas_decisiones_canon), donde cada valor distinto se decide una vez; sin almacén sólo
+# cuentan los sinónimos exactos. En una corrida con caché, las decisiones se cargan de
+# ella y se guardan junto a ella (ruta_decisiones_canon), y valen mientras no cambien
+# las tablas ni los umbrales (huella_canon_difusa).
+VERSION_CANON_DIFUSA = 1
+UMBRAL_CANON_DIFUSA = 0.9     # parecido (Dice de trigramas) desde el que se aplica el canónico
+UMBRAL_CANON_REVISION = 0.6   # desde aquí (y bajo el anterior, o con empate) se reporta para revisión
+MARGEN_CANON_DIFUSA = 0.05    # ventaja mínima sobre el mejor candidato de otro canónico
+_PALABRAS_VACIAS = frozenset({"de", "del", "el", "la", "los", "las", "en", "con", "y"})
+_TABLAS_CANON = {"estudio": (STUDY_SHORT, str.upper, canon_study),
+                 "prueba": (TEST_SYNONYMS, str.lower, canon_test)}
+
+def _palabras_canon(texto: str) -> list[str]:
+    texto = _unidecode_local(str(texto)).lower()
+    return [w for w in "".join(ch if ch.isalnum() else " " for ch in texto).split() if w not in _PALABRAS_VACIAS]
+
+def _trigramas(palabras: list[str]) -> frozenset[str]:
+    texto = " " + " ".join(palabras) + " "
+    return frozenset(texto[i:i + 3] for i in range(len(texto) - 2))
+
+@lru_cache(maxsize=None)
+def _indice_canon(tipo: str) -> dict:
+    """Trigramas de cada sinónimo de la tabla de `tipo`, índice trigrama → sinónimos y vocabulario."""
+    sinonimos = list(_TABLAS_CANON[tipo][0])
+    palabras = [_palabras_canon(s) for s in sinonimos]
+    trigramas = [_trigramas(p) for p in palabras]
+    indice: dict[str, list[int]] = {}
+    for i, ts in enumerate(trigramas):
+        for t in ts:
+            indice.setdefault(t, []).append(i)
+    return {"sinonimos": sinonimos, "palabras": palabras, "trigramas": trigramas, "indice": indice,
+            "vocabulario": sorted({w for p in palabras for w in p})}
+
+def _expandir_abreviaturas(palabras: list[str], vocabulario: list[str]) -> list[str]:
+    """Cada palabra desconocida que es prefijo de una sola palabra conocida ('sang' → 'sanguinea')."""
+    expandidas = []
+    for w in palabras:
+        i = bisect.bisect_left(vocabulario, w)
+        if len(w) >= 3 and not w.isdigit() and (i == len(vocabulario) or vocabulario[i] != w):
+            candidatas = vocabulario[i:bisect.bisect_left(vocabulario, w + "\uffff")]
+            if len(candidatas) == 1:
+                w = candidatas[0]
+        expandidas.append(w)
+    return expandidas
+
+def decidir_canon_difusa(tipo: str, valor: str) -> dict:
+    """
+    Decisión para una grafía de `tipo` ("estudio" / "prueba") sin sinónimo exacto:
+    {"estado": "aplicada" | "revisar" | "sin_parecido", "sinonimo": la llave de la tabla
+    más parecida (o None), "puntaje": 0…1}.
+    """
+    idx = _indice_canon(tipo)
+    palabras = _expandir_abreviaturas(_palabras_canon(valor), idx["vocabulario"])
+    consulta = _trigramas(palabras)
+    comunes: dict[int, int] = {}
+    for t in consulta:
+        for i in idx["indice"].get(t, ()):
+            comunes[i] = comunes.get(i, 0) + 1
+    if not comunes:
+        return {"estado": "sin_parecido", "sinonimo": None, "puntaje": 0.0}
+    # A igual puntaje, el primer sinónimo de la tabla
+    puntajes = sorted(((2 * n / (len(consulta) + len(idx["trigramas"][i])), -i) for i, n in comunes.items()),
+                      reverse=True)
+    puntaje, mejor = puntajes[0][0], -puntajes[0][1]
+    tabla = _TABLAS_CANON[tipo][0]
+    canonico = tabla[idx["sinonimos"][mejor]]
+    rival = next((p for p, i in puntajes if tabla[idx["sinonimos"][-i]] != canonico), 0.0)
+    numeros = lambda ps: sorted(w for w in ps if w.isdigit())
+    if puntaje < UMBRAL_CANON_REVISION:
+        estado = "sin_parecido"
+    elif (puntaje >= UMBRAL_CANON_DIFUSA and puntaje - rival >= MARGEN_CANON_DIFUSA
+          and numeros(palabras) == numeros(idx["palabras"][mejor])):
+        estado = "aplicada"
+    else:
+        estado = "revisar"
+    return {"estado": estado, "sinonimo": idx["sinonimos"][mejor], "puntaje": round(puntaje, 3)}
+
+def huella_canon_difusa() -> str:
+    partes = (VERSION_CANON_DIFUSA, UMBRAL_CANON_DIFUSA, UMBRAL_CANON_REVISION, MARGEN_CANON_DIFUSA,
+              sorted(_PALABRAS_VACIAS), STUDY_SHORT, TEST_SYNONYMS)
+    return hashlib.sha256(repr(partes).encode("utf-8")).hexdigest()
+
+def ruta_decisiones_canon(directorio: str | os.PathLike) -> Path:
+    return Path(directorio) / "canonizacion.json"
+
+# Un solo candado para los almacenes: los libros de consolidar_libros comparten el de la corrida
+_CANDADO_CANON = threading.Lock()
+
+def nuevas_decisiones_canon() -> dict[str, dict]:
+    """Almacén de decisiones vacío: {tipo: {valor normalizado: decisión}}."""
+    return {t: {} for t in _TABLAS_CANON}
+
+def _leer_decisiones_canon(directorio: str | os.PathLike) -> dict:
+    try:
+        with open(ruta_decisiones_canon(directorio), encoding="utf-8") as f:
+            guardadas = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return guardadas if guardadas.get("huella") == huella_canon_difusa() else {}
+
+def _decision_canon(tipo: str, valor: str, decisiones: dict[str, dict]) -> dict:
+    llave = " ".join(_palabras_canon(valor))
+    with _CANDADO_CANON:
+        decision = decisiones[tipo].get(llave)
+        if decision is None:
+            decision = decisiones[tipo][llave] = decidir_canon_difusa(tipo, valor)
+    return decision
+
+def copiar_decisiones_canon(decisiones: dict[str, dict]) -> dict[str, dict]:
+    """Copia de un almacén (p. ej. para mandarlo a un proceso del pool)."""
+    with _CANDADO_CANON:
+        return {t: dict(decisiones[t]) for t in _TABLAS_CANON}
+
+def incorporar_decisiones_canon(decisiones: dict[str, dict], nuevas: dict[str, dict]) -> None:
+    """Suma a `decisiones` las de `nuevas` (p. ej. las que devuelve un proceso del pool)."""
+    with _CANDADO_CANON:
+        for t in _TABLAS_CANON:
+            decisiones[t].update(nuevas.get(t, {}))
+
+def cargar_decisiones_canon(directorio: str | os.PathLike) -> dict[str, dict]:
+    """Almacén con las decisiones guardadas en `directorio` (vacío si no hay o ya no valen)."""
+    decisiones = nuevas_decisiones_canon()
+    incorporar_decisiones_canon(decisiones, _leer_decisiones_canon(directorio))
+    return decisiones
+
+def guardar_decisiones_canon(directorio: str | os.PathLike, decisiones: dict[str, dict]) -> None:
+    """Agrega al archivo de `directorio` las decisiones que le faltan (sin error si no se puede escribir)."""
+    with _CANDADO_CANON:
+        guardadas = _leer_decisiones_canon(directorio)  # incluye las de otras corridas
+        if all(decisiones[t].keys() <= guardadas.get(t, {}).keys() for t in _TABLAS_CANON):
+            return
+        datos = {"huella": huella_canon_difusa(),
+                 **{t: {**guardadas.get(t, {}), **decisiones[t]} for t in _TABLAS_CANON}}
+        ruta = ruta_decisiones_canon(directorio)
+        try:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            _guardar_atomico(ruta, lambda tmp: tmp.write_text(json.dumps(datos, ensure_ascii=False),
+                                                               encoding="utf-8"))
+        except OSError:
+            pass
+
+@contextmanager
+def _decisiones_de_corrida(cache: str | os.PathLike | None, canon_difusa: bool = True) -> Iterator[dict | None]:
+    """
+    El almacén de decisiones de una corrida, o None sin canonización difusa. Con caché
+    parte de las decisiones guardadas en su directorio y, si la corrida termina bien,
+    guarda ahí las nuevas una sola vez (las de los procesos del pool llegan con cada
+    hoja). Sin caché las decisiones sólo duran lo que la corrida.
+    """
+    if not canon_difusa:
+        yield None
+        return
+    if cache is None:
+        yield nuevas_decisiones_canon()
+        return
+    decisiones = cargar_decisiones_canon(cache)
+    yield decisiones
+    guardar_decisiones_canon(cache, decisiones)
+
+def canonizar(tipo: str, valor: str, registro: list[dict] | None = None,
+              decisiones: dict[str, dict] | None = None) -> str:
+    """
+    canon_study / canon_test (según `tipo`) con respaldo difuso: con un almacén de
+    `decisiones` (nuevas_decisiones_canon), una grafía sin sinónimo exacto toma el
+    canónico del sinónimo más parecido sólo si la decisión es "aplicada"; sin almacén,
+    sólo los sinónimos exactos. Las grafías aplicadas o por revisar se agregan a
+    `registro` (tipo, valor, estado, sinónimo, canónico y puntaje).
+    """
+    tabla, caso, exacta = _TABLAS_CANON[tipo]
+    if decisiones is None or not valor or caso(_unidecode_local(valor).strip()) in tabla:
+        return exacta(valor)
+    decision = _decision_canon(tipo, valor, decisiones)
+    if registro is not None and decision["estado"] != "sin_parecido":
+        registro.append({"tipo": tipo, "valor": str(valor).strip(), **decision,
+                         "canonico": tabla[decision["sinonimo"]]})
+    return tabla[decision["sinonimo"]] if decision["estado"] == "aplicada" else exacta(valor)
+
+def canonizaciones(resumen: dict, estado: str | None = None) -> list[dict]:
+    """resumen["canonizacion"] sin repetidos (una vez por tipo y valor), opcionalmente de un `estado`."""
+    vistas = {}
+    for r in resumen.get("canonizacion", []):
+        if estado is None or r["estado"] == estado:
+            vistas.setdefault((r["tipo"], r["valor"]), r)
+    return list(vistas.values())
+
+def first_nonempty(series: pd.Series) -> str:
+    for v in series:
+        if pd.notna(v) and str(v).strip() != "":
+            return str(v)
+    return ""
+
+# Servicios que sobreviven al filtro (salida canónica de normalize_servicio)
+SERVICIOS_VALIDOS = ("consulta externa", "urgencia general")
+
+_SEPARADORES_SERVICIO = str.maketrans({".": " ", "-": " ", "/": " "})
+_RE_ESPACIOS = re.compile(r"\s+")
+# Reglas de consulta externa y urgencia general en un solo patrón precompilado:
+# cada coincidencia reporta su grupo, así basta una pasada por cadena.
+_RE_SERVICIO = re.compile(
+    r"(?P<consulta>\bconsulta\s*externa\b|\bconsulta\s*ext(?:erna)?\b"
+    r"|\bcons?\s*ext(?:\s*erna)?\b|\bc\s*externa\b)"
+    r"|(?P<urgencia>\burgencias?\b)"
+    r"|(?P<urg>\burg\w*\b)"          # urg., urg-, urgs, urgenc…
+    r"|(?P<general>\bgeneral\b|\bgral\b)"
+)
+
+@lru_cache(maxsize=4096)
+def _normalizar_servicio_texto(texto: str) -> str:
+    raw = _unidecode_local(texto).lower().strip()
+
+    # Normalización básica
+    raw = raw.translate(_SEPARADORES_SERVICIO)
+    raw = _RE_ESPACIOS.sub(" ", raw)
+
+    # Corrección de typos frecuentes
+    raw = raw.replace("urgenciasl", "urgencias")   # 'urgenciasl general' -> 'urgencias general'
+    raw = raw.replace("urgenc", "urgencia")        # 'urgenc gral' -> 'urgencia gral'
+    raw = raw.replace("genral", "general")         # 'genral' -> 'general'
+    raw = raw.replace("grl", "gral")               # 'grl' -> 'gral'
+
+    grupos = {m.lastgroup for m in _RE_SERVICIO.finditer(raw)}
+
+    # ====== DETECCIÓN CONSULTA EXTERNA ======
+    if "consulta" in grupos:
+        return "consulta externa"
+
+    # ====== DETECCIÓN URGENCIA GENERAL ======
+    has_urg = "urgencia" in grupos or "urg" in grupos
+    if has_urg and "general" in grupos:
+        return "urgencia general"
+
+    # Si sólo dice 'urgencia' / 'urgencias' sin 'general', lo tratamos como urgencia general
+    if "urgencia" in grupos:
+        return "urgencia general"
+
+    # Cualquier otro servicio queda tal cual (y luego será excluido por el filtro)
+    return raw
+
+def normalize_servicio(s: str) -> str:
+    """
+    Normaliza 'servicio' y mapea variantes/abreviaturas/typos a categorías canónicas.
+    Queremos conservar SOLO:
+      - 'consulta externa'
+      - 'urgencia general'  (incluye: 'urg. gral', 'urg gral', 'urgencias general', 'urgenciasl general', etc.)
+    El resultado se memoiza por texto (LRU de módulo), así se reutiliza entre hojas y archivos.
+    """
+    if s is None or (isinstance(s, float) and pd.isna(s)):
+        return ""
+    return _normalizar_servicio_texto(str(s))
+
+def normalize_servicio_series(servicio: pd.Series) -> pd.Series:
+    """Versión por columna: normaliza cada valor distinto una sola vez (categórica)."""
+    return mapear_categorias(servicio, normalize_servicio)
+
+def limpiar_memo_servicio() -> None:
+    """Olvida los textos de servicio ya normalizados (para medir o correr en frío)."""
+    _normalizar_servicio_texto.cache_clear()
+
+# ---- Columnas categóricas ----
+# Pocas cadenas distintas repetidas en miles de filas: viajan como códigos + categorías
+# desde la lectura hasta el pivote, y la canonicalización corre sobre las categorías.
+COLUMNAS_CATEGORICAS = ["sexo","servicio","estudio","prueba"]
+
+def como_categoria(valores) -> pd.Categorical:
+    """
+    Categórica con las categorías ordenadas como cadenas, para que agrupar u ordenar
+    por la columna dé el mismo orden que sobre el texto.
+    """
+    if isinstance(valores, pd.Series):
+        valores = valores.to_numpy(dtype=object)
+    codes, uniques = pd.factorize(valores, sort=True)
+    return pd.Categorical.from_codes(codes, categories=uniques)
+
+def _recodificar(codes_por_valor: np.ndarray, valores: list) -> tuple[np.ndarray, pd.Index]:
+    """Códigos nuevos (ordenados) para `valores`, que puede repetir cadenas."""
+    remap, uniques = pd.factorize(np.array(valores, dtype=object), sort=True)
+    return remap[codes_por_valor], uniques
+
+def mapear_categorias(serie: pd.Series, funcion: Callable[[object], str], nulo: str = "") -> pd.Series:
+    """
+    `funcion` una vez por categoría (no por fila); devuelve otra categórica en la que
+    se juntan las categorías que la función deja iguales. Los nulos toman `nulo`.
+    """
+    cat = serie.array if isinstance(serie.dtype, pd.CategoricalDtype) else como_categoria(serie)
+    # El último valor cubre los nulos (código -1)
+    codes, categorias = _recodificar(cat.codes, [funcion(v) for v in cat.categories] + [nulo])
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categorias), index=serie.index, name=serie.name)
+
+def combinar_categorias(a: pd.Series, b: pd.Series, funcion: Callable[[object, object], str]) -> pd.Series:
+    """Como mapear_categorias, pero sobre los pares (a, b) presentes (nulo = None)."""
+    ca = a.array if isinstance(a.dtype, pd.CategoricalDtype) else como_categoria(a)
+    cb = b.array if isinstance(b.dtype, pd.CategoricalDtype) else como_categoria(b)
+    ancho = len(cb.categories) + 1
+    pares, distintos = pd.factorize((ca.codes.astype(np.int64) + 1) * ancho + (cb.codes + 1))
+    valores = []
+    for par in distintos:
+        ia, ib = divmod(int(par), ancho)
+        valores.append(funcion(ca.categories[ia - 1] if ia else None, cb.categories[ib - 1] if ib else None))
+    codes, categorias = _recodificar(pares, valores)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categorias), index=a.index)
+
+def por_combinaciones(df: pd.DataFrame, cols: list[str],
+                      funcion: Callable[[pd.DataFrame], pd.Series]) -> pd.Series:
+    """`funcion` sobre las combinaciones distintas de `cols`, repartida a las filas como categórica."""
+    codes, distintas = pd.MultiIndex.from_frame(df[cols]).factorize()
+    valores = funcion(distintas.to_frame(index=False, name=cols)).tolist()
+    codes, categorias = _recodificar(codes, valores)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categorias), index=df.index)
+
+def concatenar_tablas(partes: list[pd.DataFrame], **kwargs) -> pd.DataFrame:
+    """
+    pd.concat que conserva las columnas categóricas: con categorías distintas pandas
+    las volvería object, así que antes se llevan todas a la unión (ordenada).
+    """
+    if len(partes) > 1:
+        categoricas = [c for c in partes[0].columns
+                       if all(c in p.columns and isinstance(p[c].dtype, pd.CategoricalDtype) for p in partes)]
+        if categoricas:
+            partes = [p.copy(deep=False) for p in partes]
+            for c in categoricas:
+                union = pd.Index(sorted(set().union(*(p[c].cat.categories for p in partes))))
+                for p in partes:
+                    if not p[c].cat.categories.equals(union):
+                        p[c] = p[c].cat.set_categories(union)
+    return pd.concat(partes, **kwargs)
+
+
+# Columnas (ya normalizadas) que usa el pipeline; el resto de la hoja no se carga
+COLUMNAS_ENTRADA = ["nombres","apellido_paterno","apellido_materno","sexo","servicio",
+                    "fecha_nacimiento","estudio","prueba","resultado",
+                    "fecha_creacion","fecha_validacion","fecha"]
+
+# Textos que pd.read_excel toma como nulos por defecto (na_values) + errores de Excel
+_TEXTOS_NULOS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}) | frozenset(ERROR_CODES)
+
+def _celda_a_texto(v) -> str | None:
+    """Convierte un valor de celda (de cualquier lector) como lo haría pd.read_excel(dtype=str); None = nulo."""
+    if v is None:
+        return None
+    if isinstance(v, str):
+        return None if v in _TEXTOS_NULOS else v
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    if type(v) is date:  # calamine entrega date en celdas sin hora; openpyxl, datetime
+        return f"{v.isoformat()} 00:00:00"
+    return str(v)
+
+def _encabezados(fila: tuple) -> list[str]:
+    return [f"Unnamed: {i}" if v is None or v == "" else str(v) for i, v in enumerate(fila)]
+
+def iter_bloques_hoja(filas: Iterator, filas_por_bloque: int = FILAS_POR_BLOQUE,
+                      contador: dict | None = None,
+                      al_avanzar: Callable[[], None] | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Recorre las filas de una hoja (las de un lector, cabecera primero) y entrega bloques
+    de a lo más `filas_por_bloque` filas, sólo con COLUMNAS_ENTRADA y sólo las que pasan
+    el filtro de servicio (COLUMNAS_CATEGORICAS como categóricas). La memoria depende del
+    tamaño del bloque, no del de la hoja.
+    `contador` recibe "filas_leidas", "filas_conservadas" y "segundos_servicio" (lo que
+    lleva el filtro); se actualiza al entregar cada bloque y cada FILAS_AVISO filas leídas,
+    momento en que también se llama `al_avanzar` (útil cuando el filtro descarta casi todo
+    y los bloques tardan en llenarse).
+    """
+    filas = iter(filas)
+    encabezado = next(filas, None)
+    if encabezado is None:
+        return
+    posiciones: dict[str, int] = {}
+    for i, col in enumerate(normalize_headers(_encabezados(encabezado))):
+        if col in COLUMNAS_ENTRADA:
+            posiciones.setdefault(col, i)
+    if "servicio" not in posiciones:
+        return  # sin servicio nada pasa el filtro
+    nombres, indices = list(posiciones), list(posiciones.values())
+    i_servicio = posiciones["servicio"]
+
+    bloque, leidas, conservadas, t_servicio = [], 0, 0, 0.0
+    def contar():
+        if contador is not None:
+            contador["filas_leidas"], contador["filas_conservadas"] = leidas, conservadas
+            contador["segundos_servicio"] = t_servicio
+
+    for fila in filas:
+        leidas += 1
+        if leidas % FILAS_AVISO == 0:
+            contar()
+            if al_avanzar:
+                al_avanzar()
+        t0 = time.perf_counter()
+        servicio = _celda_a_texto(fila[i_servicio]) if i_servicio < len(fila) else None
+        valido = normalize_servicio(servicio) in SERVICIOS_VALIDOS
+        t_servicio += time.perf_counter() - t0
+        if not valido:
+            continue
+        conservadas += 1
+        bloque.append([_celda_a_texto(fila[i]) if i < len(fila) else None for i in indices])
+        if len(bloque) >= filas_por_bloque:
+            contar()
+            yield _bloque_a_df(bloque, nombres)
+            bloque = []
+    contar()
+    if bloque:
+        yield _bloque_a_df(bloque, nombres)
+
+def _bloque_a_df(bloque: list[list], nombres: list[str]) -> pd.DataFrame:
+    df = pd.DataFrame(bloque, columns=nombres, dtype=object)
+    for col in COLUMNAS_CATEGORICAS:
+        if col in df.columns:
+            df[col] = como_categoria(df[col])
+    return df
+
+def cargar_y_preparar_df(df: pd.DataFrame, resumen: dict | None = None,
+                         fecha_ref: date | None = None,
+                         tiempos: dict[str, float] | None = None,
+                         vistos: dict[str, set] | None = None,
+                         decisiones: dict[str, dict] | None = None) -> pd.DataFrame:
+    """
+    Normaliza cabeceras, filtra por servicio y agrega persona, fechas y llave ESTUDIO – PRUEBA.
+    Si se pasa `resumen`, acumula en resumen["formatos_fecha"][columna] cuántas filas
+    reconoció cada formato de fecha. `fecha_ref` fija el día contra el que se calcula
+    la edad (hoy si no se indica), para que las corridas sean reproducibles.
+    Con `tiempos`, suma en tiempos["fechas"] los segundos de interpretación de fechas.
+    Con `decisiones` (nuevas_decisiones_canon), estudio y prueba tienen canonización
+    difusa: las grafías canonizadas por parecido, o con un parecido dudoso que no se
+    aplicó, quedan en resumen["canonizacion"] (ver canonizar). Con `vistos`, suma en
+    vistos["estudio"] / vistos["prueba"] los valores distintos que pasaron el filtro.
+    """
+    df = df.copy()
+    df.columns = normalize_headers(list(df.columns))
+    # Asegurar columnas base
+    for col in COLUMNAS_ENTRADA:
+        if col not in df.columns:
+            df[col] = ""
+
+    # --- Filtro por SERVICIO (SOLO consulta externa y urgencia gral/general) ---
+    df["servicio_norm"] = normalize_servicio_series(df["servicio"])
+    df = df[df["servicio_norm"].isin(SERVICIOS_VALIDOS)].copy()
+
+    # Si todo quedó vacío tras el filtro, devolvemos DataFrame vacío con las columnas requeridas
+    if df.empty:
+        cols = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
+        return pd.DataFrame(columns=cols)
+
+    conteo = resumen.setdefault("formatos_fecha", {}) if resumen is not None else None
+    def fechas(col: str) -> pd.Series:
+        return parse_fechas(df[col], conteo.setdefault(col, {}) if conteo is not None else None)
+
+    # Datos de persona (nombre y fecha de nacimiento se arman una sola vez por valor distinto)
+    df["nombre"] = por_combinaciones(df, ["nombres","apellido_paterno","apellido_materno"], build_nombre)
+    if not isinstance(df["sexo"].dtype, pd.CategoricalDtype):
+        df["sexo"] = como_categoria(df["sexo"])
+    t0 = time.perf_counter()
+    codes, iso, nacimiento = _parse_fechas_codigos(
+        df["fecha_nacimiento"], conteo.setdefault("fecha_nacimiento", {}) if conteo is not None else None)
+    edades = calcular_edades(nacimiento, fecha_ref)  # por valor distinto (+ posición de nulos)
+    df["fecha_nacimiento"] = pd.Categorical.from_codes(*_recodificar(codes, iso.tolist()))
+    df["edad"] = edades[codes]
+    df["mayor_18"] = _mayor_18(edades, codes)
+
+    # --- FECHA DEL EVENTO (clave para separar filas por distintas atenciones) ---
+    df["fecha_validacion"] = fechas("fecha_validacion")
+    df["fecha_creacion"] = fechas("fecha_creacion")
+    # Si existe una 'fecha' genérica, úsala si ambas anteriores están vacías
+    df["fecha"] = fechas("fecha")
+
+    # Preferir fecha_validacion > fecha_creacion > fecha
+    df["fecha_evento"] = df["fecha_validacion"]
+    df.loc[df["fecha_evento"] == "", "fecha_evento"] = df.loc[df["fecha_evento"] == "", "fecha_creacion"]
+    df.loc[df["fecha_evento"] == "", "fecha_evento"] = df.loc[df["fecha_evento"] == "", "fecha"]
+    df["fecha_evento"] = como_categoria(df["fecha_evento"])
+    if tiempos is not None:
+        tiempos["fechas"] = tiempos.get("fechas", 0.0) + time.perf_counter() - t0
+
+    # Canon estudio/prueba y llave, sobre las categorías (no por fila): sólo los valores
+    # presentes tras el filtro, y los que no tienen sinónimo exacto pasan por canonizar
+    registro = []
+    for col in ("estudio", "prueba"):
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.remove_unused_categories()
+        if vistos is not None:
+            vistos.setdefault(col, set()).update(
+                df[col].cat.categories if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].dropna().unique())
+    df["study_canon"] = mapear_categorias(df["estudio"], lambda v: canonizar("estudio", v, registro, decisiones), canon_study(""))
+    df["test_canon"] = mapear_categorias(df["prueba"], lambda v: canonizar("prueba", v, registro, decisiones), canon_test(""))
+    if resumen is not None and registro:
+        resumen.setdefault("canonizacion", []).extend(registro)
+    df["col_key"] = combinar_categorias(df["study_canon"], df["test_canon"],
+                                        lambda s, t: str(s).strip() + (" – "+t if str(t).strip()!="" else ""))
+
+    return df
+
+# Columnas de la tabla preparada que llegan al pivote
+COLUMNAS_PIVOTE = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento",
+                   "col_key","resultado"]
+
+def _mayor_18(edades: pd.arrays.IntegerArray, codes: np.ndarray) -> pd.Categorical:
+    """mayor_18 ("Sí"/"No") por fila, a partir de las edades por valor distinto (código -1 = último)."""
+    mayor = (edades >= 18).to_numpy(dtype=bool, na_value=False)
+    return pd.Categorical.from_codes(mayor[codes].astype(np.int8), categories=["No", "Sí"])
+
+def podar_filas_sin_salida(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Deja sólo las filas que pueden alimentar una columna de `want` (llave solicitada y
+    resultado no vacío) más una fila por persona/evento del resto, para que esas
+    personas sigan apareciendo en el reporte aunque no tengan pruebas solicitadas.
+    """
+    util = df["col_key"].isin(list(LLAVES_WANT)) & mascara_llenos(df[["resultado"]])["resultado"]
+    if util.all():
+        return df
+    resto = df[~util]
+    # Primero las filas con contenido: conservan el chequeo de hoja vacía del pivote
+    contenido = (resto["col_key"] != "") | resto["resultado"].notna() & (resto["resultado"] != "")
+    base_cols = ["fecha_nacimiento","nombre","sexo","edad","mayor_18","servicio_norm","fecha_evento"]
+    resto = resto.iloc[np.argsort(~contenido.to_numpy(), kind="stable")].drop_duplicates(base_cols)
+    return concatenar_tablas([df[util], resto]).sort_index()
+
+def pivot_por_persona_cols_estudio_prueba(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Una fila por persona/evento con las columnas finales de `want` ya resueltas: en cada
+    una, el primer resultado no vacío de la candidata de mayor prioridad presente.
+    Junto a cada columna va PREFIJO_RANGO + nombre con esa prioridad (-1 si no hubo
+    valor), para que fusionar_tablas respete el mismo orden entre hojas.
+    """
+    # INCLUYE fecha_evento en el índice
+    base_cols = ["fecha_nacimiento","nombre","sexo","edad","mayor_18","servicio_norm","fecha_evento"]
+    df_base = df[base_cols + ["col_key","resultado"]]
+    vacia = lambda col: (df_base[col].isna() | (df_base[col] == "")).all()
+    if df_base.empty or (vacia("col_key") and vacia("resultado")):
+        return pd.DataFrame(columns=["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"])
+    # Igual que pivot_table: las filas con nulos en la llave no forman grupo
+    df_base = df_base.dropna(subset=base_cols + ["col_key"])
+    grupos = df_base.groupby(base_cols, sort=True, observed=True)
+    ids = grupos.ngroup().to_numpy()
+    pivot = grupos.size().index.to_frame(index=False)
+
+    # Prioridad de cada llave distinta para cada columna final (-1: no es candidata)
+    col_codes, col_keys = pd.factorize(df_base["col_key"])
+    rangos = np.full((len(col_keys) + 1, len(want)), -1, dtype=np.int32)
+    for k, llave in enumerate(col_keys):
+        for j, rango in LLAVES_WANT.get(llave, ()):
+            rangos[k, j] = rango
+    llenos = mascara_llenos(df_base[["resultado"]])["resultado"].to_numpy()
+    resultados = df_base["resultado"].to_numpy(dtype=object)
+    for j, (new_name, _) in enumerate(want):
+        rango = rangos[col_codes, j]
+        filas = np.flatnonzero(llenos & (rango >= 0))
+        # Por grupo: menor prioridad y, a igual prioridad, la primera fila
+        filas = filas[np.lexsort((filas, rango[filas], ids[filas]))]
+        grupo, primera = np.unique(ids[filas], return_index=True)
+        valores = np.full(grupos.ngroups, "", dtype=object)
+        valores[grupo] = resultados[filas[primera]]
+        mejor = np.full(grupos.ngroups, -1, dtype=np.int32)
+        mejor[grupo] = rango[filas[primera]]
+        pivot[new_name] = valores
+        pivot[PREFIJO_RANGO + new_name] = mejor
+
+    pivot = pivot.sort_values(["fecha_nacimiento","nombre","fecha_evento"]).reset_index(drop=True)
+    fixed = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
+    tests = [c for c in pivot.columns if c not in fixed]
+    return pivot[fixed + tests]
+
+def mascara_llenos(df: pd.DataFrame) -> pd.DataFrame:
+    """True donde la celda tiene valor (ni nula ni vacía/sólo espacios)."""
+    return df.notna() & df.apply(lambda col: col.astype(str).str.strip() != "")
+
+def coalesce_first_nonempty(df: pd.DataFrame, cols: list[str],
+                            llenos: pd.DataFrame | None = None) -> pd.Series:
+    """
+    Primer valor no vacío entre las columnas candidatas (en su orden de prioridad),
+    resuelto con operaciones de arreglo. `llenos` permite reutilizar la máscara de
+    mascara_llenos cuando se resuelven varias listas de candidatas sobre el mismo df.
+    """
+    presentes = [c for c in dict.fromkeys(cols) if c in df.columns]
+    if not presentes or df.empty:
+        return pd.Series("", index=df.index, dtype=object)
+    valores = df[presentes].to_numpy(dtype=object)
+    mask = (llenos[presentes] if llenos is not None else mascara_llenos(df[presentes])).to_numpy(dtype=bool)
+    filas = np.arange(len(df))
+    primera = mask.argmax(axis=1)
+    out = np.where(mask[filas, primera], valores[filas, primera], "")
+    return pd.Series(out, index=df.index, dtype=object).astype(str)
+
+def pick_first(df: pd.DataFrame, cols: list[str]) -> pd.Series:
+    return coalesce_first_nonempty(df, cols)
+
+def reducir_a_columnas_solicitadas(df: pd.DataFrame) -> pd.DataFrame:
+    # df trae columnas "ESTUDIO – PRUEBA"
+    base_cols = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
+    if df.empty:
+        out = pd.DataFrame(columns=["id_trabajador"] + base_cols + [w[0] for w in want])
+        return out
+
+    out = df[base_cols].copy()
+    # Máscara de vacíos una sola vez para todas las candidatas existentes
+    candidatas = [c for c in dict.fromkeys(c for _, cands in want for c in cands) if c in df.columns]
+    llenos = mascara_llenos(df[candidatas])
+    for new_name, candidates in want:
+        # Tablas del pivote ya traen la columna final resuelta
+        out[new_name] = (df[new_name].astype(str) if new_name in df.columns
+                         else coalesce_first_nonempty(df, candidates, llenos))
+
+    # ID incremental
+    out.insert(0, "id_trabajador", range(1, len(out)+1))
+    return out
+
+def fusionar_tablas(tablas: list[pd.DataFrame], resumen: dict | None = None) -> pd.DataFrame:
+    """
+    Une los pivotes de varias hojas: una fila por persona/evento y, en cada columna de
+    `want`, el valor de la candidata de mayor prioridad; a igual prioridad gana la
+    primera hoja (lo mismo que pick_first sobre el primer valor no vacío por llave).
+    Cuántos grupos juntaron filas de más de una hoja queda en
+    resumen["grupos_fusionados"] (y en attrs del resultado).
+    """
+    # OJO: ya NO usamos consulta_externa en 'fixed'
+    fixed = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
+    unido = concatenar_tablas(tablas, ignore_index=True)
+    for col in fixed:
+        if unido[col].hasnans:
+            if isinstance(unido[col].dtype, pd.CategoricalDtype) and "" not in unido[col].cat.categories:
+                unido[col] = unido[col].cat.add_categories("")
+            unido[col] = unido[col].fillna("")
+    grupos = unido.groupby(fixed, sort=True, dropna=False, observed=True)
+    ids = grupos.ngroup().to_numpy()
+    consolidado = grupos.size().index.to_frame(index=False)
+    for new_name, _ in want:
+        rango = unido[PREFIJO_RANGO + new_name].to_numpy()
+        filas = np.flatnonzero(rango >= 0)
+        filas = filas[np.lexsort((filas, rango[filas], ids[filas]))]
+        grupo, primera = np.unique(ids[filas], return_index=True)
+        valores = np.full(grupos.ngroups, "", dtype=object)
+        valores[grupo] = unido[new_name].to_numpy(dtype=object)[filas[primera]]
+        consolidado[new_name] = valores
+    fusionados = int((grupos.size().to_numpy() > 1).sum())
+    consolidado.attrs["grupos_fusionados"] = fusionados
+    if resumen is not None:
+        resumen["grupos_fusionados"] = resumen.get("grupos_fusionados", 0) + fusionados
+    return consolidado
+
+class ProcesoCancelado(Exception):
+    """Se pidió cancelar (cancelar.set()) mientras corría consolidar_todas_las_hojas."""
+
+def _revisar_cancelacion(cancelar: threading.Event | None) -> None:
+    if cancelar is not None and cancelar.is_set():
+        raise ProcesoCancelado()
+
+def _procesar_hoja(hoja: str, filas: Iterator, resumen: dict | None, fecha_ref: date,
+                   progreso: Callable[[dict], None] | None = None,
+                   cancelar: threading.Event | None = None,
+                   indice: int = 0, total: int = 1,
+                   decisiones: dict[str, dict] | None = None) -> tuple[pd.DataFrame, dict, dict]:
+    """
+    Lectura por bloques → cargar_y_preparar_df → pivote de una hoja.
+    Devuelve la tabla, los valores de estudio/prueba de la hoja con su huella
+    ({"valores", "huella"}, ver huella_canon_hoja) y las métricas (info): filas leídas, conservadas y
+    descartadas por el filtro de servicio, filas que entran y salen del pivote, llaves
+    ESTUDIO – PRUEBA distintas, bytes de la entrada del pivote (y los que ocuparía sin
+    columnas categóricas), variación de memoria residente (bytes; None si no se puede
+    medir) y segundos por etapa. Las etapas no se solapan: lectura no incluye el
+    filtro de servicio ni preparación la interpretación de fechas. `decisiones` es el
+    almacén de canonización difusa (ver cargar_y_preparar_df).
+    """
+    info = {"hoja": hoja, "indice": indice, "total": total,
+            "filas_leidas": 0, "filas_conservadas": 0, "segundos_servicio": 0.0,
+            "tiempos": dict.fromkeys(ETAPAS_HOJA, 0.0)}
+    tiempos = info["tiempos"]
+    memoria_inicial = memoria_residente()
+    llaves: set[str] = set()
+    vistos: dict[str, set] = {}
+    # Cada bloque se prepara al leerlo; sólo se acumulan las columnas del pivote
+    def avisar_bloque():
+        if progreso:
+            progreso({"evento": "bloque", **info, "tiempos": dict(tiempos)})
+
+    def al_avanzar():
+        _revisar_cancelacion(cancelar)
+        avisar_bloque()
+
+    partes = []
+    bloques = iter_bloques_hoja(filas, contador=info, al_avanzar=al_avanzar)
+    while True:
+        _revisar_cancelacion(cancelar)
+        t0 = time.perf_counter()
+        servicio_antes = info["segundos_servicio"]
+        bloque = next(bloques, None)
+        tiempos["servicio"] += info["segundos_servicio"] - servicio_antes
+        tiempos["lectura"] += time.perf_counter() - t0 - (info["segundos_servicio"] - servicio_antes)
+        if bloque is None:
+            break
+        t0 = time.perf_counter()
+        fechas_antes = tiempos["fechas"]
+        preparado = cargar_y_preparar_df(bloque, resumen, fecha_ref, tiempos, vistos, decisiones)[COLUMNAS_PIVOTE]
+        llaves.update(preparado["col_key"].unique())
+        partes.append(podar_filas_sin_salida(preparado))
+        tiempos["preparación"] += time.perf_counter() - t0 - (tiempos["fechas"] - fechas_antes)
+        avisar_bloque()
+    del info["segundos_servicio"]
+    info["filas_descartadas_servicio"] = info["filas_leidas"] - info["filas_conservadas"]
+    info["llaves_distintas"] = len(llaves - {""})
+    tabla = pd.DataFrame()
+    if partes:
+        t0 = time.perf_counter()
+        df_base = concatenar_tablas(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+        tabla = pivot_por_persona_cols_estudio_prueba(df_base)
+        tiempos["pivote"] += time.perf_counter() - t0
+        info["bytes_pivote"], info["bytes_pivote_texto"] = bytes_tabla(df_base)
+    info["filas_pivote"] = sum(len(p) for p in partes)
+    info["filas_salida"] = len(tabla)
+    memoria_final = memoria_residente()
+    info["memoria_delta"] = (memoria_final - memoria_inicial
+                             if memoria_final is not None and memoria_inicial is not None else None)
+    valores = {col: sorted(v, key=str) for col, v in vistos.items()}
+    return tabla, {"valores": valores, "huella": huella_canon_hoja(valores, decisiones)}, info
+
+def _empaquetar_tabla(df: pd.DataFrame) -> dict:
+    """Forma compacta para devolver una tabla desde otro proceso: cada columna como códigos + valores distintos."""
+    columnas = []
+    for col in df.columns:
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+        columnas.append((col, codes.astype(np.int32), uniques))
+    return {"columnas": columnas, "nombre_columnas": df.columns.name}
+
+def _desempaquetar_tabla(paquete: dict) -> pd.DataFrame:
+    df = pd.DataFrame({col: uniques.take(codes) for col, codes, uniques in paquete["columnas"]})
+    df.columns.name = paquete["nombre_columnas"]
+    return df
+
+def _procesar_hoja_en_proceso(path_xlsx: str, hoja: str, fecha_ref: date,
+                              indice: int, total: int, lector: str, decisiones: dict | None) -> dict:
+    """
+    Trabajo de un proceso del pool: la tabla empaquetada de una hoja, o su error. Parte
+    de una copia del almacén de `decisiones` de canonización del proceso principal (None
+    sin canonización difusa) y le devuelve las nuevas.
+    """
+    try:
+        conocidas = {t: set(d) for t, d in decisiones.items()} if decisiones is not None else {}
+        resumen = {}
+        with abrir_libro(path_xlsx, lector) as libro:
+            tabla, canon, info = _procesar_hoja(hoja, libro["filas"](hoja), resumen, fecha_ref,
+                                                indice=indice, total=total, decisiones=decisiones)
+        nuevas = {t: {k: v for k, v in d.items() if k not in conocidas[t]}
+                  for t, d in (decisiones or {}).items()}
+        return {"hoja": hoja, "tabla": _empaquetar_tabla(tabla), "canon": canon, "resumen": resumen, "info": info,
+                "decisiones": nuevas}
+    except Exception:
+        return {"hoja": hoja, "error": traceback.format_exc()}
+
+def _acumular_resumen(destino: dict, origen: dict) -> None:
+    for k, v in origen.items():
+        if isinstance(v, dict):
+            _acumular_resumen(destino.setdefault(k, {}), v)
+        elif isinstance(v, list):
+            destino.setdefault(k, []).extend(v)
+        else:
+            destino[k] = destino.get(k, 0) + v
+
+def _hojas_en_paralelo(path_xlsx: str, hojas: dict[int, str], total: int, fecha_ref: date,
+                       procesos: int, progreso: Callable[[dict], None] | None,
+                       cancelar: threading.Event | None, lector: str,
+                       recibir: Callable[[int, dict], None] | None = None,
+                       decisiones: dict[str, dict] | None = None) -> dict[int, dict]:
+    """
+    Reparte las hojas ({índice: nombre}) en un pool de procesos. Devuelve, por índice,
+    el resultado de _procesar_hoja_en_proceso (tabla empaquetada o error); una hoja que
+    falla no detiene al resto. `recibir(i, resultado)` se llama con cada hoja sin error
+    apenas termina (puede quitarle la tabla para no acumularlas). Cada proceso recibe
+    una copia de `decisiones` tal como está al empezar.
+    """
+    resultados: dict[int, dict] = {}
+    # 'spawn' en todas las plataformas: no hereda los hilos de la UI
+    contexto = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=min(procesos, len(hojas)), mp_context=contexto)
+    try:
+        copia = copiar_decisiones_canon(decisiones) if decisiones is not None else None
+        futuros = {pool.submit(_procesar_hoja_en_proceso, path_xlsx, hoja, fecha_ref, i, total, lector,
+                               copia): i
+                   for i, hoja in hojas.items()}
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                resultados[i] = futuro.result()
+            except Exception:  # p. ej. el proceso murió (BrokenProcessPool)
+                resultados[i] = {"hoja": hojas[i], "error": traceback.format_exc()}
+            if recibir and "error" not in resultados[i]:
+                recibir(i, resultados[i])
+            if progreso and "info" in resultados[i]:
+                progreso({"evento": "hoja_fin", **resultados[i]["info"]})
+            _revisar_cancelacion(cancelar)
+    finally:
+        # Al cancelar no se esperan las hojas en curso; las pendientes se descartan
+        pool.shutdown(wait=not (cancelar is not None and cancelar.is_set()), cancel_futures=True)
+    return resultados
+
+# ====================== CACHÉ ======================
+# Resultados por hoja (tabla del pivote + resumen + info) guardados en disco, con llave
+# por contenido: los bytes de la hoja en el .xlsx (o del archivo en otros formatos), la
+# huella de las tablas de normalización y el lector. La fecha de referencia no entra en
+# la llave: la tabla guarda fecha_nacimiento y edad/mayor_18 se recalculan al leerla.
+# Los sinónimos de estudio/prueba tampoco: cada entrada guarda los valores de su hoja y
+# sólo se usa si hoy se canonizan igual (huella_canon_hoja).
+VERSION_CACHE = 4                # subir cuando cambie la forma de las tablas del pivote o de info
+CACHE_MAX_BYTES = 512 * 2**20    # tope del directorio; se descartan primero las menos usadas
+# Partes del libro que, además de la hoja, cambian lo que se lee de ella
+_PARTES_COMPARTIDAS = ("xl/workbook.xml", "xl/styles.xml", "xl/sharedStrings.xml")
+
+def directorio_cache_predeterminado() -> Path:
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "redlab_consolidador"
+
+def huella_normalizacion() -> str:
+    """
+    Huella de lo que decide el contenido de cualquier tabla además de los datos. La
+    canonización de estudio/prueba se revisa aparte, por hoja (huella_canon_hoja).
+    """
+    partes = (VERSION_CACHE, SINONIMOS_CABECERA, COLUMNAS_ENTRADA, SERVICIOS_VALIDOS,
+              _RE_SERVICIO.pattern, FORMATOS_FECHA, FORMATOS_FECHA_HORA, want)
+    return hashlib.sha256(repr(partes).encode("utf-8")).hexdigest()
+
+def huella_canon_hoja(valores: dict[str, list], decisiones: dict[str, dict] | None = None) -> str:
+    """
+    Huella de cómo se canonizan hoy los valores de estudio/prueba de una hoja (canónico y
+    decisión difusa de cada uno, con el almacén `decisiones`; sin él, sólo sinónimos
+    exactos). Cambiar un sinónimo, un umbral o prender/apagar la canonización difusa
+    invalida sólo las entradas de las hojas con algún valor afectado.
+    """
+    partes = []
+    for tipo in _TABLAS_CANON:
+        for valor in valores.get(tipo, ()):
+            registro = []
+            partes.append((tipo, valor, canonizar(tipo, valor, registro, decisiones), registro))
+    return hashlib.sha256(repr(partes).encode("utf-8")).hexdigest()
+
+def _bytes_miembro(f, info: zipfile.ZipInfo) -> bytes:
+    """Bytes comprimidos de un miembro del zip, sin descomprimir (basta para la huella)."""
+    f.seek(info.header_offset)
+    cabecera = f.read(30)
+    largo_nombre, largo_extra = struct.unpack("<HH", cabecera[26:30])
+    f.seek(info.header_offset + 30 + largo_nombre + largo_extra)
+    return f.read(info.compress_size)
+
+_NS_LIBRO = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_ATRIB_RID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+def _partes_hojas(zf: zipfile.ZipFile) -> dict[str, str]:
+    """Título → parte del zip de cada hoja de cálculo, en el orden del libro (como wb.worksheets)."""
+    rels = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    destinos = {r.get("Id"): r.get("Target", "") for r in rels.iter(f"{_NS_RELS}Relationship")
+                if r.get("Type", "").endswith("/worksheet")}
+    libro = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    miembros = set(zf.namelist())
+    partes = {}
+    for hoja in libro.iter(f"{_NS_LIBRO}sheet"):
+        destino = destinos.get(hoja.get(_ATRIB_RID))
+        if destino is None:
+            continue
+        parte = destino.lstrip("/") if destino.startswith("/") else posixpath.normpath("xl/" + destino)
+        if parte in miembros:
+            partes[hoja.get("name")] = parte
+    return partes
+
+def llaves_cache_hojas(path_xlsx: str, lector: str | None = None) -> dict[str, str]:
+    """
+    Llave de caché por título de hoja, en el orden del libro. En un .xlsx/.xlsm se lee
+    sólo el índice del zip (sin abrir el libro) y cada hoja tiene su llave; en los demás
+    formatos (.xls, CSV…) la llave es la del archivo completo más el título. Vacío si el
+    archivo no se puede leer: entonces se procesa sin caché. La llave sólo depende del
+    contenido, de la normalización y del lector (no del día: ver recalcular_edades).
+    """
+    lector = elegir_lector(path_xlsx, lector)
+    base = hashlib.sha256(f"{huella_normalizacion()}|{lector}".encode("utf-8"))
+    llaves = {}
+    try:
+        with open(path_xlsx, "rb") as f:
+            if not zipfile.is_zipfile(f) or Path(path_xlsx).suffix.lower() not in (".xlsx", ".xlsm"):
+                return _llaves_archivo_completo(path_xlsx, base, lector)
+            with zipfile.ZipFile(f) as zf:
+                miembros = {info.filename: info for info in zf.infolist()}
+                partes = _partes_hojas(zf)
+                for nombre in _PARTES_COMPARTIDAS:
+                    if nombre in miembros:
+                        base.update(hashlib.sha256(_bytes_miembro(f, miembros[nombre])).digest())
+                for titulo, parte in partes.items():
+                    h = base.copy()
+                    h.update(hashlib.sha256(_bytes_miembro(f, miembros[parte])).digest())
+                    llaves[titulo] = h.hexdigest()
+    except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError, struct.error):
+        return {}
+    return llaves
+
+def _llaves_archivo_completo(path: str, base, lector: str) -> dict[str, str]:
+    contenido = hashlib.sha256()
+    with open(path, "rb") as f:
+        while bloque := f.read(2**20):
+            contenido.update(bloque)
+    base.update(contenido.digest())
+    try:
+        with abrir_libro(path, lector) as libro:
+            hojas = libro["hojas"]
+    except Exception:  # el error sale de nuevo (con su detalle) al procesar el libro
+        return {}
+    llaves = {}
+    for titulo in hojas:
+        h = base.copy()
+        h.update(titulo.encode("utf-8"))
+        llaves[titulo] = h.hexdigest()
+    return llaves
+
+def leer_cache(directorio: Path, llave: str) -> dict | None:
+    ruta = Path(directorio) / f"{llave}.pkl"
+    try:
+        with open(ruta, "rb") as f:
+            entrada = pickle.load(f)
+        os.utime(ruta)  # marca de uso para el descarte LRU
+        return entrada
+    except FileNotFoundError:
+        return None
+    except Exception:  # entrada corrupta o de otra versión: se recalcula
+        ruta.unlink(missing_ok=True)
+        return None
+
+def escribir_cache(directorio: Path, llave: str, entrada: dict,
+                   max_bytes: int = CACHE_MAX_BYTES) -> None:
+    directorio = Path(directorio)
+    try:
+        directorio.mkdir(parents=True, exist_ok=True)
+        tmp = directorio / f"{llave}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(entrada, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, directorio / f"{llave}.pkl")
+        # Descarte LRU: las entradas usadas hace más tiempo salen primero
+        archivos = sorted(((p.stat().st_mtime, p.stat().st_size, p) for p in directorio.glob("*.pkl")),
+                          key=lambda t: t[0])
+        total = sum(t[1] for t in archivos)
+        for _, tam, p in archivos:
+            if total <= max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= tam
+    except OSError as e:  # la caché nunca debe tumbar el proceso
+        warnings.warn(f"No se pudo escribir la caché en {directorio}: {e}")
+
+def tablas_por_hoja(path_xlsx: str, resumen: dict | None = None,
+                    fecha_ref: date | None = None,
+                    procesos: int | None = None,
+                    progreso: Callable[[dict], None] | None = None,
+                    cancelar: threading.Event | None = None,
+                    cache: str | os.PathLike | None = None,
+                    solo: set[str] | None = None,
+                    lector: str | None = None,
+                    destino: Callable[[int, pd.DataFrame], None] | None = None,
+                    canon: dict[str, dict] | None = None,
+                    decisiones: dict[str, dict] | None = None) -> dict[str, pd.DataFrame | None]:
+    """
+    Tabla del pivote de cada hoja del libro ({título: tabla}, en el orden del libro; las
+    hojas omitidas por error no aparecen). Con `solo`, únicamente esas hojas.
+    Con `destino`, cada tabla se entrega a destino(índice de la hoja, tabla) apenas está
+    lista y no se conserva: el dict trae None en su lugar.
+    Con `canon`, recibe por título de hoja sus valores de estudio/prueba y la huella con
+    que se canonizaron ({"valores", "huella"}, ver huella_canon_hoja).
+    `decisiones` es el almacén de canonización difusa de la corrida (None: sólo sinónimos
+    exactos; ver _decisiones_de_corrida). Los demás parámetros son los de
+    consolidar_todas_las_hojas.
+    """
+    fecha_ref = fecha_ref or date.today()  # misma referencia de edad para todas las hojas
+    lector = elegir_lector(path_xlsx, lector)
+    tablas: dict[int, pd.DataFrame | None] = {}
+    metricas: dict[int, dict] = {}
+
+    def guardar(i: int, tabla: pd.DataFrame):
+        if destino is not None:
+            destino(i, tabla)
+            tabla = None
+        tablas[i] = tabla
+
+    llaves = llaves_cache_hojas(path_xlsx, lector) if cache is not None else {}
+    en_cache = {}
+    for hoja, llave in llaves.items():
+        if solo is not None and hoja not in solo:
+            continue
+        t0 = time.perf_counter()
+        entrada = leer_cache(cache, llave)
+        if (entrada is not None
+                and entrada["canon"]["huella"] == huella_canon_hoja(entrada["canon"]["valores"], decisiones)):
+            en_cache[hoja] = (entrada, time.perf_counter() - t0)
+    # Con todas las hojas en caché ni siquiera se abre el libro
+    with ExitStack() as pila:
+        libro = None
+        if not llaves or len(en_cache) < len([h for h in llaves if solo is None or h in solo]):
+            libro = pila.enter_context(abrir_libro(path_xlsx, lector))
+        hojas = libro["hojas"] if libro is not None else list(llaves)
+        if solo is not None:
+            hojas = [h for h in hojas if h in solo]
+        if progreso:
+            progreso({"evento": "inicio", "hojas": hojas, "total": len(hojas)})
+        pendientes = {}
+        for i, hoja in enumerate(hojas):
+            _revisar_cancelacion(cancelar)
+            entrada, segundos = en_cache.get(hoja, (None, 0.0))
+            if entrada is None:
+                pendientes[i] = hoja
+                continue
+            if resumen is not None:
+                _acumular_resumen(resumen, entrada["resumen"])
+            if canon is not None:
+                canon[hoja] = entrada["canon"]
+            # La entrada vale para cualquier día: las edades van contra esta fecha_ref
+            guardar(i, recalcular_edades(_desempaquetar_tabla(entrada["tabla"]), fecha_ref))
+            metricas[i] = {**entrada["info"], "indice": i, "total": len(hojas), "desde_cache": True,
+                           "memoria_delta": None, "tiempos": {**dict.fromkeys(ETAPAS_HOJA, 0.0), "lectura": segundos}}
+            if progreso:
+                progreso({"evento": "hoja_fin", **metricas[i]})
+
+        paralelo = bool(procesos and procesos > 1 and len(pendientes) > 1)
+        for i, hoja in (pendientes.items() if not paralelo else []):
+            _revisar_cancelacion(cancelar)
+            if progreso:
+                progreso({"evento": "hoja", "hoja": hoja, "indice": i, "total": len(hojas)})
+            resumen_hoja = {}
+            try:
+                tabla, canon_hoja, info = _procesar_hoja(hoja, libro["filas"](hoja), resumen_hoja, fecha_ref,
+                                                         progreso, cancelar, i, len(hojas), decisiones)
+            except ProcesoCancelado:
+                raise
+            except Exception:  # como en el pool: una hoja que falla no detiene al resto
+                _omitir_hoja(resumen, hoja, traceback.format_exc())
+                continue
+            if resumen is not None:
+                _acumular_resumen(resumen, resumen_hoja)
+            if canon is not None:
+                canon[hoja] = canon_hoja
+            if hoja in llaves:
+                escribir_cache(cache, llaves[hoja], {"tabla": _empaquetar_tabla(tabla), "canon": canon_hoja,
+                                                     "resumen": resumen_hoja, "info": info})
+            if progreso:
+                progreso({"evento": "hoja_fin", **info})
+            guardar(i, tabla)
+            metricas[i] = info
+
+    if paralelo:
+        def recibir(i: int, r: dict):
+            if r["hoja"] in llaves:
+                escribir_cache(cache, llaves[r["hoja"]], r)
+            guardar(i, _desempaquetar_tabla(r.pop("tabla")))
+
+        resultados = _hojas_en_paralelo(path_xlsx, pendientes, len(hojas), fecha_ref, procesos,
+                                        progreso, cancelar, lector, recibir, decisiones)
+        for i in sorted(resultados):
+            r = resultados[i]
+            if "error" in r:
+                _omitir_hoja(resumen, r["hoja"], r["error"])
+                continue
+            if resumen is not None:
+                _acumular_resumen(resumen, r["resumen"])
+            if canon is not None:
+                canon[r["hoja"]] = r["canon"]
+            if decisiones is not None:
+                incorporar_decisiones_canon(decisiones, r["decisiones"])
+            metricas[i] = r["info"]
+    if resumen is not None:
+        for i in sorted(metricas):
+            _registrar_metricas_hoja(resumen, {"libro": Path(path_xlsx).name, "lector": lector, **metricas[i]})
+    return {hojas[i]: tablas[i] for i in sorted(tablas)}
+
+def _omitir_hoja(resumen: dict | None, hoja: str, error: str) -> None:
+    """Deja el error de una hoja en resumen["errores"] (o lo avisa si no hay resumen)."""
+    if resumen is not None:
+        resumen.setdefault("errores", []).append({"hoja": hoja, "error": error})
+    else:
+        warnings.warn(f"Hoja {hoja!r} omitida por error:\n{error}")
+
+def _registrar_metricas_hoja(resumen: dict, metricas: dict) -> None:
+    """Agrega las métricas de una hoja a resumen["hojas"] y sus segundos a resumen["tiempos"]."""
+    resumen.setdefault("hojas", []).append(metricas)
+    _acumular_resumen(resumen.setdefault("tiempos", {}), metricas["tiempos"])
+
+def reporte_vacio() -> pd.DataFrame:
+    """El reporte sin filas: sólo las columnas fijas y las de `want`."""
+    cols = ["id_trabajador","nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"] + [w[0] for w in want]
+    return pd.DataFrame(columns=cols)
+
+def _reporte_de_tablas(tablas: list[pd.DataFrame], resumen: dict | None,
+                       progreso: Callable[[dict], None] | None,
+                       cancelar: threading.Event | None) -> pd.DataFrame:
+    """Fusiona las tablas de las hojas (en orden de prioridad) y arma el reporte final."""
+    tablas = [t for t in tablas if not t.empty]
+    if not tablas:
+        return reporte_vacio()
+
+    _revisar_cancelacion(cancelar)
+    t0 = time.perf_counter()
+    consolidado = fusionar_tablas(tablas, resumen)
+    t1 = time.perf_counter()
+    final = reducir_a_columnas_solicitadas(consolidado)
+    tiempos = {"consolidación": t1 - t0, "reducción": time.perf_counter() - t1}
+    if resumen is not None:
+        _acumular_resumen(resumen.setdefault("tiempos", {}), tiempos)
+        resumen["filas_reporte"] = resumen.get("filas_reporte", 0) + len(final)
+    if progreso:
+        progreso({"evento": "consolidacion", "filas": len(final), "segundos": sum(tiempos.values()),
+                  "tiempos": tiempos, "grupos_fusionados": consolidado.attrs.get("grupos_fusionados", 0)})
+    return final
+
+def consolidar_todas_las_hojas(path_xlsx: str, resumen: dict | None = None,
+                               fecha_ref: date | None = None,
+                               procesos: int | None = None,
+                               progreso: Callable[[dict], None] | None = None,
+                               cancelar: threading.Event | None = None,
+                               cache: str | os.PathLike | None = None,
+                               lector: str | None = None,
+                               derrame: str | os.PathLike | None = None,
+                               canon_difusa: bool = True) -> pd.DataFrame:
+    """
+    Consolida todas las hojas del libro en el reporte final.
+    `lector` fuerza uno de LECTORES; por omisión, el más rápido instalado que abra el archivo.
+    Con `procesos` > 1 las hojas se procesan en un pool de ese tamaño; el resultado es
+    idéntico al secuencial. En ambos casos una hoja que falla se omite y su error queda
+    en resumen["errores"]; sólo ProcesoCancelado detiene la corrida.
+    `progreso` recibe eventos (dicts con "evento": inicio / hoja / bloque / hoja_fin /
+    consolidacion) con hoja, filas leídas y conservadas y segundos por etapa.
+    Si `cancelar` se activa, la corrida se detiene entre bloques u hojas con ProcesoCancelado.
+    Con `cache` (un directorio), las hojas ya procesadas con el mismo contenido, tablas de
+    normalización y lector se leen de ahí (info["desde_cache"] en hoja_fin), con las
+    edades recalculadas contra `fecha_ref`.
+    En `resumen` quedan además las métricas de cada hoja (resumen["hojas"], las de
+    _procesar_hoja) y los segundos acumulados por etapa (resumen["tiempos"]).
+    Con `derrame` (un directorio), modo fuera de memoria: ver la sección FUERA DE MEMORIA;
+    el reporte es el mismo y resumen["derrame"] resume lo escrito en disco.
+    Con `canon_difusa` en False, estudio y prueba se canonizan sólo con sus sinónimos
+    exactos (sin la sección CANONIZACIÓN DIFUSA).
+    """
+    with _decisiones_de_corrida(cache, canon_difusa) as decisiones:
+        if derrame is not None:
+            with _derrame_temporal(derrame) as d:
+                tablas_por_hoja(path_xlsx, resumen, fecha_ref, procesos, progreso, cancelar, cache, lector=lector,
+                                destino=lambda i, tabla: _derramar_tabla(d, (i,), tabla), decisiones=decisiones)
+                return _reporte_derramado(d, resumen, progreso, cancelar)
+        tablas = tablas_por_hoja(path_xlsx, resumen, fecha_ref, procesos, progreso, cancelar, cache, lector=lector,
+                                 decisiones=decisiones)
+        return _reporte_de_tablas(list(tablas.values()), resumen, progreso, cancelar)
+
+def consolidar_libros(paths: list[str | os.PathLike], resumen: dict | None = None,
+                      fecha_ref: date | None = None,
+                      procesos: int | None = None,
+                      progreso: Callable[[dict], None] | None = None,
+                      cancelar: threading.Event | None = None,
+                      cache: str | os.PathLike | None = None,
+                      lector: str | None = None,
+                      concurrentes: int = LIBROS_CONCURRENTES,
+                      derrame: str | os.PathLike | None = None,
+                      canon_difusa: bool = True) -> pd.DataFrame:
+    """
+    Un solo reporte con las hojas de varios libros: la prioridad entre valores es la de
+    tener todas las hojas en un libro, en el orden de `paths`. Hasta `concurrentes` libros
+    se leen y preparan a la vez; con `procesos`, las hojas de cada libro se reparten ese
+    total de procesos. Un libro que falla no detiene a los demás: queda en
+    resumen["libros_fallidos"] ({"libro", "error"}) y el reporte se arma con el resto.
+    Los eventos de `progreso` llegan de a uno (aunque vengan de varios hilos) y llevan
+    "libro", "indice_libro" y "total_libros"; además hay libro (al empezar cada uno) y
+    libro_fin (hojas, segundos, hojas_omitidas y error o None). Los demás parámetros son
+    los de consolidar_todas_las_hojas.
+    """
+    with _decisiones_de_corrida(cache, canon_difusa) as decisiones:
+        if derrame is not None:
+            with _derrame_temporal(derrame) as d:
+                return _consolidar_libros(paths, resumen, fecha_ref, procesos, progreso, cancelar, cache,
+                                          lector, concurrentes, d, decisiones)
+        return _consolidar_libros(paths, resumen, fecha_ref, procesos, progreso, cancelar, cache,
+                                  lector, concurrentes, None, decisiones)
+
+def _consolidar_libros(paths: list[str | os.PathLike], resumen: dict | None, fecha_ref: date | None,
+                       procesos: int | None, progreso: Callable[[dict], None] | None,
+                       cancelar: threading.Event | None, cache: str | os.PathLike | None,
+                       lector: str | None, concurrentes: int, derrame: dict | None,
+                       decisiones: dict[str, dict] | None) -> pd.DataFrame:
+    fecha_ref = fecha_ref or date.today()  # misma referencia de edad para todos los libros
+    paths = [str(p) for p in paths]
+    if not paths:
+        return _reporte_de_tablas([], resumen, progreso, cancelar)
+    concurrentes = max(1, min(concurrentes, len(paths)))
+    procesos_por_libro = max(1, procesos // concurrentes) if procesos else None
+    candado = threading.Lock()
+
+    def avisar(ev: dict):
+        if progreso:
+            with candado:
+                progreso(ev)
+
+    def leer_libro(k: int, path: str) -> tuple[dict[str, pd.DataFrame], dict, str | None]:
+        _revisar_cancelacion(cancelar)
+        etiqueta = {"libro": path, "indice_libro": k, "total_libros": len(paths)}
+        avisar({"evento": "libro", **etiqueta})
+        resumen_libro, tablas, error = {}, {}, None
+        t0 = time.perf_counter()
+        destino = (lambda i, tabla: _derramar_tabla(derrame, (k, i), tabla)) if derrame is not None else None
+        try:
+            tablas = tablas_por_hoja(path, resumen_libro, fecha_ref, procesos_por_libro,
+                                     lambda ev: avisar({**ev, **etiqueta}), cancelar, cache, lector=lector,
+                                     destino=destino, decisiones=decisiones)
+        except ProcesoCancelado:
+            raise
+        except Exception:
+            error = traceback.format_exc()
+            if derrame is not None:  # como en memoria: un libro que falla no aporta nada
+                _descartar_derrame(derrame, (k,))
+        avisar({"evento": "libro_fin", **etiqueta, "hojas": len(tablas), "segundos": time.perf_counter() - t0,
+                "hojas_omitidas": len(resumen_libro.get("errores", [])), "error": error})
+        return tablas, resumen_libro, error
+
+    resultados: dict[int, tuple] = {}
+    cancelado = False
+    pool = ThreadPoolExecutor(max_workers=concurrentes, thread_name_prefix="libro")
+    try:
+        futuros = {pool.submit(leer_libro, k, path): k for k, path in enumerate(paths)}
+        for futuro in as_completed(futuros):
+            try:
+                resultados[futuros[futuro]] = futuro.result()
+            except ProcesoCancelado:
+                cancelado = True
+    finally:
+        # Al cancelar, los libros en curso se detienen solos en su siguiente revisión
+        pool.shutdown(wait=True, cancel_futures=True)
+    if cancelado or (cancelar is not None and cancelar.is_set()):
+        raise ProcesoCancelado()
+
+    tablas = []
+    for k, path in enumerate(paths):
+        tablas_libro, resumen_libro, error = resultados[k]
+        if resumen is not None:
+            for e in resumen_libro.get("errores", []):
+                e["libro"] = path
+            _acumular_resumen(resumen, resumen_libro)
+            if error is not None:
+                resumen.setdefault("libros_fallidos", []).append({"libro": path, "error": error})
+        elif error is not None:
+            warnings.warn(f"Libro {path!r} omitido por error:\n{error}")
+        tablas.extend(tablas_libro.values())
+    if derrame is not None:
+        return _reporte_derramado(derrame, resumen, avisar if progreso else None, cancelar)
+    return _reporte_de_tablas(tablas, resumen, avisar if progreso else None, cancelar)
+
+# ====================== FUERA DE MEMORIA ======================
+# Con `derrame` (un directorio), la tabla de cada hoja se parte por un hash de la llave
+# persona/evento apenas está lista y va a disco (un archivo por tabla, en piezas de
+# particiones consecutivas empaquetadas por columnas), así que las tablas nunca están
+# todas en memoria. La fusión corre después sobre unas pocas particiones a la vez
+# (fusionar_tablas sobre sus filas, en el orden de las hojas): una llave cae siempre en
+# la misma partición, de modo que el resultado es el mismo que con todo en memoria y el
+# pico lo marca FILAS_FUSION_DERRAME (o la partición más grande, si la supera).
+COLUMNAS_LLAVE = ["nombre","sexo","edad","mayor_18","fecha_nacimiento","servicio_norm","fecha_evento"]
+FILAS_FUSION_DERRAME = 500_000   # filas de las tablas que se fusionan a la vez
+FILAS_PIEZA_DERRAME = 50_000     # filas por pieza en disco (menos piezas = menos costo fijo)
+
+def _hash_valores(serie: pd.Series) -> np.ndarray:
+    """Hash por valor (no por código de categoría): igual para la misma llave en cualquier tabla."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        por_categoria = pd.util.hash_array(np.asarray(serie.cat.categories, dtype=object))
+        return np.append(por_categoria, np.uint64(0))[serie.cat.codes]
+    if pd.api.types.is_integer_dtype(serie.dtype) and not serie.hasnans:
+        return pd.util.hash_array(serie.to_numpy(dtype=np.int64))
+    return pd.util.hash_array(serie.astype(str).to_numpy(dtype=object))
+
+def particion_por_llave(tabla: pd.DataFrame, particiones: int) -> np.ndarray:
+    """Partición (0…particiones-1) de cada fila según COLUMNAS_LLAVE."""
+    h = np.zeros(len(tabla), dtype=np.uint64)
+    for col in COLUMNAS_LLAVE:
+        h = (h * np.uint64(0x100000001B3)) ^ _hash_valores(tabla[col])
+    return (h % np.uint64(particiones)).astype(np.int64)
+
+def _nuevo_derrame(directorio: str | os.PathLike, particiones: int) -> dict:
+    Path(directorio).mkdir(parents=True, exist_ok=True)
+    return {"carpeta": Path(tempfile.mkdtemp(prefix="derrame_", dir=directorio)), "particiones": particiones,
+            "tablas": {}, "nombre_columnas": None, "categorias": {}, "filas": 0, "bytes": 0, "segundos": 0.0,
+            "candado": threading.Lock()}
+
+def _ruta_derrame(derrame: dict, orden: tuple) -> Path:
+    return derrame["carpeta"] / f"tabla_{'_'.join(map(str, orden))}.pkl"
+
+def _derramar_tabla(derrame: dict, orden: tuple, tabla: pd.DataFrame) -> None:
+    """
+    Escribe `tabla` ordenada por partición (estable: dentro de una partición, en su orden
+    original) en piezas de ~FILAS_PIEZA_DERRAME filas, cada una con la partición de sus
+    filas. `orden` (p. ej. (libro, hoja)) es la prioridad de la tabla en la fusión.
+    """
+    if tabla.empty:
+        return
+    t0 = time.perf_counter()
+    particiones = derrame["particiones"]
+    particion = particion_por_llave(tabla, particiones)
+    filas = np.argsort(particion, kind="stable")
+    conteo = np.bincount(particion, minlength=particiones)
+    cortes = np.concatenate([[0], np.cumsum(conteo)])
+    paquete = _empaquetar_tabla(tabla)
+    piezas = []  # (primera partición, última + 1, posición en el archivo)
+    ruta = _ruta_derrame(derrame, orden)
+    with open(ruta, "wb") as f:
+        desde = 0
+        for hasta in range(1, particiones + 1):
+            if hasta < particiones and cortes[hasta] - cortes[desde] < FILAS_PIEZA_DERRAME:
+                continue
+            elegidas = filas[cortes[desde]:cortes[hasta]]
+            if len(elegidas):
+                columnas = []
+                for col, codes, uniques in paquete["columnas"]:
+                    usados, nuevos = np.unique(codes[elegidas], return_inverse=True)
+                    valores = uniques.take(usados)
+                    # Arreglos planos: un Index por columna y pieza cuesta más en pickle que
+                    # los datos mismos cuando las piezas son chicas
+                    categorica = isinstance(valores.dtype, pd.CategoricalDtype)
+                    if categorica or isinstance(valores.dtype, np.dtype):
+                        valores = np.asarray(valores)
+                    elif isinstance(valores, pd.Index):
+                        valores = valores.array
+                    columnas.append((col, nuevos.astype(np.int32), valores, categorica))
+                piezas.append((desde, hasta, f.tell()))
+                pickle.dump({"particion": particion[elegidas].astype(np.int32), "columnas": columnas},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            desde = hasta
+        escritos = f.tell()
+    with derrame["candado"]:
+        derrame["tablas"][orden] = {"conteo": conteo, "piezas": piezas}
+        derrame["nombre_columnas"] = tabla.columns.name
+        for c in tabla.columns:
+            if isinstance(tabla[c].dtype, pd.CategoricalDtype):
+                derrame["categorias"].setdefault(c, set()).update(tabla[c].cat.categories)
+        derrame["filas"] += len(tabla)
+        derrame["bytes"] += escritos
+        derrame["segundos"] += time.perf_counter() - t0
+
+def _leer_derramado(derrame: dict, orden: tuple, desde: int, hasta: int) -> pd.DataFrame | None:
+    """Las filas de la tabla `orden` en las particiones desde…hasta-1 (None si no tiene)."""
+    leidas = []
+    with open(_ruta_derrame(derrame, orden), "rb") as f:
+        for inicio, fin, posicion in derrame["tablas"][orden]["piezas"]:
+            if fin <= desde or inicio >= hasta:
+                continue
+            f.seek(posicion)
+            pieza = pickle.load(f)
+            df = pd.DataFrame({col: (pd.Categorical(valores) if categorica else valores).take(codes)
+                               for col, codes, valores, categorica in pieza["columnas"]})
+            if inicio < desde or fin > hasta:
+                particion = pieza["particion"]
+                df = df[(particion >= desde) & (particion < hasta)]
+            leidas.append(df)
+    if not leidas:
+        return None
+    df = concatenar_tablas(leidas, ignore_index=True) if len(leidas) > 1 else leidas[0].reset_index(drop=True)
+    df.columns.name = derrame["nombre_columnas"]
+    return df
+
+def _descartar_derrame(derrame: dict, prefijo: tuple) -> None:
+    """Olvida las tablas cuyo orden empieza con `prefijo` (p. ej. las de un libro que falló)."""
+    with derrame["candado"]:
+        for orden in [o for o in derrame["tablas"] if o[:len(prefijo)] == prefijo]:
+            del derrame["tablas"][orden]
+            _ruta_derrame(derrame, orden).unlink(missing_ok=True)
+
+def _grupos_de_particiones(derrame: dict, max_filas: int) -> list[tuple[int, int]]:
+    """Rangos de particiones consecutivas con hasta `max_filas` (una partición nunca se parte)."""
+    filas = sum(t["conteo"] for t in derrame["tablas"].values())
+    grupos, desde, en_grupo = [], 0, 0
+    for p in range(derrame["particiones"]):
+        if en_grupo and en_grupo + filas[p] > max_filas:
+            grupos.append((desde, p))
+            desde, en_grupo = p, 0
+        en_grupo += int(filas[p])
+    return grupos + [(desde, derrame["particiones"])]
+
+def _reporte_derramado(derrame: dict, resumen: dict | None,
+                       progreso: Callable[[dict], None] | None,
+                       cancelar: threading.Event | None) -> pd.DataFrame:
+    """_reporte_de_tablas sobre las tablas derramadas, fusionando unas particiones a la vez."""
+    if not derrame["tablas"]:
+        return _reporte_de_tablas([], resumen, progreso, cancelar)
+    t0 = time.perf_counter()
+    resumen_fusion = {}
+    fusionadas, max_filas = [], 0
+    grupos = _grupos_de_particiones(derrame, FILAS_FUSION_DERRAME)
+    for desde, hasta in grupos:
+        _revisar_cancelacion(cancelar)
+        partes = [t for t in (_leer_derramado(derrame, orden, desde, hasta) for orden in sorted(derrame["tablas"]))
+                  if t is not None]
+        max_filas = max(max_filas, sum(len(t) for t in partes))
+        fusionadas.append(fusionar_tablas(partes, resumen_fusion))
+    # Orden global del reporte: el de groupby(sort=True) sobre la llave, con las
+    # categorías de todas las tablas (ordenadas, como las deja concatenar_tablas)
+    consolidado = concatenar_tablas(fusionadas, ignore_index=True)
+    for c, categorias in derrame["categorias"].items():
+        if c in consolidado.columns:
+            consolidado[c] = consolidado[c].cat.set_categories(sorted(categorias))
+    consolidado = consolidado.sort_values(COLUMNAS_LLAVE, kind="stable", ignore_index=True)
+    consolidado.attrs["grupos_fusionados"] = resumen_fusion.get("grupos_fusionados", 0)
+    t1 = time.perf_counter()
+    final = reducir_a_columnas_solicitadas(consolidado)
+    tiempos = {"consolidación": t1 - t0, "reducción": time.perf_counter() - t1}
+    if resumen is not None:
+        _acumular_resumen(resumen.setdefault("tiempos", {}), {**tiempos, "derrame": derrame["segundos"]})
+        resumen["grupos_fusionados"] = resumen.get("grupos_fusionados", 0) + consolidado.attrs["grupos_fusionados"]
+        resumen["filas_reporte"] = resumen.get("filas_reporte", 0) + len(final)
+        resumen["derrame"] = {"particiones": derrame["particiones"], "fusiones": len(grupos),
+                              "filas": derrame["filas"], "bytes": derrame["bytes"],
+                              "max_filas_fusion": max_filas}
+    if progreso:
+        progreso({"evento": "consolidacion", "filas": len(final), "segundos": sum(tiempos.values()),
+                  "tiempos": tiempos, "grupos_fusionados": consolidado.attrs["grupos_fusionados"]})
+    return final
+
+@contextmanager
+def _derrame_temporal(directorio: str | os.PathLike, particiones: int = PARTICIONES_DERRAME) -> Iterator[dict]:
+    derrame = _nuevo_derrame(directorio, particiones)
+    try:
+        yield derrame
+    finally:
+        shutil.rmtree(derrame["carpeta"], ignore_errors=True)
+
+# ====================== ALMACÉN INCREMENTAL ======================
+# Directorio con la tabla del pivote de cada hoja ya procesada (hojas/<llave>.pkl, llave
+# por contenido sin fecha de referencia), manifiesto.json con los libros en el orden en
+# que se agregaron y, por hoja, su llave junto a los valores de estudio/prueba y su huella
+# de canonización, e ids.pkl con el id_trabajador de cada persona/evento.
+# Los libros se registran por ruta: volver a agregar la misma ruta reemplaza sus hojas en
+# su lugar. Un libro renombrado o movido (ruta nueva, la anterior ya no existe, mismas
+# hojas) conserva el lugar del registrado; cualquier otra ruta nueva es un libro más al
+# final. Las hojas se guardan por contenido, así que en ningún caso se reprocesa una hoja
+# que ya está en el almacén, y los ids tampoco dependen de la ruta.
+VERSION_ALMACEN = 3
+LLAVE_PERSONA_EVENTO = ["nombre","sexo","fecha_nacimiento","servicio_norm","fecha_evento"]
+
+def _guardar_atomico(ruta: Path, escribir: Callable) -> None:
+    tmp = ruta.with_name(f"{ruta.name}.{os.getpid()}.tmp")
+    escribir(tmp)
+    os.replace(tmp, ruta)
+
+def _leer_manifiesto(almacen: Path) -> dict:
+    ruta = almacen / "manifiesto.json"
+    if not ruta.exists():
+        return {"version": VERSION_ALMACEN, "libros": []}
+    with open(ruta, encoding="utf-8") as f:
+        manifiesto = json.load(f)
+    if manifiesto.get("version") != VERSION_ALMACEN:
+        raise ValueError(f"{ruta}: versión de almacén {manifiesto.get('version')!r} no soportada")
+    return manifiesto
+
+def recalcular_edades(tabla: pd.DataFrame, fecha_ref: date) -> pd.DataFrame:
+    """edad y mayor_18 de nuevo contra `fecha_ref`, a partir de fecha_nacimiento (ISO)."""
+    if tabla.empty:
+        return tabla
+    codes, _, nacimiento = _parse_fechas_codigos(tabla["fecha_nacimiento"])
+    edades = calcular_edades(nacimiento, fecha_ref)
+    return tabla.assign(edad=edades[codes], mayor_18=_mayor_18(edades, codes))
+
+def _hoja_vigente(almacen: Path, hoja: dict | None, decisiones: dict[str, dict] | None) -> bool:
+    """La hoja del manifiesto sigue valiendo: su tabla está y sus valores se canonizan hoy igual."""
+    if hoja is None or not (almacen / "hojas" / f"{hoja['llave']}.pkl").exists():
+        return False
+    return hoja["canon"]["huella"] == huella_canon_hoja(hoja["canon"]["valores"], decisiones)
+
+def _libro_movido(manifiesto: dict, llaves: dict[str, str]) -> dict | None:
+    """El libro registrado con las mismas hojas cuyo archivo ya no está (renombrado o movido)."""
+    for libro in manifiesto["libros"]:
+        if ({hoja: h["llave"] for hoja, h in libro["hojas"].items()} == llaves
+                and not Path(libro["archivo"]).exists()):
+            return libro
+    return None
+
+def asignar_ids_estables(final: pd.DataFrame, almacen: Path) -> pd.DataFrame:
+    """
+    id_trabajador por LLAVE_PERSONA_EVENTO: la que ya tenía id lo conserva, las nuevas
+    reciben los siguientes números en el orden del reporte. Los ids no se reutilizan.
+    """
+    ruta = Path(almacen) / "ids.pkl"
+    previos = (pd.read_pickle(ruta) if ruta.exists()
+               else pd.DataFrame({c: pd.Series(dtype=object) for c in LLAVE_PERSONA_EVENTO}
+                                 | {"id_trabajador": pd.Series(dtype=np.int64)}))
+    llaves = final[LLAVE_PERSONA_EVENTO].astype(str)
+    ids = llaves.merge(previos, how="left", on=LLAVE_PERSONA_EVENTO)["id_trabajador"]
+    nuevos = ids.isna().to_numpy()
+    siguiente = int(previos["id_trabajador"].max()) + 1 if len(previos) else 1
+    ids = ids.to_numpy(dtype=np.float64)
+    ids[nuevos] = np.arange(siguiente, siguiente + nuevos.sum())
+    final = final.copy()
+    final["id_trabajador"] = ids.astype(np.int64)
+    if nuevos.any():
+        agregados = llaves[nuevos].assign(id_trabajador=final["id_trabajador"].to_numpy()[nuevos])
+        todos = pd.concat([previos, agregados], ignore_index=True)
+        _guardar_atomico(ruta, todos.to_pickle)
+    return final
+
+def consolidar_incremental(paths: list[str | os.PathLike], almacen: str | os.PathLike,
+                           resumen: dict | None = None,
+                           fecha_ref: date | None = None,
+                           procesos: int | None = None,
+                           progreso: Callable[[dict], None] | None = None,
+                           cancelar: threading.Event | None = None,
+                           cache: str | os.PathLike | None = None,
+                           lector: str | None = None,
+                           canon_difusa: bool = True) -> pd.DataFrame:
+    """
+    Agrega libros al almacén y devuelve el reporte de todo lo acumulado.
+    Sólo se procesan las hojas que no están en el almacén o cuya normalización o
+    canonización de valores de estudio/prueba cambió; un libro ya registrado (o
+    renombrado, ver arriba) conserva su lugar, así que la prioridad entre valores es la
+    de haber consolidado todos los libros juntos en el orden en que llegaron.
+    Las edades se recalculan contra `fecha_ref` y id_trabajador es estable entre corridas,
+    también si un libro cambia de nombre.
+    resumen["hojas_procesadas"] / ["hojas_sin_cambios"] cuentan lo hecho en esta corrida.
+    Los demás parámetros son los de consolidar_todas_las_hojas.
+    """
+    almacen = Path(almacen)
+    (almacen / "hojas").mkdir(parents=True, exist_ok=True)
+    fecha_ref = fecha_ref or date.today()
+    manifiesto = _leer_manifiesto(almacen)
+    libros = {libro["archivo"]: libro for libro in manifiesto["libros"]}
+    procesadas = sin_cambios = 0
+    with _decisiones_de_corrida(cache, canon_difusa) as decisiones:
+        for path in paths:
+            archivo = str(Path(path).resolve())
+            llaves = llaves_cache_hojas(archivo, lector)
+            if not llaves:
+                raise ValueError(f"{path}: no se encontraron hojas en el libro")
+            guardadas = {h["llave"]: h for libro in manifiesto["libros"] for h in libro["hojas"].values()}
+            hojas = {hoja: guardadas.get(llave) for hoja, llave in llaves.items()}
+            cambiadas = {hoja for hoja, guardada in hojas.items() if not _hoja_vigente(almacen, guardada, decisiones)}
+            tablas = {}
+            if cambiadas:
+                canon = {}
+                tablas = tablas_por_hoja(archivo, resumen, fecha_ref, procesos, progreso, cancelar, cache,
+                                         solo=cambiadas, lector=lector, canon=canon, decisiones=decisiones)
+                for hoja, tabla in tablas.items():
+                    _guardar_atomico(almacen / "hojas" / f"{llaves[hoja]}.pkl",
+                                     lambda ruta, t=_empaquetar_tabla(tabla): pd.to_pickle(t, ruta))
+                    hojas[hoja] = {"llave": llaves[hoja], "canon": canon[hoja]}
+            procesadas += len(tablas)
+            sin_cambios += len(llaves) - len(cambiadas)
+            if archivo not in libros:
+                libro = _libro_movido(manifiesto, llaves)
+                if libro is None:
+                    libro = {}
+                    manifiesto["libros"].append(libro)
+                else:
+                    del libros[libro["archivo"]]
+                libro["archivo"] = archivo
+                libros[archivo] = libro
+            # Una hoja cambiada que falló no se registra: se reintenta en la próxima corrida
+            libros[archivo]["hojas"] = {hoja: guardada for hoja, guardada in hojas.items()
+                                        if hoja not in cambiadas or hoja in tablas}
+
+    _guardar_atomico(almacen / "manifiesto.json",
+                     lambda ruta: ruta.write_text(json.dumps(manifiesto, ensure_ascii=False, indent=1),
+                                                  encoding="utf-8"))
+    usadas = {h["llave"] for libro in manifiesto["libros"] for h in libro["hojas"].values()}
+    for ruta in (almacen / "hojas").glob("*.pkl"):
+        if ruta.stem not in usadas:
+            ruta.unlink(missing_ok=True)
+    if resumen is not None:
+        resumen["hojas_procesadas"] = resumen.get("hojas_procesadas", 0) + procesadas
+        resumen["hojas_sin_cambios"] = resumen.get("hojas_sin_cambios", 0) + sin_cambios
+
+    tablas = []
+    for libro in manifiesto["libros"]:
+        for hoja in libro["hojas"].values():
+            tabla = _desempaquetar_tabla(pd.read_pickle(almacen / "hojas" / f"{hoja['llave']}.pkl"))
+            if not tabla.empty:
+                tablas.append(recalcular_edades(tabla, fecha_ref))
+    final = _reporte_de_tablas(tablas, resumen, progreso, cancelar)
+    return asignar_ids_estables(final, almacen) if not final.empty else final
+
+# ====================== EXPORTACIÓN ======================
+# Escritura por lotes (memoria constante) con avance real: `progreso` recibe
+# {"evento": "exportacion", "filas": escritas, "total": n, "formato": ...} tras cada lote.
+FILAS_POR_LOTE_EXPORTACION = 20_000
+FILAS_MAX_HOJA_EXCEL = 1_048_576   # incluye la fila de cabecera
+FORMATOS_EXPORTACION = {".xlsx": "xlsx", ".csv": "csv", ".parquet": "parquet"}
+
+def formatos_exportacion_disponibles() -> list[str]:
+    """Formatos que se pueden escribir con lo instalado (Parquet requiere pyarrow)."""
+    return ["xlsx", "csv"] + (["parquet"] if importlib.util.find_spec("pyarrow") else [])
+
+def _lotes_exportacion(df: pd.DataFrame, cancelar: threading.Event | None) -> Iterator[tuple[int, pd.DataFrame]]:
+    for inicio in range(0, len(df), FILAS_POR_LOTE_EXPORTACION):
+        _revisar_cancelacion(cancelar)
+        yield inicio, df.iloc[inicio:inicio + FILAS_POR_LOTE_EXPORTACION]
+
+def _filas_python(lote: pd.DataFrame) -> list[list]:
+    """Filas del lote como listas de valores Python; nulos (NaN/NA) como None."""
+    valores = lote.astype(object)
+    return valores.where(valores.notna(), None).to_numpy().tolist()
+
+def _avisar_exportacion(progreso: Callable[[dict], None] | None, filas: int, total: int, formato: str) -> None:
+    if progreso:
+        progreso({"evento": "exportacion", "filas": filas, "total": total, "formato": formato})
+
+# Caracteres de control que XML 1.0 (y por tanto .xlsx) no admite
+_RE_CONTROL_XML = r"[\x00-\x08\x0b\x0c\x0e-\x1f]"
+
+def _filas_excel(lote: pd.DataFrame) -> tuple[list[tuple], dict[str, int]]:
+    """
+    Filas del lote para la hoja: vacíos, nulos y números no finitos sin celda; el texto sin
+    los caracteres de control que .xlsx no admite. Devuelve también, por columna, cuántas
+    celdas perdieron alguno.
+    """
+    columnas, cambiadas = [], {}
+    for c in lote.columns:
+        col = lote[c]
+        if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+            vacias = col.isna().to_numpy() | ~np.isfinite(col.to_numpy(dtype=np.float64, na_value=0.0))
+            valores = col.astype(object).where(~vacias, None)
+        else:
+            texto = col.astype(object).where(col.notna(), "").astype(str)
+            limpio = texto.str.replace(_RE_CONTROL_XML, "", regex=True)
+            n = int((limpio != texto).sum())
+            if n:
+                cambiadas[str(c)] = n
+            valores = limpio.where(limpio != "", None)
+        columnas.append(valores.tolist())
+    return list(zip(*columnas)), cambiadas
+
+# Los escritores reciben las columnas, el total de filas y los lotes (inicio, DataFrame):
+# así exportan igual un DataFrame en memoria que una consulta a la base de resultados.
+def _escribir_excel(ruta: str | os.PathLike, columnas: list, total: int,
+                    lotes: Iterator[tuple[int, pd.DataFrame]],
+                    progreso: Callable[[dict], None] | None) -> None:
+    por_hoja = FILAS_MAX_HOJA_EXCEL - 1
+    cabecera = [str(c) for c in columnas]
+    ultima_columna = get_column_letter(max(len(columnas), 1))
+    wb = Workbook(write_only=True)
+
+    def nueva_hoja():
+        k = len(wb.worksheets)
+        hoja = wb.create_sheet("REPORTE" if not k else f"REPORTE_{k + 1}")
+        # La hoja de sólo escritura no lleva <dimension>; su rango se conoce por `total`
+        filas = 1 + max(0, min(por_hoja, total - k * por_hoja))
+        hoja.calculate_dimension = lambda: f"A1:{ultima_columna}{filas}"
+        hoja.append(cabecera)
+        return hoja
+
+    hoja, en_hoja = None, por_hoja
+    cambiadas = {}
+    try:
+        for inicio, lote in lotes:
+            filas, cambios = _filas_excel(lote)
+            for col, n in cambios.items():
+                cambiadas[col] = cambiadas.get(col, 0) + n
+            for fila in filas:
+                if en_hoja == por_hoja:
+                    hoja, en_hoja = nueva_hoja(), 0
+                hoja.append(fila)
+                en_hoja += 1
+            _avisar_exportacion(progreso, inicio + len(lote), total, "xlsx")
+        if hoja is None:  # sin filas: sólo la cabecera
+            nueva_hoja()
+        wb.save(ruta)
+    except BaseException:
+        Path(ruta).unlink(missing_ok=True)
+        raise
+    if cambiadas:
+        detalle = ", ".join(f"{col}: {n}" for col, n in cambiadas.items())
+        warnings.warn(f"{ruta}: se quitaron caracteres de control (no admitidos en .xlsx) "
+                      f"de {sum(cambiadas.values())} celda(s) ({detalle})")
+
+def _escribir_csv(ruta: str | os.PathLike, columnas: list, total: int,
+                  lotes: Iterator[tuple[int, pd.DataFrame]],
+                  progreso: Callable[[dict], None] | None) -> None:
+    try:
+        with open(ruta, "w", encoding="utf-8-sig", newline="") as f:
+            cabecera = True
+            for inicio, lote in lotes:
+                lote.to_csv(f, index=False, header=cabecera)
+                cabecera = False
+                _avisar_exportacion(progreso, inicio + len(lote), total, "csv")
+            if cabecera:  # sin filas: sólo la cabecera
+                pd.DataFrame(columns=columnas).to_csv(f, index=False)
+    except BaseException:
+        Path(ruta).unlink(missing_ok=True)
+        raise
+
+def _escribir_parquet(ruta: str | os.PathLike, columnas: list, total: int,
+                      lotes: Iterator[tuple[int, pd.DataFrame]],
+                      progreso: Callable[[dict], None] | None) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Exportar a Parquet requiere pyarrow (pip install pyarrow).") from None
+    escritor = None
+    try:
+        for inicio, lote in lotes:
+            if escritor is None:
+                # Esquema del primer lote; una columna de texto aún sin valores sería de tipo null
+                esquema = pa.Schema.from_pandas(lote, preserve_index=False)
+                for i, campo in enumerate(esquema):
+                    if pa.types.is_null(campo.type):
+                        esquema = esquema.set(i, campo.with_type(pa.string()))
+                escritor = pq.ParquetWriter(str(ruta), esquema)
+            escritor.write_table(pa.Table.from_pandas(lote, schema=esquema, preserve_index=False))
+            _avisar_exportacion(progreso, inicio + len(lote), total, "parquet")
+        if escritor is None:
+            pq.write_table(pa.table({str(c): pa.array([], pa.string()) for c in columnas}), str(ruta))
+        else:
+            escritor.close()
+    except BaseException:
+        if escritor is not None:
+            escritor.close()
+        Path(ruta).unlink(missing_ok=True)
+        raise
+
+def exportar_excel(df: pd.DataFrame, ruta: str | os.PathLike,
+                   progreso: Callable[[dict], None] | None = None,
+                   cancelar: threading.Event | None = None) -> None:
+    """
+    Escribe el reporte en la hoja REPORTE de `ruta` con un libro openpyxl de sólo escritura,
+    así que la memoria no crece con el tamaño del reporte. Por encima del límite de filas
+    de Excel sigue en REPORTE_2, REPORTE_3…, cada una con su cabecera. Los caracteres de
+    control que .xlsx no admite se quitan con un aviso (warnings) que dice cuántas celdas.
+    """
+    _escribir_excel(ruta, list(df.columns), len(df), _lotes_exportacion(df, cancelar), progreso)
+
+def exportar_csv(df: pd.DataFrame, ruta: str | os.PathLike,
+                 progreso: Callable[[dict], None] | None = None,
+                 cancelar: threading.Event | None = None) -> None:
+    """CSV UTF-8 con BOM (Excel lo abre con acentos correctos), escrito por lotes."""
+    _escribir_csv(ruta, list(df.columns), len(df), _lotes_exportacion(df, cancelar), progreso)
+
+def exportar_parquet(df: pd.DataFrame, ruta: str | os.PathLike,
+                     progreso: Callable[[dict], None] | None = None,
+                     cancelar: threading.Event | None = None) -> None:
+    """Parquet (requiere pyarrow), un row group por lote."""
+    _escribir_parquet(ruta, list(df.columns), len(df), _lotes_exportacion(df, cancelar), progreso)
+
+_EXPORTADORES = {"xlsx": exportar_excel, "csv": exportar_csv, "parquet": exportar_parquet}
+_ESCRITORES = {"xlsx": _escribir_excel, "csv": _escribir_csv, "parquet": _escribir_parquet}
+
+def _formato_exportacion(ruta: str | os.PathLike, formato: str | None) -> str:
+    formato = formato or FORMATOS_EXPORTACION.get(Path(ruta).suffix.lower(), "xlsx")
+    if formato not in _EXPORTADORES:
+        raise ValueError(f"Formato de exportación desconocido: {formato!r}")
+    return formato
+
+def exportar(df: pd.DataFrame, ruta: str | os.PathLike, formato: str | None = None,
+             progreso: Callable[[dict], None] | None = None,
+             cancelar: threading.Event | None = None) -> None:
+    """
+    Exporta el reporte; sin `formato`, se deduce de la extensión (xlsx por omisión).
+    Si `cancelar` se activa entre lotes, se borra el archivo parcial y se lanza ProcesoCancelado.
+    """
+    _EXPORTADORES[_formato_exportacion(ruta, formato)](df, ruta, progreso, cancelar)
+
+# ====================== FILTROS ======================
+# Filtros sobre un resultado ya consolidado, en memoria (indices_filtro + filtrar) o en la
+# base de resultados (consultar_base / contar_base / exportar_desde_base). Mismo dict:
+#   "servicio_norm" / "sexo" / "mayor_18": lista de valores aceptados
+#   "fecha_desde" / "fecha_hasta": rango inclusivo de fecha_evento (AAAA-MM-DD)
+#   "nombre": prefijo del nombre, sin distinguir mayúsculas ni acentos
+#   "con_valor": columnas de `want` que deben tener valor
+# Una clave con None, "" o [] no filtra.
+COLUMNAS_FILTRO_CATEGORIA = ["servicio_norm","sexo","mayor_18"]
+_MAXIMO_UNICODE = "\U0010ffff"  # cota superior de las claves que empiezan con un prefijo
+
+def clave_nombre(texto) -> str:
+    """Forma de comparación del nombre para el filtro por prefijo."""
+    return _RE_ESPACIOS.sub(" ", _unidecode_local(texto).casefold()).lstrip()
+
+def filtros_activos(filtros: dict | None) -> dict:
+    return {k: v for k, v in (filtros or {}).items() if v is not None and v != "" and v != []}
+
+def _indice_rango(serie: pd.Series, clave: Callable[[object], str]) -> tuple[np.ndarray, np.ndarray]:
+    """Claves ordenadas y código de cada fila: un rango de claves es un rango de códigos."""
+    cat = mapear_categorias(serie, clave).array
+    return np.asarray(cat.categories, dtype=str), cat.codes
+
+def indices_filtro(df: pd.DataFrame) -> dict:
+    """
+    Índices para filtrar `df` sin recorrer sus valores: una máscara por categoría de
+    COLUMNAS_FILTRO_CATEGORIA, claves ordenadas de fecha_evento y de nombre (rango y
+    prefijo con searchsorted) y la máscara "tiene valor" de cada columna de `want`.
+    """
+    indices = {"filas": len(df), "categorias": {}, "rangos": {}, "con_valor": {}}
+    for col in COLUMNAS_FILTRO_CATEGORIA:
+        if col in df.columns:
+            cat = df[col].array if isinstance(df[col].dtype, pd.CategoricalDtype) else como_categoria(df[col])
+            indices["categorias"][col] = {valor: cat.codes == i for i, valor in enumerate(cat.categories)}
+    if "fecha_evento" in df.columns:
+        indices["rangos"]["fecha_evento"] = _indice_rango(df["fecha_evento"], str)
+    if "nombre" in df.columns:
+        indices["rangos"]["nombre"] = _indice_rango(df["nombre"], clave_nombre)
+    for col, _ in want:
+        if col in df.columns:
+            # mascara_llenos sobre los valores distintos; el código -1 (nulo) cae en el False del final
+            codes, distintos = pd.factorize(df[col])
+            llenos = mascara_llenos(pd.DataFrame({col: pd.Series(distintos, dtype=object)}))[col].to_numpy()
+            indices["con_valor"][col] = np.append(llenos, False)[codes]
+    return indices
+
+def valores_filtro(indices: dict) -> dict[str, list]:
+    """Valores que se pueden elegir en cada filtro por categoría."""
+    return {col: [v for v, mascara in mapas.items() if mascara.any()] for col, mapas in indices["categorias"].items()}
+
+def filtrar(indices: dict, filtros: dict | None) -> np.ndarray | None:
+    """Posiciones (ascendentes) de las filas que cumplen `filtros`; None si no filtra nada."""
+    filtros = filtros_activos(filtros)
+    mascaras = []
+    for clave, valor in filtros.items():
+        if clave in COLUMNAS_FILTRO_CATEGORIA:
+            por_valor = indices["categorias"].get(clave, {})
+            mascara = np.zeros(indices["filas"], dtype=bool)
+            for v in valor:
+                if v in por_valor:
+                    mascara |= por_valor[v]
+            mascaras.append(mascara)
+        elif clave == "con_valor":
+            for col in valor:
+                if col not in indices["con_valor"]:
+                    raise ValueError(f"Columna sin filtro de valor: {col!r}")
+                mascaras.append(indices["con_valor"][col])
+        elif clave not in ("fecha_desde", "fecha_hasta", "nombre"):
+            raise ValueError(f"Filtro desconocido: {clave!r}")
+    if "fecha_desde" in filtros or "fecha_hasta" in filtros:
+        claves, codes = indices["rangos"]["fecha_evento"]
+        # Sin fecha ("") no entra en ningún rango
+        i = (np.searchsorted(claves, str(filtros["fecha_desde"]), "left") if "fecha_desde" in filtros
+             else np.searchsorted(claves, "", "right"))
+        j = np.searchsorted(claves, str(filtros["fecha_hasta"]), "right") if "fecha_hasta" in filtros else len(claves)
+        mascaras.append((codes >= i) & (codes < j))
+    if "nombre" in filtros:
+        prefijo = clave_nombre(filtros["nombre"])
+        if prefijo:
+            claves, codes = indices["rangos"]["nombre"]
+            i, j = np.searchsorted(claves, [prefijo, prefijo + _MAXIMO_UNICODE], "left")
+            mascaras.append((codes >= i) & (codes < j))
+    if not mascaras:
+        return None
+    mascara = mascaras[0].copy()
+    for m in mascaras[1:]:
+        mascara &= m
+    return np.flatnonzero(mascara)
+
+# ====================== BASE DE RESULTADOS ======================
+# Base SQLite local con los reportes ya consolidados: la tabla `resultados` lista cada
+# reporte guardado (nombre, fecha, libros de origen, columnas con su dtype) y cada uno
+# vive en reporte_<id>, con _fila = posición en el reporte (y _nombre_clave para el
+# filtro por nombre, fuera de las columnas del reporte). La vista previa y la
+# exportación consultan por páginas o lotes, sin cargar el reporte entero en memoria.
+VERSION_BASE = 2
+COLUMNAS_INDICE_BASE = ["servicio_norm","fecha_evento","fecha_nacimiento","nombre"]
+COLUMNA_CLAVE_NOMBRE = "_nombre_clave"   # clave_nombre(nombre), indexada para el filtro por prefijo
+
+def ruta_base_predeterminada() -> Path:
+    return directorio_cache_predeterminado().parent / "redlab_resultados.sqlite"
+
+def _identificador(nombre: str) -> str:
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+def _tabla_resultado(resultado: int) -> str:
+    return f"reporte_{int(resultado)}"
+
+def _conectar_base(ruta_db: str | os.PathLike) -> sqlite3.Connection:
+    ruta = Path(ruta_db)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    # Transacciones explícitas (BEGIN/COMMIT): el módulo no abre ninguna por su cuenta
+    con = sqlite3.connect(ruta, isolation_level=None)
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, VERSION_BASE):
+        con.close()
+        raise ValueError(f"{ruta}: versión de base {version} no soportada")
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    if version == 0:
+        con.execute("""CREATE TABLE IF NOT EXISTS resultados (
+                           id INTEGER PRIMARY KEY, nombre TEXT NOT NULL, creado TEXT NOT NULL,
+                           origenes TEXT NOT NULL, columnas TEXT NOT NULL, filas INTEGER NOT NULL)""")
+        con.execute(f"PRAGMA user_version={VERSION_BASE}")
+    return con
+
+def _tipo_sqlite(dtype) -> str:
+    if pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+def guardar_en_base(df: pd.DataFrame, ruta_db: str | os.PathLike, nombre: str,
+                    origenes: list[str | os.PathLike] = (),
+                    progreso: Callable[[dict], None] | None = None,
+                    cancelar: threading.Event | None = None) -> int:
+    """
+    Guarda el reporte en la base y devuelve su id. Todo va en una transacción: inserciones
+    por lotes con executemany y los índices (COLUMNAS_INDICE_BASE) al final, sobre los datos
+    ya cargados. Si falla o se cancela no queda nada a medias.
+    `progreso` recibe {"evento": "base", "filas": guardadas, "total": n} tras cada lote.
+    """
+    con = _conectar_base(ruta_db)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        columnas = [{"nombre": str(c), "tipo": str(df[c].dtype)} for c in df.columns]
+        resultado = con.execute(
+            "INSERT INTO resultados (nombre, creado, origenes, columnas, filas) VALUES (?, ?, ?, ?, ?)",
+            (nombre, datetime.now().isoformat(timespec="seconds"),
+             json.dumps([str(p) for p in origenes], ensure_ascii=False),
+             json.dumps(columnas, ensure_ascii=False), len(df))).lastrowid
+        tabla = _tabla_resultado(resultado)
+        definicion = ", ".join(f"{_identificador(c)} {_tipo_sqlite(df[c].dtype)}" for c in df.columns)
+        con.execute(f"CREATE TABLE {tabla} (_fila INTEGER PRIMARY KEY, {definicion}, {COLUMNA_CLAVE_NOMBRE} TEXT)")
+        insertar = f"INSERT INTO {tabla} VALUES ({', '.join(['?'] * (len(df.columns) + 2))})"
+        claves = (mapear_categorias(df["nombre"], clave_nombre).to_numpy(dtype=object) if "nombre" in df.columns
+                  else np.full(len(df), None, dtype=object))
+        for inicio, lote in _lotes_exportacion(df, cancelar):
+            clave = claves[inicio:inicio + len(lote)]
+            con.executemany(insertar, ([inicio + i, *fila, clave[i]] for i, fila in enumerate(_filas_python(lote))))
+            if progreso:
+                progreso({"evento": "base", "filas": inicio + len(lote), "total": len(df)})
+        for c in COLUMNAS_INDICE_BASE + [COLUMNA_CLAVE_NOMBRE]:
+            if c in df.columns or c == COLUMNA_CLAVE_NOMBRE:
+                con.execute(f"CREATE INDEX {tabla}_{c.strip('_')} ON {tabla} ({_identificador(c)})")
+        _revisar_cancelacion(cancelar)
+        con.execute("COMMIT")
+    except BaseException:
+        if con.in_transaction:  # si BEGIN falló no hay nada que deshacer; queda el error original
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+    return resultado
+
+def listar_resultados(ruta_db: str | os.PathLike) -> list[dict]:
+    """Reportes guardados, el más reciente primero (sin leer sus filas)."""
+    if not Path(ruta_db).exists():
+        return []
+    con = _conectar_base(ruta_db)
+    try:
+        filas = con.execute("SELECT id, nombre, creado, origenes, filas FROM resultados ORDER BY id DESC").fetchall()
+    finally:
+        con.close()
+    return [{"id": i, "nombre": nombre, "creado": creado, "origenes": json.loads(origenes), "filas": n}
+            for i, nombre, creado, origenes, n in filas]
+
+def borrar_resultado(ruta_db: str | os.PathLike, resultado: int) -> None:
+    con = _conectar_base(ruta_db)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        con.execute(f"DROP TABLE IF EXISTS {_tabla_resultado(resultado)}")
+        con.execute("DELETE FROM resultados WHERE id = ?", (int(resultado),))
+        con.execute("COMMIT")
+    except BaseException:
+        if con.in_transaction:  # si BEGIN falló no hay nada que deshacer; queda el error original
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+def _columnas_resultado(con: sqlite3.Connection, resultado: int) -> list[dict]:
+    fila = con.execute("SELECT columnas FROM resultados WHERE id = ?", (int(resultado),)).fetchone()
+    if fila is None:
+        raise ValueError(f"No existe el resultado {resultado} en la base")
+    return json.loads(fila[0])
+
+def _condiciones_base(filtros: dict | None) -> tuple[str, list]:
+    """WHERE para los filtros de consulta (los de la sección FILTROS)."""
+    condiciones, parametros = [], []
+    for clave, valor in filtros_activos(filtros).items():
+        if clave in COLUMNAS_FILTRO_CATEGORIA:
+            condiciones.append(f"{clave} IN ({', '.join(['?'] * len(valor))})")
+            parametros.extend(valor)
+        elif clave == "fecha_desde":
+            condiciones.append("fecha_evento >= ?")
+            parametros.append(str(valor))
+        elif clave == "fecha_hasta":
+            condiciones.append("fecha_evento <> '' AND fecha_evento <= ?")
+            parametros.append(str(valor))
+        elif clave == "nombre":
+            prefijo = clave_nombre(valor)
+            if prefijo:
+                condiciones.append(f"{COLUMNA_CLAVE_NOMBRE} >= ? AND {COLUMNA_CLAVE_NOMBRE} < ?")
+                parametros.extend([prefijo, prefijo + _MAXIMO_UNICODE])
+        elif clave == "con_valor":
+            condiciones.extend(f"TRIM({_identificador(c)}) <> ''" for c in valor)
+        else:
+            raise ValueError(f"Filtro desconocido: {clave!r}")
+    return (" WHERE " + " AND ".join(condiciones) if condiciones else ""), parametros
+
+def _consulta_base(resultado: int, columnas: list[str], filtros: dict | None, orden: str | None,
+                   ascendente: bool) -> tuple[str, list]:
+    donde, parametros = _condiciones_base(filtros)
+    sql = f"SELECT {', '.join(map(_identificador, columnas))} FROM {_tabla_resultado(resultado)}{donde} ORDER BY "
+    if orden is not None:
+        # Estable como orden_por_columna: a igual valor, el orden del reporte; vacíos al final
+        # (con "IS NULL" y no NULLS LAST, que recién existe desde SQLite 3.30)
+        columna = _identificador(orden)
+        sql += f"{columna} IS NULL, {columna} {'ASC' if ascendente else 'DESC'}, "
+    return sql + "_fila", parametros
+
+def _df_de_filas(filas: list[tuple], columnas: list[dict]) -> pd.DataFrame:
+    """Filas leídas de la base con los dtypes que tenía el reporte."""
+    datos = {}
+    por_columna = list(zip(*filas)) if filas else [()] * len(columnas)
+    for c, valores in zip(columnas, por_columna):
+        valores = list(valores)
+        if c["tipo"] == "category":
+            datos[c["nombre"]] = pd.Categorical(valores)
+        elif c["tipo"] == "object":
+            datos[c["nombre"]] = pd.Series(valores, dtype=object)
+        else:
+            datos[c["nombre"]] = pd.array(valores, dtype=c["tipo"])
+    return pd.DataFrame(datos, columns=[c["nombre"] for c in columnas])
+
+def columnas_base(ruta_db: str | os.PathLike, resultado: int) -> list[str]:
+    con = _conectar_base(ruta_db)
+    try:
+        return [c["nombre"] for c in _columnas_resultado(con, resultado)]
+    finally:
+        con.close()
+
+def contar_base(ruta_db: str | os.PathLike, resultado: int, filtros: dict | None = None) -> int:
+    """Filas del resultado que cumplen `filtros` (todas, sin filtros: se lee de `resultados`)."""
+    con = _conectar_base(ruta_db)
+    try:
+        _columnas_resultado(con, resultado)
+        if not filtros:
+            return con.execute("SELECT filas FROM resultados WHERE id = ?", (int(resultado),)).fetchone()[0]
+        donde, parametros = _condiciones_base(filtros)
+        return con.execute(f"SELECT COUNT(*) FROM {_tabla_resultado(resultado)}{donde}", parametros).fetchone()[0]
+    finally:
+        con.close()
+
+def valores_filtro_base(ruta_db: str | os.PathLike, resultado: int) -> dict[str, list]:
+    """Como valores_filtro, para un resultado guardado."""
+    con = _conectar_base(ruta_db)
+    try:
+        presentes = {c["nombre"] for c in _columnas_resultado(con, resultado)}
+        return {col: [v for (v,) in con.execute(f"SELECT DISTINCT {col} FROM {_tabla_resultado(resultado)} "
+                                                f"WHERE {col} IS NOT NULL ORDER BY {col}")]
+                for col in COLUMNAS_FILTRO_CATEGORIA if col in presentes}
+    finally:
+        con.close()
+
+def consultar_base(ruta_db: str | os.PathLike, resultado: int, filtros: dict | None = None,
+                   orden: str | None = None, ascendente: bool = True,
+                   limite: int | None = None, desplazamiento: int = 0,
+                   columnas: list[str] | None = None) -> pd.DataFrame:
+    """
+    Una página del resultado: filas que cumplen `filtros`, ordenadas por `orden` (o en el
+    orden del reporte), desde `desplazamiento` y a lo sumo `limite`; sólo `columnas` si se dan.
+    """
+    con = _conectar_base(ruta_db)
+    try:
+        todas = _columnas_resultado(con, resultado)
+        elegidas = todas if columnas is None else [c for c in todas if c["nombre"] in set(columnas)]
+        sql, parametros = _consulta_base(resultado, [c["nombre"] for c in elegidas], filtros, orden, ascendente)
+        if limite is not None or desplazamiento:
+            sql += " LIMIT ? OFFSET ?"
+            parametros += [-1 if limite is None else int(limite), int(desplazamiento)]
+        return _df_de_filas(con.execute(sql, parametros).fetchall(), elegidas)
+    finally:
+        con.close()
+
+def exportar_desde_base(ruta_db: str | os.PathLike, resultado: int, ruta: str | os.PathLike,
+                        formato: str | None = None, filtros: dict | None = None,
+                        orden: str | None = None, ascendente: bool = True,
+                        progreso: Callable[[dict], None] | None = None,
+                        cancelar: threading.Event | None = None) -> int:
+    """
+    Como exportar(), pero leyendo el resultado guardado por lotes de la base (con `filtros`
+    y `orden` opcionales). Devuelve las filas escritas.
+    """
+    formato = _formato_exportacion(ruta, formato)
+    total = contar_base(ruta_db, resultado, filtros)
+    con = _conectar_base(ruta_db)
+    try:
+        columnas = _columnas_resultado(con, resultado)
+        nombres = [c["nombre"] for c in columnas]
+        sql, parametros = _consulta_base(resultado, nombres, filtros, orden, ascendente)
+        cursor = con.execute(sql, parametros)
+
+        def lotes() -> Iterator[tuple[int, pd.DataFrame]]:
+            inicio = 0
+            while True:
+                _revisar_cancelacion(cancelar)
+                filas = cursor.fetchmany(FILAS_POR_LOTE_EXPORTACION)
+                if not filas:
+                    return
+                yield inicio, _df_de_filas(filas, columnas)
+                inicio += len(filas)
+
+        _ESCRITORES[formato](ruta, nombres, total, lotes(), progreso)
+    finally:
+        con.close()
+    return total
+
+# ============================ CLI ============================
+# Códigos de salida del modo por lotes
+SALIDA_OK = 0               # todos los reportes escritos
+SALIDA_ERROR = 1            # algún archivo no se pudo consolidar o exportar
+SALIDA_USO = 2              # argumentos inválidos o ninguna entrada encontrada (igual que argparse)
+SALIDA_HOJAS_OMITIDAS = 3   # reportes escritos, pero alguna hoja se omitió por error
+
+VERSION_METRICAS = 1  # forma del JSON de --metricas
+
+def expandir_entradas(entradas: list[str]) -> list[Path]:
+    """
+    Archivos a procesar: cada entrada puede ser un archivo, un directorio (sus archivos
+    con extensiones_legibles) o un patrón glob (se expande aquí, también en Windows). Sin
+    duplicados, en el orden dado; se ignoran los temporales de Excel (~$…).
+    """
+    legibles = {f".{e}" for e in extensiones_legibles()}
+    archivos = []
+    for entrada in entradas:
+        ruta = Path(entrada)
+        if ruta.is_dir():
+            encontrados = sorted(p for p in ruta.iterdir() if p.suffix.lower() in legibles)
+        elif glob.has_magic(entrada):
+            encontrados = sorted(Path(p) for p in glob.glob(entrada, recursive=True)
+                                 if Path(p).suffix.lower() in legibles)
+        else:
+            encontrados = [ruta]
+        archivos.extend(p for p in encontrados if not p.name.startswith("~$"))
+    return list(dict.fromkeys(archivos))
+
+def _es_archivo_reporte(salida: str) -> bool:
+    return Path(salida).suffix.lower() in FORMATOS_EXPORTACION
+
+def ruta_reporte(entrada: Path, salida: str | None, varios: bool, formato: str = "xlsx") -> Path:
+    """
+    Sin `salida`: <nombre>_REPORTE_UNICO.<formato> junto a la entrada (el nombre que sugiere
+    la app). Con un solo archivo y `salida` con extensión de reporte (.xlsx/.csv/.parquet),
+    esa ruta; en otro caso `salida` es un directorio donde se escribe el reporte.
+    """
+    nombre = f"{entrada.stem}_REPORTE_UNICO.{formato}"
+    if salida is None:
+        return entrada.with_name(nombre)
+    if not varios and _es_archivo_reporte(salida):
+        return Path(salida)
+    return Path(salida) / nombre
+
+def parse_fecha_ref(texto: str) -> date:
+    """AAAA-MM-DD a fecha; el error es el de argparse, para usarla como `type=`."""
+    try:
+        return date.fromisoformat(texto)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha inválida {texto!r} (se espera AAAA-MM-DD)")
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="consolidador",
+        description="Consolida libros de laboratorio en el reporte único, sin abrir la interfaz.",
+        epilog=f"Códigos de salida: {SALIDA_OK} ok, {SALIDA_ERROR} algún archivo falló, "
+               f"{SALIDA_USO} uso inválido o sin entradas, {SALIDA_HOJAS_OMITIDAS} hojas omitidas por error.")
+    parser.add_argument("entradas", nargs="+", metavar="ENTRADA",
+                        help="libro (.xlsx, .xls, .csv…), directorio o patrón glob (p. ej. 'datos/*.xlsx')")
+    parser.add_argument("-o", "--salida",
+                        help="archivo .xlsx/.csv/.parquet (con una sola entrada) o directorio para los reportes; "
+                             "por omisión, junto a cada entrada")
+    parser.add_argument("-f", "--formato", choices=sorted(_EXPORTADORES), default=None,
+                        help="formato del reporte (por omisión, el de la extensión de --salida o xlsx)")
+    parser.add_argument("-p", "--procesos", type=int, default=None,
+                        help="procesar las hojas de cada libro en un pool de N procesos")
+    parser.add_argument("--lector", choices=list(LECTORES), default=None,
+                        help="forzar el lector de todas las entradas (una que no pueda abrir falla); por "
+                             "omisión, el más rápido instalado que abra cada archivo "
+                             f"(disponibles: {', '.join(lectores_disponibles())})")
+    parser.add_argument("--fecha-ref", type=parse_fecha_ref, default=None, metavar="AAAA-MM-DD",
+                        help="día contra el que se calcula la edad (hoy por omisión)")
+    parser.add_argument("--cache", default=None, metavar="DIR",
+                        help=f"directorio de la caché de hojas procesadas (por omisión {directorio_cache_predeterminado()})")
+    parser.add_argument("--sin-cache", action="store_true", help="procesar todo sin leer ni escribir la caché")
+    parser.add_argument("--sin-canon-difusa", action="store_true",
+                        help="canonizar estudio/prueba sólo con los sinónimos exactos (sin grafías parecidas)")
+    parser.add_argument("--almacen", default=None, metavar="DIR",
+                        help="modo incremental: agrega las entradas al almacén DIR y escribe un solo reporte "
+                             "con todo lo acumulado (en --salida, o DIR/REPORTE_ACUMULADO.<formato>)")
+    parser.add_argument("--fuera-de-memoria", nargs="?", const=tempfile.gettempdir(), default=None, metavar="DIR",
+                        help="consolidar fuera de memoria: las tablas de cada hoja van a disco en DIR (por omisión "
+                             f"{tempfile.gettempdir()}) y se fusionan por partes, para libros que no caben en RAM")
+    parser.add_argument("--base", nargs="?", const=str(ruta_base_predeterminada()), default=None, metavar="SQLITE",
+                        help="guardar además cada reporte en la base de resultados SQLite (por omisión "
+                             f"{ruta_base_predeterminada()}), para consultarlo o reabrirlo en la app")
+    parser.add_argument("--metricas", default=None, metavar="JSON",
+                        help="escribir las métricas por hoja y por etapa de la corrida en JSON ('-' = salida estándar)")
+    parser.add_argument("--perfil", default=None, metavar="ARCHIVO",
+                        help="perfilar la corrida con cProfile y guardar las estadísticas en ARCHIVO "
+                             "(con --procesos sólo se perfila el proceso principal)")
+    parser.add_argument("-q", "--silencioso", action="store_true", help="sólo reportar errores")
+    args = parser.parse_args(argv)
+
+    archivos = expandir_entradas(args.entradas)
+    faltantes = [p for p in archivos if not p.is_file()]
+    for p in faltantes:
+        print(f"No existe: {p}", file=sys.stderr)
+    archivos = [p for p in archivos if p.is_file()]
+    if not archivos:
+        print("Ninguna entrada coincide con un libro legible.", file=sys.stderr)
+        return SALIDA_USO
+    varios = len(archivos) > 1
+    if varios and not args.almacen and args.salida and _es_archivo_reporte(args.salida):
+        print("Con varias entradas, --salida debe ser un directorio.", file=sys.stderr)
+        return SALIDA_USO
+    if args.almacen and args.fuera_de_memoria:
+        print("--fuera-de-memoria no aplica con --almacen.", file=sys.stderr)
+        return SALIDA_USO
+    formato = args.formato or (FORMATOS_EXPORTACION[Path(args.salida).suffix.lower()]
+                               if args.salida and _es_archivo_reporte(args.salida) else "xlsx")
+    if formato not in formatos_exportacion_disponibles():
+        print(f"El formato {formato} no está disponible (Parquet requiere pyarrow).", file=sys.stderr)
+        return SALIDA_USO
+    if args.lector and args.lector not in lectores_disponibles():
+        print(f"El lector {args.lector} no está instalado (pip install {LECTORES[args.lector]['modulo']}).",
+              file=sys.stderr)
+        return SALIDA_USO
+
+    # Misma referencia de edad para todo el lote
+    fecha_ref = args.fecha_ref or date.today()
+    cache = None if args.sin_cache else (args.cache or directorio_cache_predeterminado())
+    metricas = {"version": VERSION_METRICAS, "fecha_ref": fecha_ref.isoformat(), "procesos": args.procesos,
+                "corridas": []}
+    perfil = cProfile.Profile() if args.perfil else None
+    if perfil:
+        perfil.enable()
+    try:
+        codigo = _correr_lote(args, archivos, formato, fecha_ref, cache, metricas["corridas"])
+    finally:
+        if perfil:
+            perfil.disable()
+            perfil.dump_stats(args.perfil)
+            if not args.silencioso:
+                print(f"Perfil guardado en {args.perfil}; funciones con más tiempo acumulado:", file=sys.stderr)
+                pstats.Stats(perfil, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    if faltantes and codigo != SALIDA_ERROR:
+        codigo = SALIDA_ERROR
+    if args.metricas:
+        texto = json.dumps(metricas, ensure_ascii=False, indent=2)
+        if args.metricas == "-":
+            print(texto)
+        else:
+            Path(args.metricas).write_text(texto, encoding="utf-8")
+    return codigo
+
+def _metricas_corrida(entradas: list[Path], destino: Path, resumen: dict, segundos: float) -> dict:
+    """Lo que --metricas guarda de cada reporte escrito (o intentado)."""
+    return {"entradas": [str(p) for p in entradas], "salida": str(destino), "segundos": round(segundos, 4),
+            "filas_reporte": resumen.get("filas_reporte", 0),
+            "grupos_fusionados": resumen.get("grupos_fusionados", 0),
+            "tiempos": resumen.get("tiempos", {}), "hojas": resumen.get("hojas", []),
+            "derrame": resumen.get("derrame"),
+            "canonizacion": canonizaciones(resumen),
+            "errores": [{"hoja": e["hoja"], "error": e["error"].strip().splitlines()[-1]}
+                        for e in resumen.get("errores", [])]}
+
+def _avisar_canonizacion(prefijo: str, resumen: dict, eco, silencioso: bool) -> None:
+    """Grafías por revisar (a stderr) y, salvo en modo silencioso, las canonizadas por parecido."""
+    for c in canonizaciones(resumen, "revisar"):
+        print(f"REVISAR{prefijo}: {c['tipo']} {c['valor']!r} se parece a {c['sinonimo']!r} "
+              f"({c['canonico']}, parecido {c['puntaje']:.2f}); no se aplicó", file=sys.stderr)
+    if not silencioso:
+        for c in canonizaciones(resumen, "aplicada"):
+            print(f"  {c['tipo']} {c['valor']!r} → {c['canonico']} (como {c['sinonimo']!r}, "
+                  f"parecido {c['puntaje']:.2f})", file=eco)
+
+def _correr_lote(args: argparse.Namespace, archivos: list[Path], formato: str, fecha_ref: date,
+                 cache: str | os.PathLike | None, corridas: list[dict]) -> int:
+    """Consolida y exporta las entradas de main(); agrega a `corridas` las métricas de cada reporte."""
+    codigo = SALIDA_OK
+    varios = len(archivos) > 1
+    eco = sys.stderr if args.metricas == "-" else sys.stdout  # stdout queda para el JSON
+    if args.almacen:
+        salida = Path(args.salida or args.almacen)
+        destino = salida if _es_archivo_reporte(str(salida)) else salida / f"REPORTE_ACUMULADO.{formato}"
+        resumen = {}
+        t0 = time.perf_counter()
+        try:
+            df = consolidar_incremental(archivos, args.almacen, resumen, fecha_ref=fecha_ref,
+                                        procesos=args.procesos, cache=cache, lector=args.lector,
+                                        canon_difusa=not args.sin_canon_difusa)
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            t1 = time.perf_counter()
+            exportar(df, destino, formato)
+            resumen.setdefault("tiempos", {})["exportación"] = time.perf_counter() - t1
+            if args.base:
+                t1 = time.perf_counter()
+                guardar_en_base(df, args.base, destino.stem, archivos)
+                resumen["tiempos"]["base"] = time.perf_counter() - t1
+        except Exception:
+            print(f"ERROR {args.almacen}:\n{traceback.format_exc()}", file=sys.stderr)
+            corridas.append(_metricas_corrida(archivos, destino, resumen, time.perf_counter() - t0))
+            return SALIDA_ERROR
+        corridas.append(_metricas_corrida(archivos, destino, resumen, time.perf_counter() - t0))
+        for e in resumen.get("errores", []):
+            print(f"AVISO: hoja {e['hoja']!r} omitida: {e['error'].strip().splitlines()[-1]}", file=sys.stderr)
+        _avisar_canonizacion("", resumen, eco, args.silencioso)
+        if resumen.get("errores") and codigo == SALIDA_OK:
+            codigo = SALIDA_HOJAS_OMITIDAS
+        if not args.silencioso:
+            print(f"{len(archivos)} libros → {destino}: {resumen.get('hojas_procesadas', 0)} hojas procesadas, "
+                  f"{resumen.get('hojas_sin_cambios', 0)} sin cambios, {len(df)} filas en "
+                  f"{time.perf_counter() - t0:.1f} s", file=eco)
+        return codigo
+
+    for entrada in archivos:
+        destino = ruta_reporte(entrada, args.salida, varios, formato)
+        resumen = {}
+        t0 = time.perf_counter()
+        try:
+            df = consolidar_todas_las_hojas(str(entrada), resumen, fecha_ref=fecha_ref,
+                                            procesos=args.procesos, cache=cache, lector=args.lector,
+                                            derrame=args.fuera_de_memoria, canon_difusa=not args.sin_canon_difusa)
+            destino.parent.mkdir(parents=True, exist_ok=True)
+            t1 = time.perf_counter()
+            exportar(df, destino, formato)
+            resumen.setdefault("tiempos", {})["exportación"] = time.perf_counter() - t1
+            if args.base:
+                t1 = time.perf_counter()
+                guardar_en_base(df, args.base, destino.stem, [entrada])
+                resumen["tiempos"]["base"] = time.perf_counter() - t1
+        except Exception:
+            print(f"ERROR {entrada}:\n{traceback.format_exc()}", file=sys.stderr)
+            corridas.append(_metricas_corrida([entrada], destino, resumen, time.perf_counter() - t0))
+            codigo = SALIDA_ERROR
+            continue
+        corridas.append(_metricas_corrida([entrada], destino, resumen, time.perf_counter() - t0))
+        for e in resumen.get("errores", []):
+            print(f"AVISO {entrada}: hoja {e['hoja']!r} omitida: {e['error'].strip().splitlines()[-1]}",
+                  file=sys.stderr)
+        _avisar_canonizacion(f" {entrada}", resumen, eco, args.silencioso)
+        if resumen.get("errores") and codigo == SALIDA_OK:
+            codigo = SALIDA_HOJAS_OMITIDAS
+        if not args.silencioso:
+            print(f"{entrada} → {destino}: {len(df)} filas en {time.perf_counter() - t0:.1f} s", file=eco)
+    return codigo
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# tests/conftest.py
+# Libros sintéticos pequeños (benchmark.generar_libro) y el reporte de referencia: el de la
+# versión original, leído con pd.read_excel y preparado fila por fila (tests/referencia.py).
+# Correr desde la raíz del repo: python -m pytest -q
+
+from __future__ import annotations
+import sys
+from datetime import date
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import benchmark
+from referencia import reporte_de_referencia as reporte_original
+
+FECHA_REF = date(2025, 1, 1)
+
+@pytest.fixture(scope="session")
+def libro(tmp_path_factory) -> Path:
+    """4 hojas de 600 filas: servicios con variantes, fechas en varios formatos y pacientes repetidos."""
+    return benchmark.generar_libro(tmp_path_factory.mktemp("libros") / "libro.xlsx",
+                                   hojas=4, filas=600, pacientes=150, semilla=1)
+
+@pytest.fixture(scope="session")
+def otro_libro(libro, tmp_path_factory) -> Path:
+    """
+    Las dos primeras hojas de `libro` con un tercio de los resultados vacíos y otro tercio
+    cambiado, más una hoja de pacientes nuevos: casi todas sus filas se fusionan con las
+    de `libro` y el resultado depende del orden de prioridad entre libros.
+    """
+    ruta = tmp_path_factory.mktemp("libros") / "otro.xlsx"
+    nuevos = benchmark.generar_libro(ruta.with_name("nuevos.xlsx"), hojas=1, filas=300, semilla=2)
+    wb = Workbook(write_only=True)
+    origen = load_workbook(libro, read_only=True)
+    for titulo in origen.sheetnames[:2]:
+        ws = wb.create_sheet(titulo + " bis")
+        filas = origen[titulo].iter_rows(values_only=True)
+        cabecera = next(filas)
+        ws.append(cabecera)
+        col = cabecera.index("RESULTADO")
+        for i, fila in enumerate(filas):
+            fila = list(fila)
+            fila[col] = ("", f"{fila[col]}*", fila[col])[i % 3]
+            ws.append(fila)
+    origen.close()
+    origen = load_workbook(nuevos, read_only=True)
+    ws = wb.create_sheet("Nuevos")
+    for fila in origen.active.iter_rows(values_only=True):
+        ws.append(fila)
+    origen.close()
+    wb.save(ruta)
+    return ruta
+
+def copiar_libro(origen: Path, destino: Path,
+                 cambiar: Callable[[str, int, list], list] | None = None) -> Path:
+    """Reescribe `origen` en `destino` fila por fila; `cambiar(hoja, i, fila)` puede editar las filas de datos."""
+    wb = Workbook(write_only=True)
+    libro = load_workbook(origen, read_only=True)
+    for titulo in libro.sheetnames:
+        ws = wb.create_sheet(titulo)
+        for i, fila in enumerate(libro[titulo].iter_rows(values_only=True)):
+            ws.append(cambiar(titulo, i - 1, list(fila)) if cambiar and i else fila)
+    libro.close()
+    wb.save(destino)
+    return destino
+
+def reporte_de_referencia(paths: list[Path]) -> pd.DataFrame:
+    """El reporte de la versión original (tests/referencia.py) para las hojas de `paths`, en ese orden."""
+    return reporte_original(paths, FECHA_REF)
+
+@pytest.fixture(scope="session")
+def referencia(libro) -> pd.DataFrame:
+    """El reporte de referencia de `libro`, ya comparable."""
+    return comparable(reporte_de_referencia([libro]))
+
+def comparable(df: pd.DataFrame) -> pd.DataFrame:
+    """Todo como texto (edad sin decimales, nulos vacíos) para comparar con la referencia."""
+    df = df.copy()
+    df.columns = list(df.columns)
+    df["edad"] = df["edad"].map(lambda v: "" if pd.isna(v) or v == "" else str(int(float(v))))
+    return df.astype(object).where(df.notna(), "").astype(str).reset_index(drop=True)
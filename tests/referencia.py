@@ -0,0 +1,163 @@
+# tests/referencia.py
+# El pipeline de la versión original (app_dashboard_full.py antes de consolidador.py), fila
+# por fila: pd.read_excel(dtype=str), parse_dob, normalize_servicio, canon_study/canon_test
+# y build_nombre con .apply, pivot_table, groupby y first_nonempty. Sólo cambia la edad, que
+# se calcula contra una fecha fija en vez de hoy. Las tablas de datos (sinónimos, `want`)
+# son las de consolidador; la lógica es la original, para comparar contra ella cada modo.
+
+from __future__ import annotations
+import re
+import unicodedata
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+import consolidador as C
+
+FIJAS = ["nombre", "sexo", "edad", "mayor_18", "fecha_nacimiento", "servicio_norm", "fecha_evento"]
+
+def _unidecode_local(x: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", str(x)) if not unicodedata.combining(c))
+
+def parse_dob(s: str) -> str:
+    if s is None or s=="" or pd.isna(s): return ""
+    for fmt in ("%d/%m/%Y","%Y-%m-%d","%d-%m-%Y","%m/%d/%Y"):
+        try:
+            return datetime.strptime(str(s), fmt).strftime("%Y-%m-%d")
+        except Exception:
+            pass
+    try:
+        dt = pd.to_datetime(s, errors="coerce")
+        if pd.notna(dt): return dt.strftime("%Y-%m-%d")
+    except Exception:
+        pass
+    return ""
+
+def edad_from_iso(iso: str, hoy: date) -> int | None:
+    if not iso: return None
+    try:
+        dob = datetime.strptime(iso,"%Y-%m-%d")
+    except Exception:
+        return None
+    return hoy.year - dob.year - ((hoy.month,hoy.day) < (dob.month,dob.day))
+
+def canon_study(study_raw: str) -> str:
+    if not study_raw: return ""
+    key = _unidecode_local(study_raw).strip().upper()
+    return C.STUDY_SHORT.get(key, study_raw.strip())
+
+def canon_test(test_raw: str) -> str:
+    if not test_raw: return ""
+    key = _unidecode_local(test_raw).strip().lower()
+    return C.TEST_SYNONYMS.get(key, test_raw.strip())
+
+def normalize_servicio(s: str) -> str:
+    if s is None or (isinstance(s, float) and pd.isna(s)):
+        return ""
+    raw = _unidecode_local(str(s)).lower().strip()
+    raw = raw.replace(".", " ").replace("-", " ").replace("/", " ")
+    raw = re.sub(r"\s+", " ", raw)
+    raw = raw.replace("urgenciasl", "urgencias")
+    raw = raw.replace("urgenc", "urgencia")
+    raw = raw.replace("genral", "general")
+    raw = raw.replace("grl", "gral")
+    if (
+        re.search(r"\bconsulta\s*externa\b", raw)
+        or re.search(r"\bconsulta\s*ext(erna)?\b", raw)
+        or re.search(r"\bcons?(\s*)ext(\s*erna)?\b", raw)
+        or re.search(r"\bc(\s*)externa\b", raw)
+    ):
+        return "consulta externa"
+    has_urg = (
+        re.search(r"\burgencia(s)?\b", raw) is not None
+        or re.search(r"\burg\b", raw) is not None
+        or re.search(r"\burgs\b", raw) is not None
+        or re.search(r"\burg\w*\b", raw) is not None
+    )
+    has_general = (
+        re.search(r"\bgeneral\b", raw) is not None
+        or re.search(r"\bgral\b", raw) is not None
+    )
+    if has_urg and has_general:
+        return "urgencia general"
+    if re.search(r"\burgencia(s)?\b", raw):
+        return "urgencia general"
+    return raw
+
+def build_nombre(df: pd.DataFrame) -> pd.Series:
+    return (
+        df["nombres"].fillna("").str.strip()+" "+
+        df["apellido_paterno"].fillna("").str.strip()+" "+
+        df["apellido_materno"].fillna("").str.strip()
+    ).str.replace(r"\s+"," ",regex=True).str.strip()
+
+def cargar_y_preparar_df(df: pd.DataFrame, hoy: date) -> pd.DataFrame:
+    df = df.copy()
+    df.columns = C.normalize_headers(list(df.columns))
+    for col in ["nombres","apellido_paterno","apellido_materno","sexo","servicio",
+                "fecha_nacimiento","estudio","prueba","resultado",
+                "fecha_creacion","fecha_validacion","fecha"]:
+        if col not in df.columns:
+            df[col] = ""
+    df["servicio_norm"] = df["servicio"].apply(normalize_servicio)
+    df = df[df["servicio_norm"].isin(["consulta externa", "urgencia general"])].copy()
+    if df.empty:
+        return pd.DataFrame(columns=FIJAS)
+    df["nombre"] = build_nombre(df)
+    df["fecha_nacimiento"] = df["fecha_nacimiento"].apply(parse_dob)
+    df["edad"] = df["fecha_nacimiento"].apply(lambda iso: edad_from_iso(iso, hoy))
+    df["mayor_18"] = df["edad"].apply(lambda e: "Sí" if e is not None and e >= 18 else "No")
+    df["fecha_validacion"] = df["fecha_validacion"].apply(parse_dob)
+    df["fecha_creacion"] = df["fecha_creacion"].apply(parse_dob)
+    df["fecha"] = df["fecha"].apply(parse_dob)
+    df["fecha_evento"] = df["fecha_validacion"]
+    df.loc[df["fecha_evento"] == "", "fecha_evento"] = df.loc[df["fecha_evento"] == "", "fecha_creacion"]
+    df.loc[df["fecha_evento"] == "", "fecha_evento"] = df.loc[df["fecha_evento"] == "", "fecha"]
+    df["study_canon"] = df["estudio"].fillna("").apply(canon_study)
+    df["test_canon"] = df["prueba"].fillna("").apply(canon_test)
+    df["col_key"] = (df["study_canon"].fillna("").astype(str).str.strip()
+                     + df["test_canon"].apply(lambda s: " – "+s if str(s).strip()!="" else ""))
+    return df
+
+def pivot_por_persona_cols_estudio_prueba(df: pd.DataFrame) -> pd.DataFrame:
+    base_cols = ["fecha_nacimiento","nombre","sexo","edad","mayor_18","servicio_norm","fecha_evento"]
+    if df.empty:
+        return pd.DataFrame(columns=FIJAS)
+    pivot = (df[base_cols + ["col_key","resultado"]]
+             .pivot_table(index=base_cols, columns="col_key", values="resultado",
+                          aggfunc=C.first_nonempty, fill_value="")
+             .reset_index())
+    return pivot.sort_values(["fecha_nacimiento","nombre","fecha_evento"]).reset_index(drop=True)
+
+def pick_first(df: pd.DataFrame, cols: list[str]) -> pd.Series:
+    vals = []
+    for _, row in df.iterrows():
+        val = ""
+        for c in cols:
+            if c in df.columns:
+                v = row[c]
+                if v is not None and str(v).strip() != "":
+                    val = str(v)
+                    break
+        vals.append(val)
+    return pd.Series(vals, index=df.index)
+
+def reporte_de_referencia(paths: list[Path], hoy: date) -> pd.DataFrame:
+    """El reporte de la versión original para todas las hojas de `paths`, en ese orden."""
+    tablas = []
+    for path in paths:
+        xls = pd.ExcelFile(path, engine="openpyxl")
+        for sheet in xls.sheet_names:
+            df_raw = pd.read_excel(xls, sheet_name=sheet, dtype=str, header=0)
+            tabla = pivot_por_persona_cols_estudio_prueba(cargar_y_preparar_df(df_raw, hoy))
+            if not tabla.empty:
+                tablas.append(tabla)
+    unido = pd.concat(tablas, ignore_index=True, sort=True).fillna("")
+    consolidado = unido.groupby(FIJAS, dropna=False, as_index=False).agg(
+        {col: C.first_nonempty for col in unido.columns})
+    out = consolidado[FIJAS].copy()
+    for nombre, candidatas in C.want:
+        out[nombre] = pick_first(consolidado, candidatas)
+    out.insert(0, "id_trabajador", range(1, len(out) + 1))
+    return out
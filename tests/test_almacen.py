@@ -0,0 +1,100 @@
+# tests/test_almacen.py
+# Almacén incremental: el mismo reporte que el pivote original, ids estables entre corridas
+# y sólo las hojas cambiadas se procesan, también con libros renombrados o copiados.
+
+from __future__ import annotations
+import json
+import shutil
+
+import pandas as pd
+
+import benchmark
+import consolidador as C
+from conftest import FECHA_REF, comparable, copiar_libro
+
+def _ids(final: pd.DataFrame) -> dict[tuple, int]:
+    llaves = final[C.LLAVE_PERSONA_EVENTO].astype(str).itertuples(index=False, name=None)
+    return dict(zip(llaves, final["id_trabajador"]))
+
+def _persona(nombre: str, fecha_evento: str) -> dict:
+    return {"nombre": nombre, "sexo": "F", "fecha_nacimiento": "1990-01-01",
+            "servicio_norm": "consulta externa", "fecha_evento": fecha_evento}
+
+def test_incremental(libro, referencia, tmp_path):
+    final = C.consolidar_incremental([libro], tmp_path / "almacen", fecha_ref=FECHA_REF)
+    pd.testing.assert_frame_equal(comparable(final), referencia)
+
+def test_ids_no_se_reutilizan(tmp_path):
+    a, b, c = _persona("ANA", "2024-01-01"), _persona("ANA", "2024-02-01"), _persona("LUIS", "2024-01-01")
+    primera = C.asignar_ids_estables(pd.DataFrame([a, b]), tmp_path)
+    assert primera["id_trabajador"].tolist() == [1, 2]
+    # b desaparece y llega c: c no toma el id de b
+    segunda = C.asignar_ids_estables(pd.DataFrame([c, a]), tmp_path)
+    assert segunda["id_trabajador"].tolist() == [3, 1]
+    # b vuelve con su id de antes
+    tercera = C.asignar_ids_estables(pd.DataFrame([b, c, a]), tmp_path)
+    assert tercera["id_trabajador"].tolist() == [2, 3, 1]
+
+def test_ids_estables_al_agregar_un_libro(libro, otro_libro, tmp_path):
+    antes = _ids(C.consolidar_incremental([libro], tmp_path, fecha_ref=FECHA_REF))
+    assert sorted(antes.values()) == list(range(1, len(antes) + 1))
+    final = C.consolidar_incremental([otro_libro], tmp_path, fecha_ref=FECHA_REF)
+    despues = _ids(final)
+    assert final["id_trabajador"].is_unique
+    assert all(despues[llave] == id_ for llave, id_ in antes.items() if llave in despues)
+    # Las filas nuevas reciben los números siguientes, en el orden del reporte
+    nuevos = final.loc[[llave not in antes for llave in despues], "id_trabajador"].tolist()
+    assert nuevos and nuevos == list(range(len(antes) + 1, len(antes) + 1 + len(nuevos)))
+
+def test_ids_estables_con_otra_fecha_ref(libro, tmp_path):
+    primera = C.consolidar_incremental([libro], tmp_path, fecha_ref=FECHA_REF)
+    resumen = {}
+    otra_fecha = FECHA_REF.replace(year=FECHA_REF.year + 30)
+    segunda = C.consolidar_incremental([libro], tmp_path, resumen, fecha_ref=otra_fecha)
+    assert resumen["hojas_procesadas"] == 0
+    assert _ids(segunda) == _ids(primera)
+    pd.testing.assert_frame_equal(segunda.drop(columns="id_trabajador"),
+                                  C.consolidar_todas_las_hojas(str(libro), fecha_ref=otra_fecha)
+                                  .drop(columns="id_trabajador"))
+
+def test_solo_se_procesa_la_hoja_cambiada(libro, tmp_path):
+    ruta = copiar_libro(libro, tmp_path / "libro.xlsx")
+    almacen = tmp_path / "almacen"
+    C.consolidar_incremental([ruta], almacen, fecha_ref=FECHA_REF)
+    col = benchmark.CABECERA_SINTETICA.index("RESULTADO")
+    def otro_resultado(titulo, i, fila):
+        if titulo == "Clínica 4":
+            fila[col] = f"{fila[col]}!"
+        return fila
+    copiar_libro(libro, ruta, otro_resultado)
+    resumen = {}
+    final = C.consolidar_incremental([ruta], almacen, resumen, fecha_ref=FECHA_REF)
+    assert (resumen["hojas_procesadas"], resumen["hojas_sin_cambios"]) == (1, 3)
+    pd.testing.assert_frame_equal(final.drop(columns="id_trabajador"),
+                                  C.consolidar_todas_las_hojas(str(ruta), fecha_ref=FECHA_REF)
+                                  .drop(columns="id_trabajador"))
+    # Sólo queda en el almacén la tabla vigente de cada hoja
+    assert len(list((almacen / "hojas").glob("*.pkl"))) == 4
+
+def test_libro_renombrado_conserva_lugar_e_ids(libro, otro_libro, tmp_path):
+    ruta = copiar_libro(libro, tmp_path / "libro.xlsx")
+    almacen = tmp_path / "almacen"
+    antes = C.consolidar_incremental([ruta, otro_libro], almacen, fecha_ref=FECHA_REF)
+    renombrado = ruta.rename(tmp_path / "renombrado.xlsx")
+    resumen = {}
+    despues = C.consolidar_incremental([renombrado], almacen, resumen, fecha_ref=FECHA_REF)
+    assert resumen["hojas_procesadas"] == 0
+    pd.testing.assert_frame_equal(despues, antes)
+    manifiesto = json.loads((almacen / "manifiesto.json").read_text(encoding="utf-8"))
+    assert [l["archivo"] for l in manifiesto["libros"]] == [str(renombrado.resolve()), str(otro_libro.resolve())]
+    # La huella de canonización va en el manifiesto, junto a la llave de cada hoja
+    assert all(set(h) == {"llave", "canon"} for l in manifiesto["libros"] for h in l["hojas"].values())
+
+def test_copia_de_un_libro_no_reprocesa_sus_hojas(libro, tmp_path):
+    almacen = tmp_path / "almacen"
+    C.consolidar_incremental([libro], almacen, fecha_ref=FECHA_REF)
+    resumen = {}
+    C.consolidar_incremental([shutil.copy(libro, tmp_path / "copia.xlsx")], almacen, resumen, fecha_ref=FECHA_REF)
+    assert (resumen["hojas_procesadas"], resumen["hojas_sin_cambios"]) == (0, 4)
+    manifiesto = json.loads((almacen / "manifiesto.json").read_text(encoding="utf-8"))
+    assert len(manifiesto["libros"]) == 2
@@ -0,0 +1,111 @@
+# tests/test_cache.py
+# Llaves e invalidación de la caché por hoja: contenido, normalización y canonización. Lo
+# leído de la caché da el mismo reporte que el pivote original.
+
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+import benchmark
+import consolidador as C
+from conftest import FECHA_REF, comparable, copiar_libro
+
+@pytest.fixture
+def sinonimos_de_prueba():
+    """Agrega sinónimos de prueba a TEST_SYNONYMS y los quita al terminar."""
+    agregados = []
+    def agregar(valor: str, canonico: str) -> None:
+        C.TEST_SYNONYMS[valor] = canonico
+        agregados.append(valor)
+        _olvidar_canonizacion()
+    yield agregar
+    for valor in agregados:
+        C.TEST_SYNONYMS.pop(valor, None)
+    _olvidar_canonizacion()
+
+def _olvidar_canonizacion() -> None:
+    # El índice difuso depende de las tablas de sinónimos
+    C._indice_canon.cache_clear()
+
+def _desde_cache(resumen: dict) -> dict[str, bool]:
+    return {h["hoja"]: bool(h.get("desde_cache")) for h in resumen["hojas"]}
+
+def test_cache(libro, referencia, tmp_path):
+    primera = C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF, cache=tmp_path)
+    resumen = {}
+    segunda = C.consolidar_todas_las_hojas(str(libro), resumen, fecha_ref=FECHA_REF, cache=tmp_path)
+    assert all(h.get("desde_cache") for h in resumen["hojas"])
+    pd.testing.assert_frame_equal(comparable(primera), referencia)
+    pd.testing.assert_frame_equal(comparable(segunda), referencia)
+
+def test_cache_con_otra_fecha_ref(libro, tmp_path):
+    # La llave no depende de fecha_ref: la edad se recalcula al leer de la caché
+    fecha = FECHA_REF.replace(year=FECHA_REF.year + 7)
+    C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF, cache=tmp_path)
+    resumen = {}
+    desde_cache = C.consolidar_todas_las_hojas(str(libro), resumen, fecha_ref=fecha, cache=tmp_path)
+    assert all(h.get("desde_cache") for h in resumen["hojas"])
+    pd.testing.assert_frame_equal(desde_cache, C.consolidar_todas_las_hojas(str(libro), fecha_ref=fecha))
+
+def test_llave_cambia_solo_en_la_hoja_editada(libro, tmp_path):
+    hoja = "Clínica 2"
+    def otro_folio(titulo, i, fila):
+        if titulo == hoja and i == 0:
+            fila[benchmark.CABECERA_SINTETICA.index("FOLIO")] += 1
+        return fila
+    igual = copiar_libro(libro, tmp_path / "igual.xlsx")
+    editado = copiar_libro(libro, tmp_path / "editado.xlsx", otro_folio)
+    antes, despues = C.llaves_cache_hojas(str(igual)), C.llaves_cache_hojas(str(editado))
+    assert list(antes) == list(despues)
+    assert [t for t in antes if antes[t] != despues[t]] == [hoja]
+
+    cache = tmp_path / "cache"
+    C.consolidar_todas_las_hojas(str(igual), fecha_ref=FECHA_REF, cache=cache)
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(str(editado), resumen, fecha_ref=FECHA_REF, cache=cache)
+    assert _desde_cache(resumen) == {t: t != hoja for t in antes}
+    pd.testing.assert_frame_equal(final, C.consolidar_todas_las_hojas(str(editado), fecha_ref=FECHA_REF))
+
+def test_llave_cambia_con_la_normalizacion(libro, monkeypatch):
+    antes = C.llaves_cache_hojas(str(libro))
+    monkeypatch.setitem(C.SINONIMOS_CABECERA, "folio_lis", "folio")
+    despues = C.llaves_cache_hojas(str(libro))
+    assert all(antes[t] != despues[t] for t in antes)
+
+def test_llave_depende_del_lector(libro):
+    if "calamine" not in C.lectores_disponibles():
+        pytest.skip("python-calamine no está instalado")
+    calamine = C.llaves_cache_hojas(str(libro), "calamine")
+    openpyxl = C.llaves_cache_hojas(str(libro), "openpyxl")
+    assert all(calamine[t] != openpyxl[t] for t in calamine)
+
+def test_sinonimo_nuevo_invalida_solo_las_hojas_afectadas(libro, tmp_path, sinonimos_de_prueba):
+    hoja = "Clínica 3"
+    def prueba_rara(titulo, i, fila):
+        if titulo == hoja and i < 5:
+            fila[benchmark.CABECERA_SINTETICA.index("PRUEBA")] = "Prueba Rarísima"
+        return fila
+    rara = copiar_libro(libro, tmp_path / "rara.xlsx", prueba_rara)
+    cache = tmp_path / "cache"
+    C.consolidar_todas_las_hojas(str(rara), fecha_ref=FECHA_REF, cache=cache)
+
+    sinonimos_de_prueba("prueba rarisima", "Glucosa")
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(str(rara), resumen, fecha_ref=FECHA_REF, cache=cache)
+    assert _desde_cache(resumen) == {t: t != hoja for t in C.llaves_cache_hojas(str(rara))}
+    pd.testing.assert_frame_equal(final, C.consolidar_todas_las_hojas(str(rara), fecha_ref=FECHA_REF))
+
+def test_entrada_corrupta_se_recalcula(libro, tmp_path):
+    esperado = C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF, cache=tmp_path)
+    entradas = sorted(tmp_path.glob("*.pkl"))
+    assert len(entradas) == len(C.llaves_cache_hojas(str(libro)))
+    entradas[0].write_bytes(b"no es un pickle")
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(str(libro), resumen, fecha_ref=FECHA_REF, cache=tmp_path)
+    assert sum(not v for v in _desde_cache(resumen).values()) == 1
+    pd.testing.assert_frame_equal(final, esperado)
+
+def test_sin_cache_no_escribe(libro, tmp_path, monkeypatch):
+    monkeypatch.setattr(C, "escribir_cache", lambda *a, **k: pytest.fail("escribió la caché"))
+    C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF)
@@ -0,0 +1,128 @@
+# tests/test_canonizacion.py
+# Canonización difusa de estudio/prueba: decisiones por puntaje, registro de lo aplicado y
+# lo que queda por revisar, avisos del CLI, decisiones guardadas una vez por corrida y la
+# corrida sin canonización difusa.
+
+from __future__ import annotations
+import json
+
+import pandas as pd
+import pytest
+
+import benchmark
+import consolidador as C
+from conftest import FECHA_REF, copiar_libro
+
+ESTUDIO_ABREVIADO = "QUIMICA SANG. 6 ELEM"   # aplicada: QUIMICA SANGUINEA 6 ELEMENTOS → QS6
+PRUEBA_DUDOSA = "colesterol hdl"             # por revisar: se parece a colesterol, no se aplica
+
+@pytest.fixture(scope="module")
+def libro_con_grafias(libro, tmp_path_factory):
+    """`libro` con el estudio QS6 abreviado y Colesterol escrito como PRUEBA_DUDOSA en Clínica 1."""
+    estudio = benchmark.CABECERA_SINTETICA.index("ESTUDIO")
+    prueba = benchmark.CABECERA_SINTETICA.index("PRUEBA")
+    def grafias(titulo, i, fila):
+        if titulo == "Clínica 1":
+            if fila[estudio] == "QUIMICA SANGUINEA 6 ELEMENTOS":
+                fila[estudio] = ESTUDIO_ABREVIADO
+            if str(fila[prueba]).lower() == "colesterol":
+                fila[prueba] = PRUEBA_DUDOSA
+        return fila
+    return copiar_libro(libro, tmp_path_factory.mktemp("grafias") / "grafias.xlsx", grafias)
+
+@pytest.mark.parametrize("tipo, valor, estado, sinonimo", [
+    ("estudio", ESTUDIO_ABREVIADO, "aplicada", "QUIMICA SANGUINEA 6 ELEMENTOS"),
+    ("estudio", "EXAMEN GENERAL ORINA", "aplicada", "EXAMEN GENERAL DE ORINA"),
+    ("prueba", PRUEBA_DUDOSA, "revisar", "colesterol"),
+    ("prueba", "xyzzy", "sin_parecido", None),
+])
+def test_decision_por_puntaje(tipo, valor, estado, sinonimo):
+    decision = C.decidir_canon_difusa(tipo, valor)
+    assert (decision["estado"], decision["sinonimo"]) == (estado, sinonimo)
+    if estado == "aplicada":
+        assert decision["puntaje"] >= C.UMBRAL_CANON_DIFUSA
+    elif estado == "revisar":
+        assert C.UMBRAL_CANON_REVISION <= decision["puntaje"] < C.UMBRAL_CANON_DIFUSA
+
+def test_canonizar_registra_solo_lo_difuso():
+    registro, decisiones = [], C.nuevas_decisiones_canon()
+    assert C.canonizar("estudio", "Química Sanguínea 6 Elementos", registro, decisiones) == "QS6"
+    assert C.canonizar("prueba", "xyzzy", registro, decisiones) == "xyzzy"
+    assert registro == []
+    assert C.canonizar("estudio", ESTUDIO_ABREVIADO, registro, decisiones) == "QS6"
+    assert C.canonizar("prueba", f" {PRUEBA_DUDOSA} ", registro, decisiones) == PRUEBA_DUDOSA
+    assert [(r["tipo"], r["valor"], r["estado"], r["canonico"]) for r in registro] == [
+        ("estudio", ESTUDIO_ABREVIADO, "aplicada", "QS6"),
+        ("prueba", PRUEBA_DUDOSA, "revisar", "Colesterol")]
+    # Cada valor se decide una vez, en el almacén que se pasó
+    assert {t: len(d) for t, d in decisiones.items()} == {"estudio": 1, "prueba": 2}
+
+def test_sin_almacen_solo_sinonimos_exactos():
+    registro = []
+    assert C.canonizar("estudio", "Química Sanguínea 6 Elementos", registro) == "QS6"
+    assert C.canonizar("estudio", ESTUDIO_ABREVIADO, registro) == ESTUDIO_ABREVIADO
+    assert registro == []
+
+@pytest.mark.parametrize("procesos", [None, 2])
+def test_reporte_de_canonizaciones(libro, libro_con_grafias, procesos):
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(str(libro_con_grafias), resumen, fecha_ref=FECHA_REF, procesos=procesos)
+    # La abreviatura aplicada cae en las mismas columnas; la prueba dudosa no alimenta `want`
+    pd.testing.assert_frame_equal(final, C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF))
+    aplicadas = C.canonizaciones(resumen, "aplicada")
+    revisar = C.canonizaciones(resumen, "revisar")
+    assert [(c["tipo"], c["valor"]) for c in aplicadas] == [("estudio", ESTUDIO_ABREVIADO)]
+    assert [(c["tipo"], c["valor"], c["sinonimo"]) for c in revisar] == [("prueba", PRUEBA_DUDOSA, "colesterol")]
+    assert len(C.canonizaciones(resumen)) == 2
+
+def test_cli_avisa_lo_que_hay_que_revisar(libro_con_grafias, tmp_path, capsys):
+    metricas = tmp_path / "metricas.json"
+    codigo = C.main([str(libro_con_grafias), "-o", str(tmp_path / "reporte.csv"), "--sin-cache",
+                     "--fecha-ref", FECHA_REF.isoformat(), "--metricas", str(metricas)])
+    assert codigo == C.SALIDA_OK
+    salida = capsys.readouterr()
+    assert "REVISAR" in salida.err and repr(PRUEBA_DUDOSA) in salida.err
+    assert repr(ESTUDIO_ABREVIADO) in salida.out
+    corrida, = json.loads(metricas.read_text(encoding="utf-8"))["corridas"]
+    estados = {c["valor"]: c["estado"] for c in corrida["canonizacion"]}
+    assert estados == {ESTUDIO_ABREVIADO: "aplicada", PRUEBA_DUDOSA: "revisar"}
+
+@pytest.mark.parametrize("procesos", [None, 2])
+def test_sin_canon_difusa(libro, libro_con_grafias, procesos):
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(str(libro_con_grafias), resumen, fecha_ref=FECHA_REF,
+                                         procesos=procesos, canon_difusa=False)
+    assert C.canonizaciones(resumen) == []
+    # Sin la abreviatura aplicada, las filas de QS6 de Clínica 1 no llegan a sus columnas
+    original = C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF)
+    assert final.shape == original.shape
+    assert (final["Glucosa (QS)"] != original["Glucosa (QS)"]).any()
+
+def test_cache_sin_canon_difusa(libro_con_grafias, tmp_path):
+    ruta = str(libro_con_grafias)
+    C.consolidar_todas_las_hojas(ruta, fecha_ref=FECHA_REF, cache=tmp_path)
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(ruta, resumen, fecha_ref=FECHA_REF, cache=tmp_path, canon_difusa=False)
+    # Sólo la hoja con grafías canonizadas por parecido deja de valer en la caché
+    assert ({h["hoja"]: bool(h.get("desde_cache")) for h in resumen["hojas"]}
+            == {t: t != "Clínica 1" for t in C.llaves_cache_hojas(ruta)})
+    pd.testing.assert_frame_equal(final, C.consolidar_todas_las_hojas(ruta, fecha_ref=FECHA_REF, canon_difusa=False))
+
+def test_cli_sin_canon_difusa(libro_con_grafias, tmp_path, capsys):
+    codigo = C.main([str(libro_con_grafias), "-o", str(tmp_path / "reporte.csv"), "--sin-cache",
+                     "--fecha-ref", FECHA_REF.isoformat(), "--sin-canon-difusa"])
+    assert codigo == C.SALIDA_OK
+    salida = capsys.readouterr()
+    assert "REVISAR" not in salida.err and repr(ESTUDIO_ABREVIADO) not in salida.out
+
+def test_decisiones_se_guardan_una_vez_por_corrida(libro_con_grafias, tmp_path, monkeypatch):
+    escrituras = []
+    guardar = C._guardar_atomico
+    monkeypatch.setattr(C, "_guardar_atomico",
+                        lambda ruta, escribir: (escrituras.append(ruta), guardar(ruta, escribir)))
+    C.consolidar_todas_las_hojas(str(libro_con_grafias), fecha_ref=FECHA_REF, procesos=2, cache=tmp_path)
+    assert escrituras == [C.ruta_decisiones_canon(tmp_path)]
+    guardadas = json.loads(C.ruta_decisiones_canon(tmp_path).read_text(encoding="utf-8"))
+    assert guardadas["prueba"][PRUEBA_DUDOSA]["estado"] == "revisar"
+    assert any(d["estado"] == "aplicada" and d["sinonimo"] == "QUIMICA SANGUINEA 6 ELEMENTOS"
+               for d in guardadas["estudio"].values())
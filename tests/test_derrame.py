@@ -0,0 +1,17 @@
+# tests/test_derrame.py
+# La consolidación fuera de memoria (tablas por hoja derramadas a disco) da el mismo reporte
+# que el pivote original y no deja archivos en el directorio de derrame.
+
+from __future__ import annotations
+
+import pandas as pd
+
+import consolidador as C
+from conftest import FECHA_REF, comparable
+
+def test_fuera_de_memoria(libro, referencia, tmp_path):
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(str(libro), resumen, fecha_ref=FECHA_REF, derrame=tmp_path)
+    pd.testing.assert_frame_equal(comparable(final), referencia)
+    assert resumen["derrame"]["particiones"] > 0
+    assert not any(tmp_path.iterdir())
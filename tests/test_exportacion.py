@@ -0,0 +1,50 @@
+# tests/test_exportacion.py
+# El .xlsx exportado se lee igual con openpyxl y con calamine: mismas celdas que el
+# reporte, hojas partidas en el límite de filas y aviso por los caracteres de control.
+
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+import consolidador as C
+from conftest import FECHA_REF, comparable
+
+LECTORES_EXCEL = ["openpyxl"] + (["calamine"] if "calamine" in C.lectores_disponibles() else [])
+
+@pytest.fixture(scope="module")
+def reporte(libro) -> pd.DataFrame:
+    return C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF)
+
+def _leido(ruta, motor: str) -> dict[str, pd.DataFrame]:
+    hojas = pd.read_excel(ruta, sheet_name=None, dtype=str, keep_default_na=False, engine=motor)
+    return {nombre: comparable(df) for nombre, df in hojas.items()}
+
+@pytest.mark.parametrize("motor", LECTORES_EXCEL)
+def test_ida_y_vuelta(reporte, tmp_path, motor):
+    ruta = tmp_path / "reporte.xlsx"
+    eventos = []
+    C.exportar(reporte, ruta, progreso=eventos.append)
+    assert eventos[-1] == {"evento": "exportacion", "filas": len(reporte), "total": len(reporte), "formato": "xlsx"}
+    leido, = _leido(ruta, motor).values()
+    pd.testing.assert_frame_equal(leido, comparable(reporte))
+
+@pytest.mark.parametrize("motor", LECTORES_EXCEL)
+def test_hojas_partidas_en_el_limite(reporte, tmp_path, motor, monkeypatch):
+    monkeypatch.setattr(C, "FILAS_MAX_HOJA_EXCEL", 61)
+    monkeypatch.setattr(C, "FILAS_POR_LOTE_EXPORTACION", 25)
+    ruta = tmp_path / "reporte.xlsx"
+    C.exportar_excel(reporte.head(150), ruta)
+    hojas = _leido(ruta, motor)
+    assert list(hojas) == ["REPORTE", "REPORTE_2", "REPORTE_3"]
+    assert [len(h) for h in hojas.values()] == [60, 60, 30]
+    pd.testing.assert_frame_equal(pd.concat(hojas.values(), ignore_index=True), comparable(reporte.head(150)))
+
+def test_caracteres_de_control(tmp_path):
+    df = pd.DataFrame({"nombre": ["ANA\x01", "LUIS", "\x0bEVA\x1f"], "nota": ["a\tb", "", None]})
+    ruta = tmp_path / "control.xlsx"
+    with pytest.warns(UserWarning, match=r"de 2 celda\(s\) \(nombre: 2\)"):
+        C.exportar_excel(df, ruta)
+    leido = pd.read_excel(ruta, dtype=str, keep_default_na=False)
+    assert leido["nombre"].tolist() == ["ANA", "LUIS", "EVA"]
+    assert leido["nota"].tolist() == ["a\tb", "", ""]
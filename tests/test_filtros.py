@@ -0,0 +1,107 @@
+# tests/test_filtros.py
+# Los filtros en memoria (indices_filtro + filtrar) y sobre la base SQLite (consultar_base,
+# contar_base) eligen las mismas filas, en el mismo orden, que un filtro directo en pandas.
+
+from __future__ import annotations
+import sqlite3
+from functools import partial
+
+import pandas as pd
+import pytest
+
+import consolidador as C
+from conftest import FECHA_REF, comparable
+
+@pytest.fixture(scope="module")
+def reporte(libro) -> pd.DataFrame:
+    final = C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF)
+    final.loc[final.index[::9], "edad"] = pd.NA  # edades vacías para el orden con nulos
+    return final
+
+@pytest.fixture(scope="module")
+def base(reporte, tmp_path_factory) -> tuple:
+    ruta = tmp_path_factory.mktemp("base") / "resultados.sqlite"
+    return ruta, C.guardar_en_base(reporte, ruta, "prueba")
+
+def _filtro_directo(df: pd.DataFrame, filtros: dict) -> pd.DataFrame:
+    """El mismo filtro escrito fila a fila, sin índices ni SQL."""
+    mascara = pd.Series(True, index=df.index)
+    for col in C.COLUMNAS_FILTRO_CATEGORIA:
+        if filtros.get(col):
+            mascara &= df[col].astype(object).isin(filtros[col])
+    fecha = df["fecha_evento"].astype(str)
+    if filtros.get("fecha_desde"):
+        mascara &= (fecha != "") & (fecha >= filtros["fecha_desde"])
+    if filtros.get("fecha_hasta"):
+        mascara &= (fecha != "") & (fecha <= filtros["fecha_hasta"])
+    if filtros.get("nombre"):
+        prefijo = C.clave_nombre(filtros["nombre"])
+        mascara &= df["nombre"].astype(str).map(lambda n: C.clave_nombre(n).startswith(prefijo))
+    for col in filtros.get("con_valor") or []:
+        mascara &= df[col].fillna("").astype(str).str.strip() != ""
+    return df[mascara]
+
+FILTROS = [
+    {},
+    {"servicio_norm": ["consulta externa"]},
+    {"sexo": ["F"], "mayor_18": ["Sí"]},
+    {"sexo": ["F", "M"], "servicio_norm": ["urgencia general", "no existe"]},
+    {"fecha_desde": "2023-01-01", "fecha_hasta": "2023-06-30"},
+    {"fecha_hasta": "2022-12-31"},
+    {"nombre": "  María"},
+    {"nombre": "ana r", "fecha_desde": "2022-06-01"},
+    {"con_valor": ["Glucosa (QS)", "Urea (QS)"]},
+    {"servicio_norm": [], "nombre": "", "fecha_desde": None, "con_valor": ["Nitritos (EGO)"]},
+]
+
+@pytest.mark.parametrize("filtros", FILTROS)
+def test_memoria_y_base_coinciden(reporte, base, filtros):
+    esperado = comparable(_filtro_directo(reporte, filtros))
+    posiciones = C.filtrar(C.indices_filtro(reporte), filtros)
+    en_memoria = reporte if posiciones is None else reporte.iloc[posiciones]
+    pd.testing.assert_frame_equal(comparable(en_memoria), esperado)
+    ruta, resultado = base
+    pd.testing.assert_frame_equal(comparable(C.consultar_base(ruta, resultado, filtros)), esperado)
+    assert C.contar_base(ruta, resultado, filtros) == len(esperado)
+
+def test_filtros_no_triviales(reporte):
+    filas = [len(_filtro_directo(reporte, f)) for f in FILTROS]
+    assert all(0 < n < len(reporte) for n in filas[1:])
+
+def test_valores_filtro(reporte, base):
+    assert C.valores_filtro_base(*base) == C.valores_filtro(C.indices_filtro(reporte))
+
+@pytest.mark.parametrize("orden", ["edad", "nombre", "fecha_evento", "Glucosa (QS)"])
+@pytest.mark.parametrize("ascendente", [True, False])
+def test_orden_con_nulos_al_final(reporte, base, orden, ascendente):
+    filtros = {"servicio_norm": ["urgencia general"]}
+    esperado = (_filtro_directo(reporte, filtros)
+                .sort_values(orden, ascending=ascendente, kind="stable", na_position="last"))
+    obtenido = C.consultar_base(*base, filtros, orden=orden, ascendente=ascendente)
+    assert obtenido["id_trabajador"].tolist() == esperado["id_trabajador"].tolist()
+
+def test_pagina(reporte, base):
+    esperado = comparable(reporte.iloc[40:65])
+    pd.testing.assert_frame_equal(comparable(C.consultar_base(*base, limite=25, desplazamiento=40)), esperado)
+
+def test_filtro_desconocido(reporte, base):
+    with pytest.raises(ValueError, match="Filtro desconocido"):
+        C.filtrar(C.indices_filtro(reporte), {"color": ["rojo"]})
+    with pytest.raises(ValueError, match="Filtro desconocido"):
+        C.consultar_base(*base, {"color": ["rojo"]})
+
+def test_base_ocupada_conserva_el_error(reporte, tmp_path, monkeypatch):
+    ruta = tmp_path / "resultados.sqlite"
+    C.guardar_en_base(reporte.head(10), ruta, "primero")
+    otra = sqlite3.connect(ruta, isolation_level=None)
+    otra.execute("BEGIN IMMEDIATE")
+    monkeypatch.setattr(C.sqlite3, "connect", partial(sqlite3.connect, timeout=0))
+    try:
+        for escribir in (lambda: C.guardar_en_base(reporte.head(10), ruta, "segundo"),
+                         lambda: C.borrar_resultado(ruta, 1)):
+            with pytest.raises(sqlite3.OperationalError, match="locked"):
+                escribir()
+    finally:
+        otra.execute("ROLLBACK")
+        otra.close()
+    assert [r["nombre"] for r in C.listar_resultados(ruta)] == ["primero"]
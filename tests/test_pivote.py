@@ -0,0 +1,21 @@
+# tests/test_pivote.py
+# El pivote y la consolidación vectorizados, en la corrida secuencial, dan el mismo reporte
+# que el pivote original fila por fila.
+
+from __future__ import annotations
+
+import pandas as pd
+
+import consolidador as C
+from conftest import FECHA_REF, comparable
+
+def test_referencia_no_trivial(referencia):
+    # El libro sintético debe llenar varias columnas de `want`
+    assert len(referencia) > 50
+    assert sum((referencia[nombre] != "").any() for nombre, _ in C.want) >= 8
+
+def test_secuencial(libro, referencia):
+    resumen = {}
+    final = C.consolidar_todas_las_hojas(str(libro), resumen, fecha_ref=FECHA_REF)
+    pd.testing.assert_frame_equal(comparable(final), referencia)
+    assert not resumen.get("errores")
@@ -0,0 +1,13 @@
+# tests/test_procesos.py
+# Las hojas procesadas en un pool de procesos dan el mismo reporte que el pivote original.
+
+from __future__ import annotations
+
+import pandas as pd
+
+import consolidador as C
+from conftest import FECHA_REF, comparable
+
+def test_pool_de_procesos(libro, referencia):
+    final = C.consolidar_todas_las_hojas(str(libro), fecha_ref=FECHA_REF, procesos=2)
+    pd.testing.assert_frame_equal(comparable(final), referencia)
@@ -0,0 +1,25 @@
+# tests/test_varios_libros.py
+# Varios libros a la vez, en pool de procesos o agregados uno por uno al almacén, dan el
+# mismo reporte que el pivote original sobre todas sus hojas, en el orden de los libros.
+
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+import consolidador as C
+from conftest import FECHA_REF, comparable, reporte_de_referencia
+
+@pytest.mark.parametrize("orden", [0, 1])
+def test_varios_libros(libro, otro_libro, orden, tmp_path):
+    paths = [libro, otro_libro][::1 if orden == 0 else -1]
+    referencia = comparable(reporte_de_referencia(paths))
+    resumen = {}
+    final = C.consolidar_libros(paths, resumen, fecha_ref=FECHA_REF, procesos=2)
+    pd.testing.assert_frame_equal(comparable(final), referencia)
+    assert resumen["grupos_fusionados"] > 50
+    # Agregado libro por libro: mismo reporte, salvo los ids (las filas ya vistas conservan el suyo)
+    C.consolidar_incremental(paths[:1], tmp_path, fecha_ref=FECHA_REF)
+    incremental = C.consolidar_incremental(paths[1:], tmp_path, fecha_ref=FECHA_REF)
+    pd.testing.assert_frame_equal(comparable(incremental).drop(columns="id_trabajador"),
+                                  referencia.drop(columns="id_trabajador"))